@@ -0,0 +1,227 @@
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+SYNTHETIC_PARAMETERS = {
+    # parameter: (unit, mean, seasonal amplitude, noise)
+    'temperature': ('°C', 18.0, 4.0, 0.8),
+    'salinity': ('PSU', 35.0, 0.6, 0.2),
+    'ph': ('pH', 8.08, 0.04, 0.02),
+    'dissolved_oxygen': ('mg/L', 6.5, 1.2, 0.9),
+    'chlorophyll': ('mg/m³', 1.5, 0.8, 0.4),
+    'turbidity': ('NTU', 3.0, 1.0, 0.8),
+}
+
+SYNTHETIC_REGIONS = ['pacific', 'atlantic', 'indian', 'arctic', 'southern']
+
+
+@contextmanager
+def benchmark_database(path=None):
+    # Builds a throwaway on-disk database with the current schema so
+    # benchmarks never touch the real database.
+    # File caches derived from the data are redirected alongside it and
+    # Django caches are replaced by empty in-memory ones.
+    tmpdir = tempfile.mkdtemp(prefix='agroai-bench-')
+    if path is None:
+        path = os.path.join(tmpdir, 'bench.sqlite3')
+    connection.settings_dict.setdefault('TEST', {})['NAME'] = path
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        caches = {
+            alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'bench-{alias}'}
+            for alias in settings.CACHES
+        }
+        with override_settings(OCEAN_SERIES_CACHE_DIR=os.path.join(tmpdir, 'series'), CACHES=caches):
+            yield path
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def generate_ocean_data(user, count, regions=None, parameters=None, start=None,
+                        interval=timedelta(minutes=10), seed=0, batch_size=20000):
+    # Inserts `count` synthetic readings spread round-robin over the given
+    # regions and parameters. Values follow a seasonal cycle plus noise and
+    # a slow warming trend so analyses have something real to find.
+    # Uses executemany rather than model instances so 10^7 rows are feasible.
+    from data.models import OceanData
+    from data.spatial import grid_cell
+
+    rng = random.Random(seed)
+    regions = regions or SYNTHETIC_REGIONS
+    parameters = parameters or list(SYNTHETIC_PARAMETERS)
+    start = start or datetime(2015, 1, 1, tzinfo=dt_timezone.utc)
+    pairs = [(region, parameter) for region in regions for parameter in parameters]
+
+    table = OceanData._meta.db_table
+    columns = ['user_id', 'region', 'parameter', 'value', 'unit', 'timestamp',
+               'latitude', 'longitude', 'depth', 'grid_cell', 'created_at']
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(table),
+        ', '.join(connection.ops.quote_name(column) for column in columns),
+        ', '.join(['%s'] * len(columns)),
+    )
+    adapt = connection.ops.adapt_datetimefield_value
+    created_at = adapt(datetime.now(dt_timezone.utc))
+    year_seconds = 365.25 * 86400
+
+    inserted = 0
+    with connection.cursor() as cursor:
+        while inserted < count:
+            rows = []
+            for i in range(inserted, min(count, inserted + batch_size)):
+                region, parameter = pairs[i % len(pairs)]
+                unit, mean, amplitude, noise = SYNTHETIC_PARAMETERS[parameter]
+                timestamp = start + interval * (i // len(pairs))
+                elapsed = (timestamp - start).total_seconds() / year_seconds
+                value = (mean + amplitude * _season(elapsed) + 0.02 * mean * elapsed / 10
+                         + rng.gauss(0, noise))
+                latitude, longitude = round(rng.uniform(-60, 60), 4), round(rng.uniform(-180, 180), 4)
+                rows.append((
+                    user.pk, region, parameter, round(value, 4), unit, adapt(timestamp),
+                    latitude, longitude, round(rng.uniform(0, 200), 1),
+                    grid_cell(latitude, longitude), created_at,
+                ))
+            with transaction.atomic():
+                cursor.executemany(sql, rows)
+            inserted += len(rows)
+    return inserted
+
+
+def _season(elapsed_years):
+    return math.sin(2 * math.pi * elapsed_years)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def latency_summary(samples):
+    # Summarizes a list of durations in seconds as milliseconds
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3) if samples else 0.0,
+    }
+
+
+# Upper bounds in milliseconds of the latency histogram buckets
+HISTOGRAM_BOUNDS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def latency_histogram(samples):
+    # Counts of durations in seconds per bucket, keyed by the bucket's upper
+    # bound in milliseconds ('+Inf' for the rest)
+    counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for sample in samples:
+        ms = sample * 1000
+        index = next((i for i, bound in enumerate(HISTOGRAM_BOUNDS_MS) if ms <= bound), len(HISTOGRAM_BOUNDS_MS))
+        counts[index] += 1
+    labels = [f'le_{bound}ms' for bound in HISTOGRAM_BOUNDS_MS] + ['+Inf']
+    return dict(zip(labels, counts))
+
+
+def latency_report(samples):
+    # latency_summary() plus the histogram
+    return dict(latency_summary(samples), histogram=latency_histogram(samples))
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2, min_delta_ms=1.0):
+    # Regressions of results against a baseline of the same shape: any
+    # p50/p95/p99 more than `tolerance` and `min_delta_ms` slower (so
+    # sub-millisecond jitter is not flagged), or any *_per_second figure
+    # more than `tolerance` lower. Returns a list of
+    # {'metric', 'baseline', 'current', 'change'}.
+    regressions = []
+
+    def walk(current, previous, path):
+        if isinstance(current, dict) and isinstance(previous, dict):
+            for key, value in current.items():
+                if key in previous:
+                    walk(value, previous[key], path + [key])
+            return
+        if not isinstance(current, (int, float)) or not isinstance(previous, (int, float)) or not previous:
+            return
+        key = path[-1]
+        change = (current - previous) / previous
+        if key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            regressed = change > tolerance and current - previous > min_delta_ms
+        elif key.endswith('_per_second'):
+            regressed = change < -tolerance
+        else:
+            return
+        if regressed:
+            regressions.append({
+                'metric': '.'.join(path),
+                'baseline': previous,
+                'current': current,
+                'change': round(change, 3),
+            })
+
+    walk(results, baseline, [])
+    return regressions
+
+
+class Timer:
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.started
+
+
+def resident_memory():
+    # Current resident set size in bytes, or None off Linux
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class PeakMemory:
+    # Samples the resident set size on a thread while the block runs.
+    # ru_maxrss cannot be reset, so it would report earlier peaks, like
+    # the one from generating the data.
+    def __init__(self, interval=0.01):
+        self.interval = interval
+
+    def __enter__(self):
+        self.baseline = self.peak = resident_memory() or 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, resident_memory() or 0)
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, resident_memory() or 0)
+
+    def report(self):
+        return {
+            'baseline_mb': round(self.baseline / 2 ** 20, 1),
+            'peak_mb': round(self.peak / 2 ** 20, 1),
+            'growth_mb': round((self.peak - self.baseline) / 2 ** 20, 1),
+        }
@@ -0,0 +1,152 @@
+import atexit
+import contextvars
+import functools
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+
+# Alias of the read-only connections in the production profile
+READ_ALIAS = 'read'
+
+# Pragmas that only a writer may set; they persist in the database file
+WRITER_PRAGMAS = ('journal_mode',)
+
+
+def configure_connection(sender, connection, **kwargs):
+    # connection_created receiver: applies settings.SQLITE_PRAGMAS to every
+    # new SQLite connection. Read-only aliases skip the pragmas that change
+    # the file and get query_only, so a write routed there by mistake fails
+    # rather than competing for the write lock.
+    if connection.vendor != 'sqlite':
+        return
+    read_only = getattr(connection, 'read_only', False)
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            if read_only and name in WRITER_PRAGMAS:
+                continue
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+
+
+class ReadOnlyRouter:
+    # Sends reads to the read-only connections of READ_ALIAS and writes to
+    # the default database. Reads inside a transaction of the default
+    # database stay on it, so they see that transaction's own writes.
+    # Both aliases open the same file, so any relation is allowed.
+
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class WriteQueue:
+    # Single writer of the process. Functions submitted from any thread
+    # run one at a time, in the order queued, each in its own transaction,
+    # on a background thread that keeps one connection to the database.
+    # Threads of one process then never compete for SQLite's write lock;
+    # other processes still do, and wait for it through busy_timeout.
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.jobs = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, func, *args, **kwargs):
+        # Returns a concurrent.futures.Future of func's result. Runs in a
+        # copy of the caller's context, so per-request state such as the
+        # query counter follows the work.
+        future = Future()
+        context = contextvars.copy_context()
+        self.jobs.put((future, functools.partial(context.run, func, *args, **kwargs)))
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                    self.thread.start()
+        return future
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            future, func = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with transaction.atomic(using=self.using):
+                    result = func()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                close_old_connections()
+        connections.close_all()
+
+    def stop(self):
+        # Lets queued writes finish, then closes the writer's connection
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.jobs.put(None)
+            thread.join()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_write_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = WriteQueue()
+                atexit.register(_queue.stop)
+    return _queue
+
+
+def reset_write_queue():
+    # Stops the writer after its queued writes, so the next write starts a
+    # new one; for tests and benchmarks
+    global _queue
+    with _queue_lock:
+        writer, _queue = _queue, None
+    if writer is not None:
+        writer.stop()
+        atexit.unregister(writer.stop)
+
+
+def _queued():
+    # Whether a write from this thread goes to the writer thread. Inside a
+    # transaction (which includes the writer thread's own) it joins the
+    # transaction instead.
+    return (getattr(settings, 'DATABASE_WRITE_QUEUE', False)
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block)
+
+
+def write(func, *args, **kwargs):
+    # Runs func in a transaction of the default database and returns its
+    # result: on the writer thread when settings.DATABASE_WRITE_QUEUE is
+    # on, else in this thread. Exceptions reach the caller either way.
+    if _queued():
+        return get_write_queue().submit(func, *args, **kwargs).result()
+    with transaction.atomic():
+        return func(*args, **kwargs)
+
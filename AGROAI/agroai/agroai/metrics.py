@@ -0,0 +1,269 @@
+import bisect
+import contextvars
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+# In-process metrics exported in the Prometheus text format at /metrics.
+# Every metric keeps its values behind its own lock, held only for a dict
+# lookup and an addition, so observing from request threads, executor
+# threads and the event loop is safe and cheap. Values are per process:
+# scrape every worker, or sum them in Prometheus.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds, from a fast cache hit to a slow analysis
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_metrics = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    # Base of the metric types. labels names the label of each value; a
+    # metric given collect is computed at scrape time instead, from a
+    # callable returning a number, or a {label values tuple: number} dict.
+    kind = None
+
+    def __init__(self, name, description, labels=(), collect=None):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.values = {}
+        self.lock = threading.Lock()
+        with _registry_lock:
+            _metrics[:] = [metric for metric in _metrics if metric.name != name]
+            _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        # (suffix, label values, extra labels, value) tuples
+        if self.collect is not None:
+            value = self.collect()
+            if value is None:
+                return []
+            if not isinstance(value, dict):
+                value = {(): value}
+            return [('', key, (), value) for key, value in sorted(value.items())]
+        with self.lock:
+            return [('', key, (), value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labels, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    # Fixed buckets: an observation is one bisect and one increment, and
+    # cumulative counts are only built when scraped
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Bucket counts, then +Inf, then the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        samples = []
+        for key, counts in sorted(values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                samples.append(('_bucket', key, (('le', _format_value(float(bound))),), total))
+            samples.append(('_sum', key, (), counts[-1]))
+            samples.append(('_count', key, (), total))
+        return samples
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_metrics)
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+def reset():
+    # Clears every recorded value; for tests and benchmarks
+    with _registry_lock:
+        metrics = list(_metrics)
+    for metric in metrics:
+        with metric.lock:
+            metric.values.clear()
+
+
+http_request_seconds = Histogram(
+    'agroai_http_request_seconds', 'Time to produce an HTTP response, by view.', labels=('view',))
+http_request_queries = Histogram(
+    'agroai_http_request_queries', 'Database queries run for an HTTP request, by view.',
+    labels=('view',), buckets=QUERY_BUCKETS)
+http_responses_total = Counter(
+    'agroai_http_responses_total', 'HTTP responses, by view and status code.', labels=('view', 'status'))
+chat_stage_seconds = Histogram(
+    'agroai_chat_stage_seconds', 'Time spent in each stage of a chat turn.', labels=('transport', 'stage'))
+chat_turns_total = Counter(
+    'agroai_chat_turns_total', 'Chat messages handled, by transport and outcome.', labels=('transport', 'outcome'))
+chat_shed_total = Counter(
+    'agroai_chat_shed_total', 'Chat messages refused by admission control, by transport and reason.',
+    labels=('transport', 'reason'))
+chat_connections = Gauge('agroai_chat_connections', 'Open chat WebSocket connections.')
+chat_messages_dropped_total = Counter(
+    'agroai_chat_messages_dropped_total', 'Buffered chat messages dropped after repeated failed writes.')
+
+
+# ORM queries per request. The middleware puts a fresh counter in the
+# request's context; sync_to_async and the chat executor copy the context
+# into their threads, so queries made there are counted too. Queries made
+# outside a request, like the message buffer's, are not.
+
+_query_count = contextvars.ContextVar('agroai_query_count', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    # connection_created receiver
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+class MetricsMiddleware:
+    # Times every request and counts its queries. Goes first in MIDDLEWARE
+    # so the time includes the other middleware.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        counter = [0]
+        token = _query_count.set(counter)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_count.reset(token)
+        self.record(request, response, started, counter[0])
+        return response
+
+    async def __acall__(self, request):
+        counter = [0]
+        token = _query_count.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_count.reset(token)
+        self.record(request, response, started, counter[0])
+        return response
+
+    def record(self, request, response, started, queries):
+        # By URL name, so the number of label values stays bounded
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unmatched'
+        http_request_seconds.observe(time.perf_counter() - started, view=view)
+        http_request_queries.observe(queries, view=view)
+        http_responses_total.inc(view=view, status=response.status_code)
+
+
+def metrics_view(request):
+    # Prometheus scrape endpoint, for staff users and scrapers sending
+    # "Authorization: Bearer <METRICS_TOKEN>". METRICS_ALLOWED_IPS is an
+    # opt-in for scrapers that cannot send a token; behind a proxy every
+    # request comes from the proxy's address, so keep it empty there.
+    if request.user.is_staff or _token_matches(request) or (
+            request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ())):
+        return HttpResponse(render(), content_type=CONTENT_TYPE)
+    return HttpResponseForbidden()
+
+
+def _token_matches(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token:
+        return False
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode())
@@ -22,6 +22,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'agroai.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,11 +55,50 @@ ASGI_APPLICATION = 'agroai.asgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'agroai.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {},
     }
 }
 
+# Database profile, from AGROAI_DB_PROFILE. 'development' keeps SQLite's
+# defaults. 'production' applies SQLITE_PRAGMAS to every connection
+# (agroai.database.configure_connection), keeps each thread's connections
+# open, begins transactions with BEGIN IMMEDIATE so they wait for the
+# write lock instead of failing with "database is locked", runs the app's
+# writes on one writer thread per process (DATABASE_WRITE_QUEUE) and
+# sends reads to read-only connections of the same file.
+DB_PROFILE = os.environ.get('AGROAI_DB_PROFILE', 'development')
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 10000,
+    # Negative sizes are in KiB: 64 MiB of page cache per connection
+    'cache_size': -65536,
+    'mmap_size': 256 * 2 ** 20,
+    'temp_store': 'MEMORY',
+}
+SQLITE_PRAGMAS = {}
+DATABASE_WRITE_QUEUE = False
+
+if DB_PROFILE == 'production':
+    SQLITE_PRAGMAS = SQLITE_PRODUCTION_PRAGMAS
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': None,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'timeout': 10, 'transaction_mode': 'IMMEDIATE'},
+    })
+    DATABASES['read'] = {
+        'ENGINE': 'agroai.sqlite',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': None,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'timeout': 10, 'read_only': True},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['agroai.database.ReadOnlyRouter']
+    DATABASE_WRITE_QUEUE = True
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -91,13 +131,89 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Memory-mapped per region/parameter series files; None disables the cache
+OCEAN_SERIES_CACHE_DIR = BASE_DIR / 'cache' / 'series'
+
+# Threads per process computing the parts of questions that name several
+# parameters or regions
+OCEAN_QUERY_WORKERS = 4
+
+# Computed ocean analyses and charts. File-based so every worker process
+# shares hits and invalidations. Tests run with in-memory caches instead,
+# see TEST_RUNNER.
+CACHES = {
+    # Shared by all workers: holds the conversation list and dashboard tile
+    # versions behind the ETags of their APIs, and the cached sessions
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'default',
+    },
+    'analysis': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'analysis',
+        'TIMEOUT': 900,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+OCEAN_ANALYSIS_CACHE = 'analysis'
+
+# Seconds browsers may reuse a dashboard API response before revalidating
+DASHBOARD_MAX_AGE = 60
+
+# Conditional GETs of the conversation list and dashboard read the session
+# without a query
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 # Channels configuration
+# Shared by the ASGI workers of this host through a SQLite file, so a
+# group_send reaches sockets held by other processes
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'BACKEND': 'chat.layers.SQLiteChannelLayer',
+        'CONFIG': {
+            'path': BASE_DIR / 'cache' / 'channels.sqlite3',
+        },
     },
 }
 
+# Per-connection inbound message queue and analysis threads per process
+CHAT_INBOX_SIZE = 8
+CHAT_ANALYSIS_WORKERS = 4
+
+# Write-behind chat message buffer: flush at this many messages or after
+# this many seconds, whichever comes first
+CHAT_MESSAGE_BUFFER_SIZE = 100
+CHAT_MESSAGE_BUFFER_DELAY = 0.05
+# Failed flushes after which a message that cannot be written is dropped
+CHAT_MESSAGE_BUFFER_ATTEMPTS = 5
+
+# Admission control of chat messages, per process: token buckets of each
+# user and each WebSocket connection (messages a second, burst), and the
+# admitted messages that may be unanswered at once. Messages over a limit
+# are refused with a retry-after hint.
+CHAT_USER_RATE = 2.0
+CHAT_USER_BURST = 10
+CHAT_CONNECTION_RATE = 1.0
+CHAT_CONNECTION_BURST = 5
+CHAT_MAX_IN_FLIGHT = 32
+
+# Turns replayed to build the context of a conversation that has none yet
+CHAT_CONTEXT_TURNS = 10
+
+# Conversations idle this long are packed into compressed archives by
+# the archive_conversations command
+CHAT_ARCHIVE_AFTER_DAYS = 30
+
+# /metrics is for staff users and for scrapers sending this bearer token.
+# Addresses listed in METRICS_ALLOWED_IPS may scrape without either; only
+# list them where REMOTE_ADDR is the scraper's own, not a proxy's.
+METRICS_TOKEN = os.environ.get('AGROAI_METRICS_TOKEN')
+METRICS_ALLOWED_IPS = []
+
+# Swaps the file-based caches, channel layer and series cache for
+# throwaway ones and empties them before every test
+TEST_RUNNER = 'agroai.testing.TestRunner'
+
 # Authentication settings
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/chat/'
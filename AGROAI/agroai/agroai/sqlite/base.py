@@ -0,0 +1,44 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # The SQLite backend with two more OPTIONS, read live from the
+    # settings so benchmarks can switch them between runs:
+    #
+    # transaction_mode: how transactions begin, DEFERRED (SQLite's
+    # default), IMMEDIATE or EXCLUSIVE, as in Django 5.1. A deferred
+    # transaction that reads and then writes cannot wait for the write
+    # lock and fails with "database is locked" at once; an immediate one
+    # takes the lock up front and waits up to busy_timeout.
+    #
+    # read_only: the alias only reads. agroai.database.configure_connection
+    # sets query_only on its connections and transactions begin deferred.
+
+    @property
+    def transaction_mode(self):
+        return self.settings_dict['OPTIONS'].get('transaction_mode')
+
+    @property
+    def read_only(self):
+        return bool(self.settings_dict['OPTIONS'].get('read_only'))
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        mode = params.pop('transaction_mode', None)
+        params.pop('read_only', None)
+        if mode is not None and mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"settings.DATABASES['{self.alias}']['OPTIONS']['transaction_mode'] is "
+                f"{mode!r}, expected one of {', '.join(TRANSACTION_MODES)}"
+            )
+        return params
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.transaction_mode
+        if mode is None or self.read_only:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute(f'BEGIN {mode.upper()}')
@@ -0,0 +1,51 @@
+import shutil
+import tempfile
+import unittest
+
+from django.core.cache import caches
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class IsolatedTestResult(unittest.TextTestResult):
+    # Empties every cache and the series cache before each test, so tests
+    # cannot see each other's entries. Primary keys are reused after a
+    # rolled-back test, so a series cached by one test would otherwise
+    # pass for another's data.
+    series_dir = None
+
+    def startTest(self, test):
+        for cache in caches.all():
+            cache.clear()
+        if self.series_dir:
+            shutil.rmtree(self.series_dir, ignore_errors=True)
+        super().startTest(test)
+
+
+class TestRunner(DiscoverRunner):
+    # Runs the tests against in-memory caches and channel layer and a
+    # temporary series cache, so the suite never reads or writes the
+    # file-based ones under BASE_DIR/cache that a development server uses.
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.tmpdir = tempfile.mkdtemp(prefix='agroai-test-')
+        self.series_dir = f'{self.tmpdir}/series'
+        self.overrides = override_settings(
+            CACHES={
+                alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'test-{alias}'}
+                for alias in ('default', 'analysis')
+            },
+            CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+            OCEAN_SERIES_CACHE_DIR=self.series_dir,
+        )
+        self.overrides.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.overrides.disable()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
+
+    def get_resultclass(self):
+        base = super().get_resultclass() or unittest.TextTestResult
+        return type('IsolatedTestResult', (IsolatedTestResult, base), {'series_dir': self.series_dir})
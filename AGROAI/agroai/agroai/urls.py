@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from agroai.metrics import metrics_view
 from chat.views import home, login_view, logout_view, register_view
 
 urlpatterns = [
@@ -12,6 +13,7 @@ urlpatterns = [
     path('register/', register_view, name='register'),
     path('chat/', include('chat.urls')),
     path('data/', include('data.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -1,9 +1,11 @@
 from django.contrib import admin
-from .models import Conversation, Message
+from django.db.models import Q
+from .models import ArchivedConversation, Conversation, Message
+from .search import matching_ids
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ['title', 'user', 'created_at', 'updated_at']
+    list_display = ['title', 'user', 'message_count', 'created_at', 'updated_at']
     list_filter = ['created_at', 'updated_at']
     search_fields = ['title', 'user__username']
 
@@ -13,6 +15,25 @@ class MessageAdmin(admin.ModelAdmin):
     list_filter = ['is_user', 'message_type', 'timestamp']
     search_fields = ['content', 'conversation__title']
 
+    def get_search_results(self, request, queryset, search_term):
+        # Content through the full-text index rather than LIKE '%term%'
+        # over every message; titles are matched on the conversations
+        ids = matching_ids(search_term)
+        if ids is None:
+            return super().get_search_results(request, queryset, search_term)
+        titled = Conversation.objects.filter(title__icontains=search_term.strip()).values('id')
+        return queryset.filter(Q(id__in=ids) | Q(conversation_id__in=titled)), False
+
     def content_preview(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
-    content_preview.short_description = 'Content'
\ No newline at end of file
+    content_preview.short_description = 'Content'
+
+@admin.register(ArchivedConversation)
+class ArchivedConversationAdmin(admin.ModelAdmin):
+    list_display = ['conversation', 'message_count', 'raw_size', 'compressed_size', 'archived_at']
+    readonly_fields = ['conversation', 'dictionary', 'message_count', 'raw_size', 'archived_at']
+    exclude = ['data']
+
+    def compressed_size(self, obj):
+        return len(obj.data)
+    compressed_size.short_description = 'Compressed size'
@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+# Admission control for chat turns, in front of the database writes and
+# analyses a turn costs. A turn is admitted when its connection's and its
+# user's token buckets both have a token and fewer than max_in_flight
+# admitted turns of this process are unfinished; otherwise it is shed at
+# once with the seconds after which a retry should succeed. Everything is
+# in memory and per process, so a rejection costs no query.
+
+# Users whose buckets are kept; the least recently seen are dropped first,
+# which only forgets buckets that have been refilling the longest
+MAX_TRACKED_USERS = 10000
+
+# Settings under which nothing is refused, for benchmarks of throughput
+UNLIMITED_SETTINGS = {
+    'CHAT_USER_RATE': 1e9, 'CHAT_USER_BURST': 10**9,
+    'CHAT_CONNECTION_RATE': 1e9, 'CHAT_CONNECTION_BURST': 10**9,
+    'CHAT_MAX_IN_FLIGHT': 10**9,
+}
+
+
+class TokenBucket:
+    # rate tokens a second, up to burst
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        # Takes a token; returns 0, or the seconds until one is available
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+
+class Rejected(Exception):
+    # reason is 'connection_rate', 'user_rate' or 'capacity'
+    def __init__(self, reason, retry_after):
+        super().__init__(f'Too many messages, please retry in {retry_after:.1f}s.')
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    # An admitted turn; release it when the turn is over
+    def __init__(self, controller):
+        self.controller = controller
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(time.monotonic() - self.started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    def __init__(self, user_rate, user_burst, connection_rate, connection_burst, max_in_flight):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.connection_rate = connection_rate
+        self.connection_burst = connection_burst
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        # Moving average of admitted turn durations, the retry hint when
+        # the process is at capacity
+        self.turn_seconds = 0.5
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    def connection_bucket(self):
+        return TokenBucket(self.connection_rate, self.connection_burst)
+
+    def user_bucket(self, user_key):
+        with self.lock:
+            bucket = self.users.get(user_key)
+            if bucket is None:
+                bucket = self.users[user_key] = TokenBucket(self.user_rate, self.user_burst)
+                if len(self.users) > MAX_TRACKED_USERS:
+                    self.users.popitem(last=False)
+            else:
+                self.users.move_to_end(user_key)
+            return bucket
+
+    def admit(self, user_key, connection_bucket=None):
+        # Returns a Ticket or raises Rejected. Tokens are given back when
+        # the process is at capacity, so clients within their rate are not
+        # also limited for retrying a shed turn.
+        taken = []
+        for reason, bucket in (('connection_rate', connection_bucket), ('user_rate', self.user_bucket(user_key))):
+            if bucket is None:
+                continue
+            wait = bucket.take()
+            if wait:
+                for earlier in taken:
+                    earlier.refund()
+                raise Rejected(reason, wait)
+            taken.append(bucket)
+
+        with self.lock:
+            if self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                return Ticket(self)
+            retry_after = self.turn_seconds
+        for bucket in taken:
+            bucket.refund()
+        raise Rejected('capacity', retry_after)
+
+    def _release(self, seconds):
+        with self.lock:
+            self.in_flight -= 1
+            self.turn_seconds += 0.1 * (seconds - self.turn_seconds)
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission():
+    # The process-wide AdmissionController, built from settings on first use
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    user_rate=getattr(settings, 'CHAT_USER_RATE', 2.0),
+                    user_burst=getattr(settings, 'CHAT_USER_BURST', 10),
+                    connection_rate=getattr(settings, 'CHAT_CONNECTION_RATE', 1.0),
+                    connection_burst=getattr(settings, 'CHAT_CONNECTION_BURST', 5),
+                    max_in_flight=getattr(settings, 'CHAT_MAX_IN_FLIGHT', 32),
+                )
+    return _controller
+
+
+def reset_admission():
+    # Drops the controller so the next turn builds one from the current
+    # settings; for tests and benchmarks
+    global _controller
+    with _controller_lock:
+        _controller = None
+
+
+def in_flight():
+    # Admitted turns not finished yet; None before the first turn
+    return _controller.in_flight if _controller is not None else None
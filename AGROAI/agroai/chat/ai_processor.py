@@ -1,38 +1,72 @@
-import re
-import json
 import random
-from datetime import datetime
+import threading
 from data.data_sources import OceanDataProcessor
+from .context import load_context, resolve
+from .intents import classify
 
 class AgroAIProcessor:
+    # Stateless after construction, so one instance serves every request;
+    # use get_processor() rather than building one per message
+
+    # Intents whose responses read and analyze stored data
+    DATA_INTENTS = ('ocean', 'visualization')
+
     def __init__(self):
         self.ocean_processor = OceanDataProcessor()
-        self.greeting_patterns = [
-            "hi", "hello", "hey", "good morning", "good afternoon", "good evening"
-        ]
-        self.ocean_keywords = [
-            'temperature', 'salinity', 'ph', 'oxygen', 'current', 'wave', 
-            'tide', 'marine', 'ocean', 'sea', 'coastal', 'fishery',
-            'aquaculture', 'algae', 'plankton', 'coral', 'ecosystem'
-        ]
+
+    def route(self, message, conversation=None):
+        # (intent, keyword classification) for a message. A parameter or
+        # topic without any ocean keyword still makes an ocean query unless
+        # a chart was asked for. With a conversation, entities the message
+        # leaves out come from conversation.context, which is updated with
+        # the ones it names; load_context() it first if it may be None.
+        intents = classify(message)
+        if conversation is not None:
+            intents, conversation.context = resolve(intents, message, conversation.context or {})
+        if 'greeting' in intents['intent']:
+            return 'greeting', intents
+        if 'ocean' in intents['intent']:
+            return 'ocean', intents
+        if 'visualization' in intents['intent']:
+            return 'visualization', intents
+        if intents['parameter'] or intents['topic']:
+            return 'ocean', intents
+        return 'general', intents
 
     def process_message(self, message, conversation):
-        message_lower = message.lower()
-        
-        # Check for greetings
-        if any(greeting in message_lower for greeting in self.greeting_patterns):
-            return self._generate_greeting_response()
-        
-        # Check for ocean data queries
-        if any(keyword in message_lower for keyword in self.ocean_keywords):
-            return self._process_ocean_query(message, conversation)
-        
-        # Check for data visualization requests
-        if any(word in message_lower for word in ['graph', 'chart', 'plot', 'visualize', 'show data']):
-            return self._generate_visualization(message)
+        load_context(conversation)
+        intent, intents = self.route(message, conversation)
+        return self.respond(intent, intents, message, conversation)
+
+    def respond(self, intent, intents, message, conversation):
+        return assemble(self.stream(intent, intents, message, conversation))
+
+    def stream_message(self, message, conversation):
+        load_context(conversation)
+        intent, intents = self.route(message, conversation)
+        return self.stream(intent, intents, message, conversation)
+
+    def stream(self, intent, intents, message, conversation):
+        # Yields the response as sections while it is being computed:
+        # {'section', 'content'[, 'data'][, 'transient']}, then one
+        # {'section': 'complete', 'type', ...} item with the response
+        # fields other than content. Transient sections are progress notes
+        # that are not part of the message; see assemble().
+        # Greetings, then ocean data queries, then visualization requests
+        if intent == 'greeting':
+            return self._single_section(self._generate_greeting_response())
+        if intent == 'ocean':
+            return self._stream_ocean_query(message, conversation, intents)
+        if intent == 'visualization':
+            return self._stream_visualization(message, intents)
         
         # Default response
-        return self._generate_general_response(message)
+        return self._single_section(self._generate_general_response(message))
+
+    def _single_section(self, response):
+        response = dict(response)
+        yield {'section': 'text', 'content': response.pop('content')}
+        yield dict(response, section='complete')
 
     def _generate_greeting_response(self):
         greetings = [
@@ -45,29 +79,34 @@ class AgroAIProcessor:
             'type': 'text'
         }
 
-    def _process_ocean_query(self, message, conversation):
+    def _stream_ocean_query(self, message, conversation, intents=None):
+        yield {'section': 'status', 'content': 'Analyzing stored ocean observations...', 'transient': True}
+
         # Analyze the query and provide relevant ocean data
-        analysis = self.ocean_processor.analyze_query(message)
+        analysis = self.ocean_processor.analyze_query(message, matches=intents)
         
         if analysis['has_data']:
-            response_content = f"""
+            yield {'section': 'title', 'content': f"""
 🌊 **Ocean Data Analysis**
 
 **Query:** {message}
 
-**Key Insights:**
+"""}
+            yield {'section': 'insights', 'content': f"""**Key Insights:**
 {analysis['insights']}
 
-**Data Summary:**
+"""}
+            yield {'section': 'summary', 'content': f"""**Data Summary:**
 {analysis['summary']}
 
-**Recommended Actions:**
+"""}
+            yield {'section': 'recommendations', 'content': f"""**Recommended Actions:**
 {analysis['recommendations']}
 
 *Data processed using AgroAI Ocean Intelligence*
-            """
+            """}
         else:
-            response_content = f"""
+            yield {'section': 'text', 'content': f"""
 🔍 **Ocean Research Assistant**
 
 I've analyzed your query about: **{message}**
@@ -87,35 +126,42 @@ While I don't have specific data for this exact request, here's what I can tell
 4. Compare with historical trends
 
 Would you like me to generate sample data visualization for ocean parameters?
-            """
+            """}
         
-        return {
-            'content': response_content,
+        yield {
+            'section': 'complete',
             'type': 'data_analysis',
             'data': analysis.get('data', {})
         }
 
-    def _generate_visualization(self, message):
+    def _stream_visualization(self, message, intents=None):
+        yield {'section': 'status', 'content': 'Preparing chart data...', 'transient': True}
+        if intents is None:
+            intents = classify(message)
+
         # Generate visualization data
-        viz_data = self.ocean_processor.generate_visualization_data(message)
+        viz_data = self.ocean_processor.generate_visualization_data(message, matches=intents, days=intents.get('days'))
+        reduction = viz_data['downsampling']
+        for parameter, points in viz_data['data'].items():
+            yield {'section': 'chart', 'content': '', 'data': {'parameter': parameter, 'points': points}}
         
-        response_content = f"""
+        yield {'section': 'text', 'content': f"""
 📊 **Ocean Data Visualization**
 
 **Generated Chart:** {viz_data['chart_type']}
 
 **Parameters:**
-- Data Points: {viz_data['data_points']}
+- Data Points: {viz_data['data_points']} (reduced from {reduction['original_points']} observations, {reduction['reduction_ratio'] or 1}x)
 - Time Range: {viz_data['time_range']}
 - Parameters Measured: {', '.join(viz_data['parameters'])}
 
 **Visualization Ready!** The chart has been generated showing {viz_data['description']}.
 
 *Tip: You can ask for specific parameters like temperature trends, salinity distribution, or ecosystem metrics.*
-        """
+        """}
         
-        return {
-            'content': response_content,
+        yield {
+            'section': 'complete',
             'type': 'visualization',
             'visualization_data': viz_data
         }
@@ -130,4 +176,31 @@ Would you like me to generate sample data visualization for ocean parameters?
         return {
             'content': random.choice(responses),
             'type': 'text'
-        }
\ No newline at end of file
+        }
+
+
+_processor = None
+_processor_lock = threading.Lock()
+
+
+def get_processor():
+    # The process-wide AgroAIProcessor, built on first use
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                _processor = AgroAIProcessor()
+    return _processor
+
+
+def assemble(sections):
+    # The response dict of a finished stream: the non-transient section
+    # contents joined, plus the fields of the closing 'complete' item
+    parts = []
+    response = {}
+    for section in sections:
+        if section['section'] == 'complete':
+            response = {key: value for key, value in section.items() if key != 'section'}
+        elif not section.get('transient'):
+            parts.append(section['content'])
+    return dict(response, content=''.join(parts))
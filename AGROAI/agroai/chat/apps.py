@@ -2,4 +2,28 @@ from django.apps import AppConfig
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'chat'
\ No newline at end of file
+    name = 'chat'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+        from agroai import metrics
+        from agroai.database import configure_connection
+        from .admission import in_flight
+        from .conversations import bump_saved_conversation
+        from .layers import queue_depth
+        from .models import Conversation
+        from .persistence import pending_messages
+
+        post_save.connect(bump_saved_conversation, sender=Conversation, dispatch_uid='chat.conversation_list_save')
+        post_delete.connect(bump_saved_conversation, sender=Conversation, dispatch_uid='chat.conversation_list_delete')
+        connection_created.connect(metrics.install_query_counter, dispatch_uid='agroai.query_counter')
+        connection_created.connect(configure_connection, dispatch_uid='agroai.configure_connection')
+
+        metrics.Gauge('agroai_channel_layer_queue_depth',
+                      'Channel layer messages delivered to this process and not yet received.',
+                      collect=queue_depth)
+        metrics.Gauge('agroai_chat_pending_messages',
+                      'Chat messages waiting in the write-behind buffer.', collect=pending_messages)
+        metrics.Gauge('agroai_chat_in_flight',
+                      'Chat messages admitted by this process and not answered yet.', collect=in_flight)
@@ -0,0 +1,204 @@
+import json
+import re
+import zlib
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DatabaseError, connection
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from agroai.database import write
+
+from .models import ArchiveDictionary, ArchivedConversation, Conversation, Message
+from .search import optimize_index
+
+# zlib only looks 32 KB back, so a larger dictionary would be cut
+MAX_DICTIONARY_SIZE = 32 * 1024
+LEVEL = 9
+# Messages the dictionary is trained on, newest first
+TRAINING_SAMPLES = 5000
+# Conversations archived per transaction
+BATCH_SIZE = 100
+# Sentences and lines, the units the dictionary is built from
+FRAGMENT = re.compile(r'[^\n.!?]*(?:[.!?]+\s*|\n+)')
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE):
+    # A preset dictionary for zlib from sample messages. zlib has no trainer
+    # like zstd's, so this keeps the sentences and lines that recur across
+    # samples, which for AgroAI replies are the fixed parts of the response
+    # templates, scored by the bytes they would save. The best go last:
+    # zlib codes nearer matches in fewer bits.
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(FRAGMENT.findall(sample)))
+    scored = sorted(
+        ((count - 1) * len(fragment.encode('utf-8')), fragment)
+        for fragment, count in counts.items() if count > 1 and len(fragment.strip()) > 3
+    )
+    chosen = []
+    total = 0
+    for score, fragment in reversed(scored):
+        length = len(fragment.encode('utf-8'))
+        if total + length <= size:
+            chosen.append(fragment)
+            total += length
+    return ''.join(reversed(chosen)).encode('utf-8')
+
+
+def train(limit=TRAINING_SAMPLES):
+    # A new ArchiveDictionary from the latest messages
+    samples = Message.objects.order_by('-id').values_list('content', flat=True)[:limit]
+    return ArchiveDictionary.objects.create(data=train_dictionary(samples))
+
+
+def current_dictionary():
+    return ArchiveDictionary.objects.order_by('-id').first()
+
+
+def pack(messages):
+    # JSON rows of the Message values() dicts, without repeating field names
+    rows = [[m['id'], m['content'], m['is_user'], m['timestamp'].isoformat(), m['message_type']]
+            for m in messages]
+    return json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def unpack(raw):
+    return [
+        {'id': id, 'content': content, 'is_user': is_user,
+         'timestamp': datetime.fromisoformat(timestamp), 'message_type': message_type}
+        for id, content, is_user, timestamp, message_type in json.loads(raw)
+    ]
+
+
+def compress(raw, dictionary):
+    compressor = zlib.compressobj(LEVEL, zdict=bytes(dictionary.data))
+    return compressor.compress(raw) + compressor.flush()
+
+
+def decompress(data, dictionary):
+    decompressor = zlib.decompressobj(zdict=bytes(dictionary.data))
+    return decompressor.decompress(bytes(data)) + decompressor.flush()
+
+
+def idle_conversations(days):
+    # Ids of conversations untouched for days that still have messages in
+    # the Message table
+    cutoff = timezone.now() - timedelta(days=days)
+    return list(
+        Conversation.objects.filter(updated_at__lt=cutoff)
+        .filter(Exists(Message.objects.filter(conversation=OuterRef('pk'))))
+        .order_by('id').values_list('id', flat=True)
+    )
+
+
+def archive_conversations(conversation_ids, dictionary):
+    # Packs the messages of the conversations into ArchivedConversations,
+    # merged with any earlier archive, and deletes them from the Message
+    # table. Only messages read here are deleted, so one written
+    # meanwhile stays behind rather than being lost. Returns totals.
+    # Archived messages leave the full-text index with the table rows, so
+    # search finds them again only once the conversation is rehydrated.
+    totals = {'conversations': 0, 'messages': 0, 'raw_bytes': 0, 'compressed_bytes': 0}
+    for start in range(0, len(conversation_ids), BATCH_SIZE):
+        write(_archive_batch, conversation_ids[start:start + BATCH_SIZE], dictionary, totals)
+    if totals['messages']:
+        optimize_index()
+    return totals
+
+
+def _archive_batch(conversation_ids, dictionary, totals):
+    # One transaction of archive_conversations(); adds to totals
+    grouped = defaultdict(list)
+    for message in (Message.objects.filter(conversation_id__in=conversation_ids)
+                    .order_by('conversation_id', 'timestamp', 'id')
+                    .values('conversation_id', 'id', 'content', 'is_user', 'timestamp', 'message_type')):
+        grouped[message['conversation_id']].append(message)
+    if not grouped:
+        return
+    # Before merging, so only what was just read gets deleted
+    read = [Q(conversation_id=conversation_id, id__lte=max(m['id'] for m in messages))
+            for conversation_id, messages in grouped.items()]
+    earlier = ArchivedConversation.objects.filter(conversation_id__in=list(grouped)).select_related('dictionary')
+    for archive in earlier:
+        grouped[archive.conversation_id][:0] = unpack(decompress(archive.data, archive.dictionary))
+
+    archives = []
+    for conversation_id, messages in grouped.items():
+        raw = pack(messages)
+        data = compress(raw, dictionary)
+        archives.append(ArchivedConversation(
+            conversation_id=conversation_id, dictionary=dictionary, data=data,
+            message_count=len(messages), raw_size=len(raw),
+        ))
+        totals['conversations'] += 1
+        totals['messages'] += len(messages)
+        totals['raw_bytes'] += len(raw)
+        totals['compressed_bytes'] += len(data)
+
+    Message.objects.filter(reduce(or_, read)).delete()
+    ArchivedConversation.objects.filter(conversation_id__in=list(grouped)).delete()
+    ArchivedConversation.objects.bulk_create(archives)
+
+
+def archive_idle_conversations(days=None, dictionary=None):
+    if days is None:
+        days = getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', 30)
+    dictionary = dictionary or current_dictionary() or train()
+    return archive_conversations(idle_conversations(days), dictionary)
+
+
+def rehydrate(conversation):
+    # Moves an archived conversation's messages back into the Message table
+    # with their ids and timestamps, and marks the conversation updated so
+    # the next archive run leaves it be. Returns the number restored. Load
+    # the conversation with select_related('archive') to skip the lookup
+    # when it has no archive.
+    try:
+        conversation.archive
+    except ObjectDoesNotExist:
+        return 0
+    restored = write(_restore, conversation)
+    Conversation.archive.related.delete_cached_value(conversation)
+    return restored
+
+
+def _restore(conversation):
+    archive = (ArchivedConversation.objects.select_for_update().select_related('dictionary')
+               .filter(conversation=conversation).first())
+    if archive is None:
+        return 0
+    messages = [Message(conversation_id=conversation.id, **message)
+                for message in unpack(decompress(archive.data, archive.dictionary))]
+    # Skip any a concurrent rehydration already restored
+    existing = set(Message.objects.filter(conversation=conversation, id__lte=messages[-1].id)
+                   .values_list('id', flat=True)) if messages else set()
+    Message.objects.bulk_create([message for message in messages if message.id not in existing],
+                                batch_size=500)
+    archive.delete()
+    conversation.updated_at = timezone.now()
+    Conversation.objects.filter(id=conversation.id).update(updated_at=conversation.updated_at)
+    return len(messages)
+
+
+def table_bytes(tables):
+    # Bytes of the b-tree pages of the tables and their indexes, or None
+    # where SQLite's dbstat table is unavailable
+    if connection.vendor != 'sqlite':
+        return None
+    placeholders = ', '.join(['%s'] * len(tables))
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(f"""
+                SELECT SUM(pgsize) FROM dbstat WHERE name IN (
+                    SELECT name FROM sqlite_master WHERE tbl_name IN ({placeholders})
+                )
+            """, tables)
+        except DatabaseError:
+            return None
+        return cursor.fetchone()[0] or 0
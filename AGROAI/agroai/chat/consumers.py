@@ -1,23 +1,73 @@
+import asyncio
 import json
+import logging
+import time
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import Conversation, Message
-from .ai_processor import AgroAIProcessor
+from agroai.metrics import chat_connections, chat_shed_total, chat_stage_seconds, chat_turns_total
+from .models import Conversation
+from .admission import Rejected, get_admission
+from .ai_processor import assemble, get_processor
+from .context import load_context
+from .executor import run_in_executor
+from .persistence import flush_messages, save_message
+
+logger = logging.getLogger(__name__)
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    # Messages from a connection go through a bounded inbox drained by one
+    # worker task, so a slow analysis only delays its own connection and
+    # replies keep their order. Replies are streamed as 'chunk' frames
+    # (section, content, seq) followed by a 'final' frame carrying the
+    # assembled response. Analyses run on the chat executor. Messages go to
+    # the process-wide write-behind buffer; only the assembled reply is
+    # saved, after it was sent. The stages of each turn are timed into
+    # agroai_chat_stage_seconds. Admission control limits the connection
+    # and the conversation's owner to their token buckets and the process
+    # to its in-flight turns: admitted messages hold a slot from receive to
+    # reply, refused ones get a 'rate_limited' frame with retry_after.
+
     async def connect(self):
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
         self.room_group_name = f'chat_{self.conversation_id}'
 
+        # Only the conversation's owner may join it
+        self.conversation = None
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        with chat_stage_seconds.time(transport='websocket', stage='fetch'):
+            self.conversation = await Conversation.objects.filter(id=self.conversation_id, user=user).afirst()
+        if self.conversation is None:
+            await self.close()
+            return
+
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
 
+        self.inbox = asyncio.Queue(maxsize=getattr(settings, 'CHAT_INBOX_SIZE', 8))
+        self.rate_limit = get_admission().connection_bucket()
+        self.worker = asyncio.create_task(self.process_inbox())
         await self.accept()
+        chat_connections.inc()
 
     async def disconnect(self, close_code):
+        if getattr(self, 'conversation', None) is None:
+            return
+
+        # Stop answering, then write out what was already said
+        chat_connections.dec()
+        self.worker.cancel()
+        while not self.inbox.empty():
+            _, ticket = self.inbox.get_nowait()
+            ticket.release()
+        await database_sync_to_async(flush_messages)()
+
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -28,19 +78,108 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         message = text_data_json['message']
-        conversation_id = text_data_json['conversation_id']
 
-        # Process message with AgroAI
-        response = await self.process_ai_message(message, conversation_id)
+        # Backpressure: refuse rather than queue without bound
+        if self.inbox.full():
+            chat_turns_total.inc(transport='websocket', outcome='busy')
+            await self.send(text_data=json.dumps({
+                'type': 'busy',
+                'message': message,
+                'error': 'Too many messages in progress, please retry shortly.',
+            }))
+            return
+        try:
+            ticket = get_admission().admit(self.conversation.user_id, self.rate_limit)
+        except Rejected as e:
+            chat_shed_total.inc(transport='websocket', reason=e.reason)
+            chat_turns_total.inc(transport='websocket', outcome='shed')
+            await self.send(text_data=json.dumps({
+                'type': 'rate_limited',
+                'message': message,
+                'reason': e.reason,
+                'retry_after': round(e.retry_after, 2),
+                'error': str(e),
+            }))
+            return
+        self.inbox.put_nowait((message, ticket))
+        with chat_stage_seconds.time(transport='websocket', stage='persist'):
+            save_message(self.conversation, message, is_user=True)
+
+    async def process_inbox(self):
+        # A turn that fails anywhere gets an error frame; the loop goes on
+        # to the next message, since nothing else drains the inbox
+        while True:
+            message, ticket = await self.inbox.get()
+            with ticket:
+                try:
+                    response = await self.stream_reply(message)
+                    with chat_stage_seconds.time(transport='websocket', stage='persist'):
+                        save_message(self.conversation, response['content'], is_user=False,
+                                     message_type=response.get('type', 'text'))
+                except Exception as e:
+                    logger.exception('Could not answer a chat message in conversation %s', self.conversation.id)
+                    chat_turns_total.inc(transport='websocket', outcome='error')
+                    try:
+                        await self.send(text_data=json.dumps({'type': 'error', 'error': str(e)}))
+                    except Exception:
+                        logger.exception('Could not send an error frame in conversation %s', self.conversation.id)
+                    continue
+                chat_turns_total.inc(transport='websocket', outcome='ok')
 
+    async def stream_reply(self, message):
+        # Forwards each section as a numbered chunk frame as soon as the
+        # processor yields it, then a final frame with the whole response.
+        # Routing and canned replies are cheap enough for the event loop;
+        # analysis sections are pulled on the executor.
+        # Analysis and sends interleave, so their times are summed per turn
+        processor = get_processor()
+        if self.conversation.context is None:
+            with chat_stage_seconds.time(transport='websocket', stage='context'):
+                await database_sync_to_async(load_context)(self.conversation)
+        with chat_stage_seconds.time(transport='websocket', stage='route'):
+            intent, intents = processor.route(message, self.conversation)
+            stream = processor.stream(intent, intents, message, self.conversation)
+        offload = intent in processor.DATA_INTENTS
+
+        sections = []
+        analysis = send = 0.0
+        while True:
+            started = time.perf_counter()
+            if offload:
+                section = await run_in_executor(next, stream, None)
+            else:
+                section = next(stream, None)
+            analysis += time.perf_counter() - started
+            if section is None:
+                break
+            sections.append(section)
+            if section['section'] != 'complete':
+                started = time.perf_counter()
+                await self.channel_layer.group_send(self.room_group_name, {
+                    'type': 'chat_chunk',
+                    'chunk': dict(section, seq=len(sections)),
+                })
+                send += time.perf_counter() - started
+
+        response = assemble(sections)
         # Send message to room group
+        started = time.perf_counter()
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
-                'message': response
+                'message': response,
+                'seq': len(sections),
             }
         )
+        send += time.perf_counter() - started
+        chat_stage_seconds.observe(analysis, transport='websocket', stage='analysis')
+        chat_stage_seconds.observe(send, transport='websocket', stage='send')
+        return response
+
+    # Receive a response section from room group
+    async def chat_chunk(self, event):
+        await self.send(text_data=json.dumps(dict(event['chunk'], type='chunk')))
 
     # Receive message from room group
     async def chat_message(self, event):
@@ -48,30 +187,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
+            'type': 'final',
+            'seq': event.get('seq'),
             'message': message
         }))
-
-    @database_sync_to_async
-    def process_ai_message(self, message, conversation_id):
-        conversation = Conversation.objects.get(id=conversation_id)
-        
-        # Save user message
-        user_message = Message.objects.create(
-            conversation=conversation,
-            content=message,
-            is_user=True
-        )
-        
-        # Process with AgroAI
-        ai_processor = AgroAIProcessor()
-        response = ai_processor.process_message(message, conversation)
-        
-        # Save AI response
-        ai_message = Message.objects.create(
-            conversation=conversation,
-            content=response['content'],
-            is_user=False,
-            message_type=response.get('type', 'text')
-        )
-        
-        return response
\ No newline at end of file
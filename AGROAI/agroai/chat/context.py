@@ -0,0 +1,81 @@
+from django.conf import settings
+
+from data.data_sources import TIME_RANGE, TIME_RANGE_DAYS
+from .archive import rehydrate
+from .intents import classify
+from .models import Message
+
+# Entities a follow-up question can leave out ("and salinity there?")
+ENTITIES = ('region', 'parameter', 'topic', 'days')
+
+
+def recent_messages(conversation_id, turns=None):
+    # The user messages of the last `turns` turns, oldest first, read
+    # through the (conversation, timestamp) index without loading the
+    # whole history
+    if turns is None:
+        turns = getattr(settings, 'CHAT_CONTEXT_TURNS', 10)
+    rows = (
+        Message.objects.filter(conversation_id=conversation_id, is_user=True)
+        .order_by('-timestamp', '-id')
+        .values('content', 'timestamp')[:turns]
+    )
+    return list(reversed(rows))
+
+
+def load_context(conversation):
+    # Builds conversation.context for a conversation that has messages
+    # but no context yet (one that predates it) from its recent turns,
+    # rehydrating them first if the conversation was archived. Every later
+    # turn updates the context in place, see resolve().
+    if conversation.context is None:
+        context = {}
+        if conversation.message_count:
+            rows = recent_messages(conversation.id)
+            if not rows and rehydrate(conversation):
+                rows = recent_messages(conversation.id)
+            for row in rows:
+                _, context = resolve(classify(row['content']), row['content'], context)
+        conversation.context = context
+    return conversation.context
+
+
+def time_window_days(message):
+    match = TIME_RANGE.search(message.lower())
+    if not match:
+        return None
+    return int(match.group(1) or 1) * TIME_RANGE_DAYS[match.group(2)]
+
+
+def resolve(intents, message, context):
+    # (intents, context) after a turn. Entities the message names replace
+    # those in the context; entities it leaves out are filled in from the
+    # context, as long as the message is about ocean data at all. The
+    # context holds one value per entity, so this costs the same on the
+    # hundredth turn as on the first.
+    mentioned = {
+        'region': intents['region'],
+        'parameter': intents['parameter'],
+        'topic': intents['topic'],
+        'days': time_window_days(message),
+    }
+    mentioned = {entity: value for entity, value in mentioned.items() if value}
+    if not mentioned and not {'ocean', 'visualization'} & set(intents['intent']):
+        return dict(intents, days=None), context
+
+    resolved = dict(intents, days=mentioned.get('days', context.get('days')))
+    if 'region' not in mentioned and context.get('region'):
+        resolved['region'] = tuple(context['region'])
+    # A named topic stands on its own; only fill in the subject when the
+    # message has neither a parameter nor a topic
+    if 'parameter' not in mentioned and 'topic' not in mentioned:
+        resolved['parameter'] = tuple(context.get('parameter', ()))
+        resolved['topic'] = tuple(context.get('topic', ()))
+
+    context = dict(context, **{entity: list(value) if isinstance(value, tuple) else value
+                               for entity, value in mentioned.items()})
+    if 'parameter' in mentioned or 'topic' in mentioned:
+        # The new subject replaces the old one entirely
+        context['parameter'] = list(mentioned.get('parameter', ()))
+        context['topic'] = list(mentioned.get('topic', ()))
+    return resolved, context
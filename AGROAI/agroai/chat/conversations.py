@@ -0,0 +1,59 @@
+import uuid
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+
+from data.queries import decode_cursor, encode_cursor
+from .models import Conversation
+
+VERSION_PREFIX = 'conversation-list-version'
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+FIELDS = ('id', 'title', 'updated_at', 'message_count', 'last_message_preview', 'last_message_at')
+
+
+def _version_key(user_id):
+    return f'{VERSION_PREFIX}:{user_id}'
+
+
+def list_version(user_id):
+    # Opaque token for the user's conversation list, changed on every write
+    # that can change the list. Kept in the default cache so it must
+    # be shared by all workers; a token lost to eviction comes back as a
+    # new value, which only costs clients one full response.
+    return caches['default'].get_or_set(_version_key(user_id), _new_version, timeout=None)
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def bump_list_versions(user_ids):
+    versions = {_version_key(user_id): _new_version() for user_id in user_ids}
+    if versions:
+        caches['default'].set_many(versions, timeout=None)
+
+
+def conversations_page(user, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    # Keyset page over the (user, updated_at, id) index, most recently
+    # updated first. Raises data.queries.InvalidQuery for a bad cursor.
+    queryset = Conversation.objects.filter(user=user)
+    if cursor:
+        updated_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(updated_at__lte=updated_at).filter(
+            Q(updated_at__lt=updated_at) | Q(id__lt=pk)
+        )
+    rows = list(queryset.order_by('-updated_at', '-id').values(*FIELDS)[:limit + 1])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['updated_at'], rows[-1]['id'])
+    return rows, next_cursor
+
+
+def bump_saved_conversation(sender, instance, **kwargs):
+    # post_save/post_delete receiver: new, renamed and deleted conversations
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_list_versions([user_id]))
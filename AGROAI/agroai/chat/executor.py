@@ -0,0 +1,44 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    # Bounded pool for CPU-bound chat work (analysis, chart building),
+    # kept apart from the default executor that sync_to_async and the
+    # async ORM use
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'CHAT_ANALYSIS_WORKERS', 4),
+                    thread_name_prefix='chat-analysis',
+                )
+    return _executor
+
+
+def _call(func, args, kwargs):
+    # Worker threads outlive requests, so drop connections that have gone
+    # stale or exceeded CONN_MAX_AGE around each call
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_executor(func, *args, **kwargs):
+    # In a copy of the caller's context, like sync_to_async, so per-request
+    # state such as the query counter follows the work
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(context.run, _call, func, args, kwargs))
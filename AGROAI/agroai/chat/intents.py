@@ -0,0 +1,25 @@
+from data.keywords import OCEAN_KEYWORDS, KeywordMatcher, merge_tables
+
+# Intent keywords of AgroAIProcessor.process_message, matched on word
+# boundaries. Priority when several match: greeting, ocean, visualization.
+CHAT_KEYWORDS = {
+    'intent': [
+        ('greeting', ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening']),
+        ('ocean', [
+            'temperature', 'salinity', 'ph', 'oxygen', 'current', 'wave',
+            'tide', 'marine', 'ocean', 'oceanic', 'sea', 'coastal', 'fishery', 'fisheries',
+            'aquaculture', 'algae', 'plankton', 'coral', 'ecosystem',
+        ]),
+        ('visualization', ['graph', 'chart', 'plot', 'visualize', 'visualise', 'show data']),
+    ],
+}
+
+# One automaton for chat intents and the ocean parameters, topics and
+# regions, so a message is scanned once for routing and analysis.
+# Greetings are not nouns and match only as written.
+chat_matcher = KeywordMatcher(merge_tables(CHAT_KEYWORDS, OCEAN_KEYWORDS), exact={'greeting'})
+
+
+def classify(message):
+    # {'intent': [...], 'parameter': [...], 'topic': [...], 'region': [...]}
+    return chat_matcher.match(message)
@@ -0,0 +1,431 @@
+import asyncio
+import errno
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import msgpack
+from channels import DEFAULT_CHANNEL_LAYER
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer, channel_layers
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS channel_message (
+        id INTEGER PRIMARY KEY,
+        owner TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        expires REAL NOT NULL,
+        body BLOB NOT NULL
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS channel_message_owner ON channel_message (owner, id)',
+    'CREATE INDEX IF NOT EXISTS channel_message_channel ON channel_message (channel)',
+    'CREATE INDEX IF NOT EXISTS channel_message_expires ON channel_message (expires)',
+    """
+    CREATE TABLE IF NOT EXISTS channel_group (
+        group_name TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        expires REAL NOT NULL,
+        PRIMARY KEY (group_name, channel)
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS channel_group_channel ON channel_group (channel)',
+]
+# Messages taken per poll
+TAKE_BATCH = 500
+# Unexpired messages of this process (?2, or general ones) on the channels
+# with room, a JSON object of channel -> free slots (?1)
+WAITING_SQL = (
+    "FROM channel_message m JOIN json_each(?1) room ON room.key = m.channel "
+    "WHERE m.owner IN (?2, '') AND m.expires >= ?3"
+)
+# Seconds between sweeps of expired messages and memberships
+SWEEP_INTERVAL = 5.0
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    # Channel layer shared by every process on one host through a SQLite
+    # file in WAL mode, for running several ASGI workers without Redis.
+    #
+    # Every process gets a client prefix, and its specific channels
+    # (new_channel()) carry it, so each stored message records the process
+    # that owns its channel. One poller task per process takes all of that
+    # process's messages with a single DELETE ... RETURNING and hands them
+    # to the waiting receive() calls; sends to channels of the same process
+    # skip the database. After writing, a sender wakes the owning processes
+    # with a datagram on their Unix socket, so delivery does not wait for a
+    # poll; without the datagram (lost, or no AF_UNIX) the poller still
+    # finds the message within wake_timeout seconds.
+    #
+    # Messages are serialized with msgpack, as channels_redis does, so they
+    # may contain bytes; tuples come back as lists.
+    #
+    # Capacity: a send is refused (or a group member skipped) when the
+    # channel already has `capacity` messages stored. The poller only takes
+    # messages for channels that are being received on and have room in
+    # their local buffer, and no more than that room, so messages wait in
+    # the database, still counted, rather than piling up in memory.
+    #
+    # Messages expire after `expiry` seconds and a channel with an expired
+    # message leaves its groups, which clears out the channels of processes
+    # that died. Group memberships expire after `group_expiry` seconds.
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 wake_timeout=0.1, wakeups=True, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.wake_timeout = wake_timeout
+        self.wakeups = wakeups and hasattr(socket, 'AF_UNIX')
+        self.client_prefix = uuid.uuid4().hex[:12]
+        # AF_UNIX paths are short, so sockets live in a temp directory
+        # named after the database rather than next to it
+        digest = hashlib.sha1(os.path.abspath(self.path).encode('utf-8')).hexdigest()[:12]
+        self.socket_dir = os.path.join(tempfile.gettempdir(), f'agroai-channels-{digest}')
+
+        self.receive_buffer = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='channel-layer')
+        self.db = None
+        self.last_sweep = 0.0
+        self.poller = None
+        # Future the poller waits on between polls, and whether it was
+        # nudged since its last poll began; see _nudge()
+        self.woken = None
+        self.nudged = False
+        self.wake_socket = None
+        self.send_socket = None
+
+    # Database access, always on the layer's own thread
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _connection(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            self.db = db
+        return self.db
+
+    def _write(self, func, *args):
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            result = func(db, *args)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return result
+
+    def _insert(self, db, rows, strict):
+        # rows: (owner, channel, body). Drops messages for full channels,
+        # or raises ChannelFull when strict. Returns the owners written to.
+        now = time.time()
+        channels = {channel for _, channel, _ in rows}
+        placeholders = ', '.join('?' * len(channels))
+        queued = dict(db.execute(
+            f'SELECT channel, COUNT(*) FROM channel_message WHERE channel IN ({placeholders}) AND expires >= ? '
+            'GROUP BY channel', [*channels, now],
+        ).fetchall())
+        accepted = []
+        for owner, channel, body in rows:
+            if queued.get(channel, 0) >= self.get_capacity(channel):
+                if strict:
+                    raise ChannelFull(channel)
+                continue
+            queued[channel] = queued.get(channel, 0) + 1
+            accepted.append((owner, channel, now + self.expiry, body))
+        db.executemany('INSERT INTO channel_message (owner, channel, expires, body) VALUES (?, ?, ?, ?)', accepted)
+        return {owner for owner, _, _, _ in accepted}
+
+    def _take(self, room):
+        # Removes and returns (channel, body) of the messages waiting for
+        # this process on the channels of `room`, at most room[channel] per
+        # channel, oldest first: those of its specific channels and of the
+        # general channels it is receiving on. Checks with a read first,
+        # which in WAL mode takes no lock, so idle polls do not queue up
+        # behind writers.
+        now = time.time()
+        sweep = now - self.last_sweep > SWEEP_INTERVAL
+        if not room and not sweep:
+            return []
+        params = [json.dumps(room), self.client_prefix, now]
+        waiting = room and self._connection().execute(
+            f'SELECT 1 {WAITING_SQL} LIMIT 1', params,
+        ).fetchone()
+        if not waiting and not sweep:
+            return []
+
+        def take(db):
+            if sweep:
+                self._sweep(db, now)
+            if not waiting:
+                return []
+            return db.execute(
+                f'DELETE FROM channel_message WHERE id IN ('
+                f'SELECT id FROM (SELECT m.id, room.value AS room, '
+                f'ROW_NUMBER() OVER (PARTITION BY m.channel ORDER BY m.id) AS position {WAITING_SQL}) '
+                f'WHERE position <= room ORDER BY id LIMIT {TAKE_BATCH}) RETURNING id, channel, expires, body',
+                params,
+            ).fetchall()
+
+        rows = sorted(self._write(take))
+        return [(channel, body) for _, channel, expires, body in rows if expires >= now]
+
+    def _sweep(self, db, now):
+        self.last_sweep = now
+        db.execute(
+            'DELETE FROM channel_group WHERE channel IN '
+            '(SELECT DISTINCT channel FROM channel_message WHERE expires < ?) OR expires < ?', [now, now],
+        )
+        db.execute('DELETE FROM channel_message WHERE expires < ?', [now])
+
+    def _group_members(self, db, group):
+        return [row[0] for row in db.execute(
+            'SELECT channel FROM channel_group WHERE group_name = ? AND expires >= ?', [group, time.time()],
+        )]
+
+    # Wakeups
+
+    def _socket_path(self, owner):
+        return os.path.join(self.socket_dir, owner)
+
+    def _open_wake_socket(self):
+        if not self.wakeups or self.wake_socket is not None:
+            return
+        os.makedirs(self.socket_dir, mode=0o700, exist_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.bind(self._socket_path(self.client_prefix))
+        self.wake_socket = sock
+
+    def _wake(self, owners):
+        if not self.wakeups:
+            return
+        if self.send_socket is None:
+            self.send_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.send_socket.setblocking(False)
+        for owner in owners:
+            if owner and owner != self.client_prefix:
+                try:
+                    self.send_socket.sendto(b'!', self._socket_path(owner))
+                except OSError as e:
+                    # Gone, or already has wakeups pending: the poll covers it
+                    if e.errno not in (errno.ENOENT, errno.ECONNREFUSED, errno.EAGAIN, errno.ENOBUFS):
+                        raise
+
+    def _nudge(self):
+        # Ends the poller's wait, for a wakeup datagram or for room made in
+        # a local buffer
+        self.nudged = True
+        if self.woken is not None and not self.woken.done():
+            self.woken.set_result(None)
+
+    async def _wait_for_wakeup(self):
+        self.woken = asyncio.get_running_loop().create_future()
+        if self.nudged:
+            self.woken.set_result(None)
+        sock = self.wake_socket
+        if sock is None:
+            await asyncio.wait([self.woken], timeout=self.wake_timeout)
+            return
+        # A reader callback rather than wait_for(sock_recv()), whose
+        # cancellation can hang on Python 3.11
+        loop = asyncio.get_running_loop()
+        loop.add_reader(sock.fileno(), self._nudge)
+        try:
+            await asyncio.wait([self.woken], timeout=self.wake_timeout)
+        finally:
+            loop.remove_reader(sock.fileno())
+        # Several senders may have woken us for the same poll
+        while True:
+            try:
+                sock.recv(64)
+            except BlockingIOError:
+                return
+
+    # Polling
+
+    def _ensure_poller(self):
+        if self.poller is None or self.poller.done() or self.poller.get_loop() is not asyncio.get_running_loop():
+            self._open_wake_socket()
+            self.poller = asyncio.create_task(self._poll())
+
+    def _room(self):
+        # {channel: free slots} of the local buffers that are not full
+        room = {}
+        for channel, queue in list(self.receive_buffer.items()):
+            free = self.get_capacity(channel) - queue.qsize()
+            if free > 0:
+                room[channel] = free
+        return room
+
+    async def _poll(self):
+        while True:
+            self.nudged = False
+            rows = await self._run(self._take, self._room())
+            for channel, body in rows:
+                # Taken within the room counted above; only a local send
+                # since then can have used it up
+                self._deliver(channel, time.time() + self.expiry, unpack(body), limit=False)
+            if len(rows) < TAKE_BATCH:
+                await self._wait_for_wakeup()
+
+    def _deliver(self, channel, expires, message, limit=True):
+        # Into the channel's local buffer; False when it is full
+        queue = self.receive_buffer.setdefault(channel, asyncio.Queue())
+        if limit and queue.qsize() >= self.get_capacity(channel):
+            return False
+        queue.put_nowait((expires, message))
+        return True
+
+    def _owner(self, channel):
+        # Client prefix of the process that owns a specific channel, or ''
+        if '!' not in channel:
+            return ''
+        return channel[:channel.index('!')].rsplit('.', 1)[-1]
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+
+        owner = self._owner(channel)
+        if owner == self.client_prefix:
+            if not self._deliver(channel, time.time() + self.expiry, unpack(pack(message))):
+                raise ChannelFull(channel)
+            return
+        owners = await self._run(self._write, self._insert, [(owner, channel, pack(message))], True)
+        self._wake(owners)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        self._ensure_poller()
+        queue = self.receive_buffer.get(channel)
+        if queue is None:
+            # Messages stored for the channel can be taken now
+            queue = self.receive_buffer[channel] = asyncio.Queue()
+            self._nudge()
+        try:
+            while True:
+                if queue.qsize() >= self.get_capacity(channel):
+                    # Full until this get; more may be waiting in the database
+                    self._nudge()
+                expires, message = await queue.get()
+                if expires >= time.time():
+                    return message
+        except asyncio.CancelledError:
+            # The consumer is gone; nothing else receives on its channel
+            self.receive_buffer.pop(channel, None)
+            raise
+
+    async def new_channel(self, prefix='specific'):
+        return f'{prefix}.{self.client_prefix}!{uuid.uuid4().hex[:12]}'
+
+    async def flush(self):
+        def delete(db):
+            db.execute('DELETE FROM channel_message')
+            db.execute('DELETE FROM channel_group')
+        await self._run(self._write, delete)
+        self.receive_buffer = {}
+
+    async def close(self):
+        if self.poller is not None:
+            self.poller.cancel()
+            if self.poller.get_loop() is asyncio.get_running_loop():
+                try:
+                    await self.poller
+                except asyncio.CancelledError:
+                    pass
+            self.poller = None
+        if self.wake_socket is not None:
+            self.wake_socket.close()
+            self.wake_socket = None
+            try:
+                os.unlink(self._socket_path(self.client_prefix))
+            except OSError:
+                pass
+
+    def queue_depth(self):
+        # Messages delivered to this process and not yet received
+        return sum(queue.qsize() for queue in list(self.receive_buffer.values()))
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+
+        def add(db):
+            db.execute(
+                'INSERT OR REPLACE INTO channel_group (group_name, channel, expires) VALUES (?, ?, ?)',
+                [group, channel, time.time() + self.group_expiry],
+            )
+        await self._run(self._write, add)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), 'Invalid channel name'
+        assert self.valid_group_name(group), 'Invalid group name'
+
+        def discard(db):
+            db.execute('DELETE FROM channel_group WHERE group_name = ? AND channel = ?', [group, channel])
+        await self._run(self._write, discard)
+
+    async def group_send(self, group, message):
+        # Members in this process get the message directly; the others in
+        # one transaction, then one wakeup per process. Full channels miss
+        # the message, as with the other layers.
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Invalid group name'
+        body = pack(message)
+
+        def send(db):
+            remote = []
+            local = []
+            for channel in self._group_members(db, group):
+                owner = self._owner(channel)
+                if owner == self.client_prefix:
+                    local.append(channel)
+                else:
+                    remote.append((owner, channel, body))
+            return local, self._insert(db, remote, False) if remote else set()
+
+        local, owners = await self._run(self._write, send)
+        self._wake(owners)
+        expires = time.time() + self.expiry
+        for channel in local:
+            self._deliver(channel, expires, unpack(body))
+
+
+def pack(message):
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def unpack(body):
+    return msgpack.unpackb(body, raw=False)
+
+
+def queue_depth():
+    # Receive buffer depth of this process's channel layer, or None before
+    # anything used it
+    layer = channel_layers.backends.get(DEFAULT_CHANNEL_LAYER)
+    if layer is None or not hasattr(layer, 'queue_depth'):
+        return None
+    return layer.queue_depth()
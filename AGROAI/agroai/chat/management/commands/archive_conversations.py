@@ -0,0 +1,40 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.archive import archive_idle_conversations, current_dictionary, table_bytes, train
+from chat.persistence import flush_messages
+
+# The Message table with its indexes, and the full-text index over it
+HOT_TABLES = ['chat_message', 'chat_message_fts_data', 'chat_message_fts_idx', 'chat_message_fts_docsize',
+              'chat_message_fts_config']
+
+
+class Command(BaseCommand):
+    help = 'Pack the messages of idle conversations into compressed archives.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', 30),
+                            help='Archive conversations idle for longer than this')
+        parser.add_argument('--retrain', action='store_true',
+                            help='Train a new compression dictionary on the latest messages first')
+
+    def handle(self, *args, **options):
+        flush_messages()
+        dictionary = None if options['retrain'] else current_dictionary()
+        if dictionary is None:
+            dictionary = train()
+            self.stderr.write(f'Trained dictionary {dictionary.id} ({len(dictionary.data)} bytes)')
+
+        before = table_bytes(HOT_TABLES)
+        totals = archive_idle_conversations(options['days'], dictionary)
+        after = table_bytes(HOT_TABLES)
+        report = dict(totals, dictionary=dictionary.id)
+        if totals['compressed_bytes']:
+            report['compression_ratio'] = round(totals['raw_bytes'] / totals['compressed_bytes'], 2)
+        if before is not None:
+            # Freed pages are reused by later writes; VACUUM returns them to
+            # the file system
+            report['hot_table_bytes'] = {'before': before, 'after': after, 'freed': before - after}
+        self.stdout.write(json.dumps(report, indent=2))
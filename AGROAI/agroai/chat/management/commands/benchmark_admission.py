@@ -0,0 +1,155 @@
+import asyncio
+import json
+import random
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from channels.testing import HttpCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from agroai import metrics
+from agroai.benchmarking import benchmark_database, generate_ocean_data, latency_report
+from chat.admission import UNLIMITED_SETTINGS, reset_admission
+from chat.models import Conversation
+from chat.persistence import flush_messages
+from data.series import load_series
+from .benchmark_chat_websocket import PARAMETERS, QUESTIONS, REGIONS
+
+
+class Command(BaseCommand):
+    help = ('Overload process_message with clients that ignore rate limits and compare the latency of '
+            'well-behaved clients with and without admission control.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per run')
+        parser.add_argument('--polite', type=int, default=10, help='Well-behaved users')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Mean seconds between messages of a well-behaved user')
+        parser.add_argument('--abusers', type=int, default=4, help='Users flooding the API')
+        parser.add_argument('--abuser-rate', type=float, default=40,
+                            help='Messages a second each abuser sends, without waiting for replies')
+        parser.add_argument('--points', type=int, default=100000, help='Synthetic observations')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        results = {}
+        with benchmark_database():
+            owner = User.objects.create_user('benchmark', password='benchmark')
+            self.stderr.write(f"Generating {options['points']} observations...")
+            generate_ocean_data(owner, options['points'], regions=[r.lower() for r in REGIONS],
+                                parameters=PARAMETERS, interval=timedelta(minutes=30), seed=options['seed'])
+            for region in REGIONS:
+                for parameter in PARAMETERS:
+                    load_series(region.lower(), parameter)
+
+            self.polite = [self.client_for(f'polite{i}') for i in range(options['polite'])]
+            self.abusers = [self.client_for(f'abuser{i}') for i in range(options['abusers'])]
+
+            # Every turn runs its analysis
+            caches = dict(settings.CACHES)
+            caches[settings.OCEAN_ANALYSIS_CACHE] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+            runs = [
+                ('baseline', {}, False),
+                ('overload_unlimited', UNLIMITED_SETTINGS, True),
+                ('overload_admission', {}, True),
+            ]
+            for name, limits, overload in runs:
+                self.stderr.write(f'Running {name}...')
+                with override_settings(CACHES=caches, **limits):
+                    reset_admission()
+                    metrics.reset()
+                    results[name] = asyncio.run(self.run(options, overload))
+                    results[name]['shed'] = self.shed_counts()
+                flush_messages()
+            reset_admission()
+
+        self.stdout.write(json.dumps({
+            'benchmark': 'admission',
+            'config': {key: options[key] for key in
+                       ('duration', 'polite', 'interval', 'abusers', 'abuser_rate', 'points', 'seed')},
+            'limits': {name: getattr(settings, name) for name in UNLIMITED_SETTINGS},
+            'results': results,
+        }, indent=2))
+
+    def client_for(self, username):
+        # (conversation id, session cookie) of a new user
+        user = User.objects.create_user(username, password='benchmark')
+        conversation = Conversation.objects.create(user=user, title='Benchmark')
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return conversation.id, f'{settings.SESSION_COOKIE_NAME}={session.session_key}'.encode()
+
+    def shed_counts(self):
+        counts = {}
+        for _, key, _, value in metrics.chat_shed_total.samples():
+            transport, reason = key
+            counts[reason] = counts.get(reason, 0) + value
+        return counts
+
+    async def post(self, client, message):
+        from agroai.asgi import application
+        conversation_id, cookie = client
+        communicator = HttpCommunicator(
+            application, 'POST', '/chat/api/process-message/',
+            body=json.dumps({'conversation_id': conversation_id, 'message': message}).encode(),
+            headers=[(b'host', b'localhost'), (b'cookie', cookie), (b'content-type', b'application/json')],
+        )
+        response = await communicator.get_response(timeout=300)
+        return response['status']
+
+    async def run(self, options, overload):
+        deadline = time.perf_counter() + options['duration']
+        polite = {'latencies': [], 'statuses': {}}
+        abusive = {'answered': 0, 'statuses': {}}
+
+        async def polite_client(index):
+            rng = random.Random(options['seed'] + index)
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(rng.expovariate(1 / options['interval']))
+                message = rng.choice(QUESTIONS).format(region=rng.choice(REGIONS))
+                started = time.perf_counter()
+                status = await self.post(self.polite[index], message)
+                polite['statuses'][status] = polite['statuses'].get(status, 0) + 1
+                if status == 200:
+                    polite['latencies'].append(time.perf_counter() - started)
+
+        async def abusive_request(index, message):
+            status = await self.post(self.abusers[index], message)
+            abusive['statuses'][status] = abusive['statuses'].get(status, 0) + 1
+            if status == 200:
+                abusive['answered'] += 1
+
+        async def abuser(index):
+            # Open loop: a new message every 1 / abuser_rate seconds, however
+            # many are unanswered or refused
+            rng = random.Random(options['seed'] + 1000 * (index + 1))
+            requests = []
+            next_send = time.perf_counter()
+            while next_send < deadline:
+                await asyncio.sleep(max(next_send - time.perf_counter(), 0))
+                message = rng.choice(QUESTIONS[:-1]).format(region=rng.choice(REGIONS))
+                requests.append(asyncio.create_task(abusive_request(index, message)))
+                next_send += 1 / options['abuser_rate']
+            await asyncio.gather(*requests)
+
+        clients = [polite_client(i) for i in range(len(self.polite))]
+        if overload:
+            clients += [abuser(i) for i in range(len(self.abusers))]
+        started = time.perf_counter()
+        await asyncio.gather(*clients)
+        elapsed = time.perf_counter() - started
+        return {
+            'elapsed_seconds': round(elapsed, 2),
+            'polite_latency': latency_report(polite['latencies']),
+            'polite_statuses': {str(status): count for status, count in sorted(polite['statuses'].items())},
+            'abusive_answered_per_second': round(abusive['answered'] / elapsed, 1),
+            'abusive_statuses': {str(status): count for status, count in sorted(abusive['statuses'].items())},
+        }
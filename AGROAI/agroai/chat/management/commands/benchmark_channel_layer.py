@@ -0,0 +1,147 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from agroai.benchmarking import latency_summary
+from chat.layers import SQLiteChannelLayer
+from channels.exceptions import ChannelFull
+
+GROUP = 'benchmark'
+
+
+def worker(index, path, options, inbox, results, barrier):
+    # One ASGI worker's worth of sockets: `channels` consumers in a group,
+    # each receiving on its own channel
+    asyncio.run(_worker(index, path, options, inbox, results, barrier))
+
+
+async def _worker(index, path, options, inbox, results, barrier):
+    layer = SQLiteChannelLayer(path, wakeups=options['wakeups'])
+    channels = [await layer.new_channel() for _ in range(options['channels'])]
+    for channel in channels:
+        await layer.group_add(GROUP, channel)
+    results.put(('channels', index, channels))
+    peers = inbox.get()
+    loop = asyncio.get_running_loop()
+
+    # Fan-out: the coordinator's group_sends reach every channel
+    fanout = []
+
+    async def listen(channel, count):
+        for _ in range(count):
+            message = await layer.receive(channel)
+            fanout.append(time.time() - message['sent'])
+
+    listeners = [asyncio.create_task(listen(channel, options['rounds'])) for channel in channels]
+    await loop.run_in_executor(None, barrier.wait)
+    await asyncio.gather(*listeners)
+    await loop.run_in_executor(None, barrier.wait)
+
+    # Throughput: every worker sends to the channels of the next one
+    targets = peers[(index + 1) % len(peers)]
+    received = 0
+    full = 0
+
+    async def drain(channel, count):
+        nonlocal received
+        for _ in range(count):
+            await layer.receive(channel)
+            received += 1
+
+    per_channel = options['messages'] // len(channels)
+    drains = [asyncio.create_task(drain(channel, per_channel)) for channel in channels]
+    await loop.run_in_executor(None, barrier.wait)
+    started = time.perf_counter()
+    for i in range(per_channel * len(targets)):
+        while True:
+            try:
+                await layer.send(targets[i % len(targets)], {'type': 'throughput', 'sent': time.time()})
+                break
+            except ChannelFull:
+                full += 1
+                await asyncio.sleep(0.001)
+    await asyncio.gather(*drains)
+    elapsed = time.perf_counter() - started
+    await layer.close()
+    results.put(('done', index, {'fanout': fanout, 'received': received, 'elapsed': elapsed, 'full': full}))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the SQLite channel layer across worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='4,8', help='Comma-separated worker process counts')
+        parser.add_argument('--channels', type=int, default=25, help='Channels (sockets) per worker')
+        parser.add_argument('--rounds', type=int, default=100, help='group_send calls for the fan-out test')
+        parser.add_argument('--messages', type=int, default=2000, help='Messages each worker sends')
+        parser.add_argument('--interval', type=float, default=0.005, help='Seconds between group_sends')
+
+    def handle(self, *args, **options):
+        results = []
+        for workers in [int(count) for count in options['workers'].split(',')]:
+            for wakeups in (False, True):
+                result = self.run(workers, dict(options, wakeups=wakeups))
+                results.append(result)
+                self.stderr.write(json.dumps(result))
+        self.stdout.write(json.dumps({'benchmark': 'channel_layer', 'results': results}, indent=2))
+
+    def run(self, workers, options):
+        tmpdir = tempfile.mkdtemp(prefix='agroai-layer-')
+        path = os.path.join(tmpdir, 'layer.sqlite3')
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        barrier = context.Barrier(workers + 1)
+        inboxes = [context.Queue() for _ in range(workers)]
+        processes = [
+            context.Process(target=worker, args=(i, path, options, inboxes[i], results, barrier))
+            for i in range(workers)
+        ]
+        try:
+            for process in processes:
+                process.start()
+            peers = [None] * workers
+            for _ in range(workers):
+                _, index, channels = results.get(timeout=60)
+                peers[index] = channels
+            for inbox in inboxes:
+                inbox.put(peers)
+
+            # The coordinator plays the consumer whose reply is fanned out
+            asyncio.run(self.fan_out(path, options, barrier))
+            barrier.wait()
+            barrier.wait()
+            reports = [results.get(timeout=300)[2] for _ in range(workers)]
+        finally:
+            for process in processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        received = sum(report['received'] for report in reports)
+        elapsed = max(report['elapsed'] for report in reports)
+        return {
+            'workers': workers,
+            'channels': workers * options['channels'],
+            'wakeups': options['wakeups'],
+            'fanout_deliveries': sum(len(report['fanout']) for report in reports),
+            'fanout_latency': latency_summary([latency for report in reports for latency in report['fanout']]),
+            'messages': received,
+            'messages_per_second': round(received / elapsed, 1),
+            'channel_full_retries': sum(report['full'] for report in reports),
+        }
+
+    async def fan_out(self, path, options, barrier):
+        layer = SQLiteChannelLayer(path, wakeups=options['wakeups'])
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, barrier.wait)
+        for seq in range(options['rounds']):
+            await layer.group_send(GROUP, {'type': 'chat_chunk', 'seq': seq, 'sent': time.time()})
+            await asyncio.sleep(options['interval'])
+        await layer.close()
@@ -0,0 +1,101 @@
+import json
+import random
+import zlib
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from agroai.benchmarking import Timer, benchmark_database, generate_ocean_data, latency_summary
+from chat.ai_processor import AgroAIProcessor
+from chat.archive import (
+    LEVEL, archive_idle_conversations, decompress, rehydrate, table_bytes, train, unpack,
+)
+from chat.models import ArchivedConversation, Conversation, Message
+from chat.persistence import write_messages
+from .archive_conversations import HOT_TABLES
+from .benchmark_chat_websocket import PARAMETERS, QUESTIONS, REGIONS
+
+
+class Command(BaseCommand):
+    help = 'Benchmark archiving idle conversations: compression, hot-table size and rehydration.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=500)
+        parser.add_argument('--turns', type=int, default=10, help='Question and reply pairs per conversation')
+        parser.add_argument('--rehydrate', type=int, default=50, help='Archived conversations to reopen')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            user = User.objects.create_user('benchmark')
+            generate_ocean_data(user, 20000, regions=[r.lower() for r in REGIONS], parameters=PARAMETERS,
+                                interval=timedelta(hours=1), seed=options['seed'])
+            self.stderr.write(f"Generating {options['conversations']} conversations...")
+            self.generate(user, options)
+
+            results = {'conversations': options['conversations'], 'messages': Message.objects.count()}
+            before = table_bytes(HOT_TABLES)
+            with Timer() as timer:
+                dictionary = train()
+            results['dictionary_bytes'] = len(dictionary.data)
+            results['train_seconds'] = round(timer.elapsed, 3)
+            with Timer() as timer:
+                totals = archive_idle_conversations(dictionary=dictionary)
+            results['archive_seconds'] = round(timer.elapsed, 3)
+            after = table_bytes(HOT_TABLES)
+
+            # The same blobs without the dictionary, for comparison
+            plain = 0
+            for archive in ArchivedConversation.objects.select_related('dictionary'):
+                plain += len(zlib.compress(decompress(archive.data, archive.dictionary), LEVEL))
+            results['storage'] = {
+                'packed_bytes': totals['raw_bytes'],
+                'zlib_bytes': plain,
+                'zlib_dictionary_bytes': totals['compressed_bytes'],
+                'ratio_zlib': round(totals['raw_bytes'] / plain, 2),
+                'ratio_zlib_dictionary': round(totals['raw_bytes'] / totals['compressed_bytes'], 2),
+            }
+            results['hot_table_bytes'] = {'before': before, 'after': after, 'freed': before - after}
+
+            timings = []
+            restored = 0
+            ids = list(ArchivedConversation.objects.values_list('conversation_id', flat=True)[:options['rehydrate']])
+            for conversation_id in ids:
+                conversation = Conversation.objects.select_related('archive').get(id=conversation_id)
+                expected = [m['content'] for m in unpack(decompress(conversation.archive.data, conversation.archive.dictionary))]
+                with Timer() as timer:
+                    restored += rehydrate(conversation)
+                timings.append(timer.elapsed)
+                assert list(conversation.messages.values_list('content', flat=True)) == expected
+            results['rehydrate'] = dict(latency_summary(timings), messages=restored)
+
+        self.stdout.write(json.dumps({'benchmark': 'chat_archive', 'results': results}, indent=2))
+
+    def generate(self, user, options):
+        # Real AgroAI replies to the benchmark questions, backdated past the
+        # archiving threshold
+        rng = random.Random(options['seed'])
+        processor = AgroAIProcessor()
+        started = timezone.now() - timedelta(days=90)
+        messages = []
+        for i in range(options['conversations']):
+            conversation = Conversation.objects.create(user=user, title=f'Conversation {i}')
+            timestamp = started + timedelta(minutes=i)
+            for _ in range(options['turns']):
+                question = rng.choice(QUESTIONS).format(region=rng.choice(REGIONS))
+                intent, intents = processor.route(question)
+                response = processor.respond(intent, intents, question, None)
+                messages.append(Message(conversation=conversation, content=question, is_user=True,
+                                        timestamp=timestamp))
+                messages.append(Message(conversation=conversation, content=response['content'], is_user=False,
+                                        message_type=response.get('type', 'text'),
+                                        timestamp=timestamp + timedelta(seconds=1)))
+                timestamp += timedelta(seconds=2)
+            if len(messages) >= 2000:
+                write_messages(messages)
+                messages = []
+        if messages:
+            write_messages(messages)
+        Conversation.objects.update(updated_at=started)
@@ -0,0 +1,113 @@
+import json
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from agroai.benchmarking import Timer, benchmark_database, latency_summary
+from chat.models import Conversation, Message
+from chat.search import matching_ids, search_messages
+
+QUESTIONS = [
+    'What is the {parameter} trend in the {region}?',
+    'Show me a chart of {parameter} in the {region} over the past year',
+    'and what about {parameter} there?',
+    'Is the {region} ecosystem healthy for coral and plankton?',
+    'How do tides and currents affect {parameter} in the {region}?',
+]
+REPLIES = [
+    'Average {parameter} in the {region} rose slightly over the last decade.',
+    'The {region} shows stable {parameter} with a clear seasonal cycle.',
+    'No hypoxic zones were found in the {region} in the last 30 days.',
+    "I understand you're asking about the {region}. I can help you analyze marine ecosystems.",
+]
+PARAMETERS = ['temperature', 'salinity', 'pH', 'dissolved oxygen', 'chlorophyll', 'turbidity']
+REGIONS = ['Pacific', 'Atlantic', 'Indian Ocean', 'Arctic', 'Southern Ocean', 'Mediterranean']
+# Frequent, rare, two words, and absent
+TERMS = ['salinity', 'hypoxic', 'chlorophyll arctic', 'zebrafish']
+
+
+class Command(BaseCommand):
+    help = "Benchmark full-text message search against the admin's LIKE search."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200000)
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--conversations', type=int, default=20, help='Conversations per user')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            users = [User.objects.create_user(f'benchmark{i}') for i in range(options['users'])]
+            self.stderr.write(f"Generating {options['messages']} messages...")
+            with Timer() as timer:
+                self.generate(users, options)
+            results = {'messages': options['messages'], 'generate_seconds': round(timer.elapsed, 2), 'terms': {}}
+
+            user = users[0]
+            for term in TERMS:
+                timings = {name: [] for name in ('like_page', 'fts_page', 'like_user_page', 'fts_user_page',
+                                                 'like_count', 'fts_count')}
+                counts = {}
+                for _ in range(options['repeat']):
+                    # The admin's search: one LIKE per field and word
+                    like = Message.objects.all()
+                    for word in term.split():
+                        like = like.filter(content__icontains=word)
+                    with Timer() as timer:
+                        list(like.order_by('-timestamp', '-id')[:20])
+                    timings['like_page'].append(timer.elapsed)
+                    with Timer() as timer:
+                        search_messages(term)
+                    timings['fts_page'].append(timer.elapsed)
+                    with Timer() as timer:
+                        list(like.filter(conversation__user=user).order_by('-timestamp', '-id')[:20])
+                    timings['like_user_page'].append(timer.elapsed)
+                    with Timer() as timer:
+                        search_messages(term, user=user)
+                    timings['fts_user_page'].append(timer.elapsed)
+                    with Timer() as timer:
+                        counts['like'] = like.count()
+                    timings['like_count'].append(timer.elapsed)
+                    with Timer() as timer:
+                        counts['fts'] = Message.objects.filter(id__in=matching_ids(term)).count()
+                    timings['fts_count'].append(timer.elapsed)
+                results['terms'][term] = {
+                    # FTS matches words and stems, LIKE substrings, so the
+                    # counts may differ slightly
+                    'matches': counts,
+                    **{name: latency_summary(samples) for name, samples in timings.items()},
+                }
+                self.stderr.write(f"{term}: like {results['terms'][term]['like_page']['p50_ms']} ms, "
+                                  f"fts {results['terms'][term]['fts_page']['p50_ms']} ms")
+
+        self.stdout.write(json.dumps({'benchmark': 'chat_search', 'results': results}, indent=2))
+
+    def generate(self, users, options):
+        # Raw executemany like generate_ocean_data; the FTS triggers still
+        # index every row
+        rng = random.Random(options['seed'])
+        conversations = [
+            Conversation.objects.create(user=user, title=f'Conversation {i}').id
+            for user in users for i in range(options['conversations'])
+        ]
+        sql = 'INSERT INTO chat_message (conversation_id, content, is_user, timestamp, message_type) ' \
+              'VALUES (%s, %s, %s, %s, %s)'
+        adapt = connection.ops.adapt_datetimefield_value
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        inserted = 0
+        with connection.cursor() as cursor:
+            while inserted < options['messages']:
+                rows = []
+                for i in range(inserted, min(options['messages'], inserted + 20000)):
+                    is_user = i % 2 == 0
+                    template = rng.choice(QUESTIONS if is_user else REPLIES)
+                    content = template.format(parameter=rng.choice(PARAMETERS), region=rng.choice(REGIONS))
+                    rows.append((rng.choice(conversations), content, is_user,
+                                 adapt(start + timedelta(seconds=i)), 'text'))
+                with transaction.atomic():
+                    cursor.executemany(sql, rows)
+                inserted += len(rows)
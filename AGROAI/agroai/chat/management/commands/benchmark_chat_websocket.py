@@ -0,0 +1,175 @@
+import asyncio
+import json
+import random
+import time
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.urls import re_path
+
+from agroai.benchmarking import benchmark_database, generate_ocean_data, latency_summary
+from chat.admission import UNLIMITED_SETTINGS, reset_admission
+from chat.ai_processor import AgroAIProcessor
+from chat.consumers import ChatConsumer
+from chat.models import Conversation, Message
+from data.series import load_series
+from data.series_cache import get_series_cache
+
+QUESTIONS = [
+    'What is the temperature trend in the {region}?',
+    'Show salinity levels in the {region}',
+    'Dissolved oxygen in the {region}',
+    'How healthy is the marine ecosystem in the {region}?',
+    'hello',
+]
+REGIONS = ['Pacific', 'Atlantic', 'Indian']
+PARAMETERS = ['temperature', 'salinity', 'dissolved_oxygen', 'chlorophyll']
+
+
+class LegacyChatConsumer(AsyncWebsocketConsumer):
+    # ChatConsumer before the async pipeline: one database_sync_to_async
+    # hop per message covering both inserts and the analysis
+    async def connect(self):
+        self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
+        self.room_group_name = f'chat_{self.conversation_id}'
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+
+    async def receive(self, text_data):
+        text_data_json = json.loads(text_data)
+        response = await self.process_ai_message(text_data_json['message'], text_data_json['conversation_id'])
+        await self.channel_layer.group_send(self.room_group_name, {'type': 'chat_message', 'message': response})
+
+    async def chat_message(self, event):
+        await self.send(text_data=json.dumps({'message': event['message']}))
+
+    @database_sync_to_async
+    def process_ai_message(self, message, conversation_id):
+        conversation = Conversation.objects.get(id=conversation_id)
+        Message.objects.create(conversation=conversation, content=message, is_user=True)
+        response = AgroAIProcessor().process_message(message, conversation)
+        Message.objects.create(conversation=conversation, content=response['content'], is_user=False,
+                               message_type=response.get('type', 'text'))
+        return response
+
+
+def websocket_application(consumer):
+    return URLRouter([re_path(r'ws/chat/(?P<conversation_id>\w+)/$', consumer.as_asgi())])
+
+
+class Command(BaseCommand):
+    help = 'Load-test concurrent ChatConsumer connections against the previous consumer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=50)
+        parser.add_argument('--messages', type=int, default=10, help='Messages per connection')
+        parser.add_argument('--points', type=int, default=200000, help='Observations to generate')
+        parser.add_argument('--cached', action='store_true', help='Keep the analysis cache enabled')
+        parser.add_argument('--burst', action='store_true',
+                            help='Send all messages of a connection at once instead of one per reply')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        results = []
+        with benchmark_database():
+            user = User.objects.create_user('benchmark')
+            self.stderr.write(f"Generating {options['points']} observations...")
+            generate_ocean_data(user, options['points'], regions=[r.lower() for r in REGIONS],
+                                parameters=PARAMETERS,
+                                interval=timedelta(minutes=30))
+            conversations = [
+                Conversation.objects.create(user=user, title=f'Load test {i}').id
+                for i in range(options['connections'])
+            ]
+
+            caches = dict(settings.CACHES)
+            if not options['cached']:
+                caches[settings.OCEAN_ANALYSIS_CACHE] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+            # One user sends every message; measure throughput, not limits
+            with override_settings(CACHES=caches, **UNLIMITED_SETTINGS):
+                reset_admission()
+                for name, consumer in (('legacy', LegacyChatConsumer), ('async_pipeline', ChatConsumer)):
+                    Message.objects.all().delete()
+                    # Steady state: every series already in the series cache
+                    get_series_cache().clear()
+                    for region in REGIONS:
+                        for parameter in PARAMETERS:
+                            load_series(region.lower(), parameter)
+                    result = asyncio.run(self.load(consumer, user, conversations, options))
+                    result['consumer'] = name
+                    result['messages_saved'] = Message.objects.count()
+                    results.append(result)
+                    self.stderr.write(json.dumps(result))
+            reset_admission()
+
+        self.stdout.write(json.dumps({'benchmark': 'chat_websocket', 'results': results}, indent=2))
+
+    async def load(self, consumer, user, conversations, options):
+        application = websocket_application(consumer)
+        latencies = []
+        ttfb = []
+        light_latencies = []
+        busy = 0
+
+        async def client(index, conversation_id):
+            nonlocal busy
+            rng = random.Random(options['seed'] + index)
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{conversation_id}/')
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            assert connected
+            messages = [rng.choice(QUESTIONS).format(region=rng.choice(REGIONS)) for _ in range(options['messages'])]
+            batches = [messages] if options['burst'] else [[message] for message in messages]
+            for batch in batches:
+                started = time.perf_counter()
+                for message in batch:
+                    await communicator.send_to(text_data=json.dumps({
+                        'message': message, 'conversation_id': conversation_id,
+                    }))
+                # Every message gets either a reply or a busy frame. A
+                # streamed reply is chunk frames and then its final frame.
+                first_frame = None
+                pending = len(batch)
+                while pending:
+                    frame = json.loads(await communicator.receive_from(timeout=120))
+                    if frame.get('type') == 'busy':
+                        busy += 1
+                        pending -= 1
+                        continue
+                    # Transient progress notes are not part of the reply
+                    if first_frame is None and not frame.get('transient'):
+                        first_frame = time.perf_counter() - started
+                        ttfb.append(first_frame)
+                    if frame.get('type') == 'chunk':
+                        continue
+                    pending -= 1
+                    first_frame = None
+                    latencies.append(time.perf_counter() - started)
+                    if frame['message'].get('type') == 'text':
+                        light_latencies.append(latencies[-1])
+            await communicator.disconnect()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(i, c) for i, c in enumerate(conversations)))
+        elapsed = time.perf_counter() - started
+        return {
+            'connections': len(conversations),
+            'replies': len(latencies),
+            'replies_per_second': round(len(latencies) / elapsed, 1),
+            'busy_frames': busy,
+            'latency': latency_summary(latencies),
+            # Time to the first frame of each reply's content
+            'ttfb': latency_summary(ttfb),
+            # Greetings and other replies that need no analysis
+            'light_reply_latency': latency_summary(light_latencies),
+        }
@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, connections
+from django.test.utils import override_settings
+
+from agroai.benchmarking import benchmark_database, latency_summary
+from agroai.database import READ_ALIAS, reset_write_queue, write
+from chat.conversations import conversations_page
+from chat.models import Conversation, Message
+from chat.persistence import write_messages
+
+PROFILES = ('development', 'production')
+
+
+def record_turn(conversation_id, index):
+    # The writes of one chat turn: load the conversation, then store the
+    # question and answer. Reading first is what makes a deferred
+    # transaction fail rather than wait when another thread is writing.
+    conversation = Conversation.objects.get(id=conversation_id)
+    write_messages([
+        Message(conversation=conversation, content=f'Question {index} about the Pacific', is_user=True),
+        Message(conversation=conversation, content=f'Answer {index}: temperature is rising', is_user=False),
+    ])
+
+
+class Command(BaseCommand):
+    help = ('Benchmark concurrent chat writes and reads against SQLite with the development and '
+            'production database profiles, reporting write throughput and "database is locked" errors.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default=','.join(PROFILES))
+        parser.add_argument('--writers', type=int, default=16, help='Threads writing chat turns')
+        parser.add_argument('--readers', type=int, default=8, help='Threads listing conversations and messages')
+        parser.add_argument('--read-interval', type=float, default=0.01,
+                            help='Seconds each reader waits between requests')
+        parser.add_argument('--turns', type=int, default=200, help='Turns each writer attempts')
+        parser.add_argument('--conversations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        results = {}
+        for profile in options['profiles'].split(','):
+            self.stderr.write(f'Running {profile}...')
+            results[profile] = self.run(profile, options)
+            self.stderr.write(json.dumps(results[profile]))
+        self.stdout.write(json.dumps({
+            'benchmark': 'database',
+            'config': {key: options[key] for key in ('writers', 'readers', 'read_interval', 'turns', 'conversations')},
+            'results': results,
+        }, indent=2))
+
+    def run(self, profile, options):
+        production = profile == 'production'
+        pragmas = settings.SQLITE_PRODUCTION_PRAGMAS if production else {}
+        database = connection.settings_dict
+        saved = dict(database), dict(database['OPTIONS'])
+        # Every thread's connection is built from this dict, so the options
+        # apply to all of them
+        database['OPTIONS']['transaction_mode'] = 'IMMEDIATE' if production else None
+        database['CONN_MAX_AGE'] = None if production else 0
+        routers = ['agroai.database.ReadOnlyRouter'] if production else []
+        try:
+            with override_settings(SQLITE_PRAGMAS=pragmas, DATABASE_WRITE_QUEUE=production,
+                                   DATABASE_ROUTERS=routers):
+                with benchmark_database():
+                    with self.read_alias(production):
+                        try:
+                            return self.measure(options)
+                        finally:
+                            reset_write_queue()
+        finally:
+            database.clear()
+            database.update(saved[0])
+            database['OPTIONS'] = saved[1]
+
+    @contextmanager
+    def read_alias(self, enabled):
+        # Read-only connections to the benchmark database, as the
+        # production profile's DATABASES['read']
+        if not enabled:
+            yield
+            return
+        connections.settings[READ_ALIAS] = dict(
+            connection.settings_dict, OPTIONS=dict(connection.settings_dict['OPTIONS'], read_only=True),
+        )
+        try:
+            yield
+        finally:
+            del connections.settings[READ_ALIAS]
+
+    def measure(self, options):
+        user = User.objects.create_user('benchmark', password='benchmark')
+        conversation_ids = [Conversation.objects.create(user=user, title=f'Benchmark {i}').id
+                            for i in range(options['conversations'])]
+        stats = {'turns': 0, 'lock_errors': 0, 'other_errors': 0, 'reads': 0, 'read_errors': 0}
+        write_latencies = []
+        read_latencies = []
+        lock = threading.Lock()
+        done = threading.Event()
+        start = threading.Barrier(options['writers'] + options['readers'] + 1)
+
+        def count(key):
+            with lock:
+                stats[key] += 1
+
+        def writer(index):
+            try:
+                start.wait()
+                for turn in range(options['turns']):
+                    conversation_id = conversation_ids[(index + turn) % len(conversation_ids)]
+                    started = time.perf_counter()
+                    try:
+                        write(record_turn, conversation_id, turn)
+                    except OperationalError as e:
+                        count('lock_errors' if 'locked' in str(e) else 'other_errors')
+                    else:
+                        count('turns')
+                        write_latencies.append(time.perf_counter() - started)
+                    # A request boundary
+                    close_old_connections()
+            finally:
+                connections.close_all()
+
+        def reader(index):
+            try:
+                start.wait()
+                turn = 0
+                while not done.is_set():
+                    conversation_id = conversation_ids[(index + turn) % len(conversation_ids)]
+                    started = time.perf_counter()
+                    try:
+                        conversations_page(user, None, 20)
+                        list(Message.objects.filter(conversation_id=conversation_id).order_by('-id')[:50])
+                    except OperationalError:
+                        count('read_errors')
+                    else:
+                        count('reads')
+                        read_latencies.append(time.perf_counter() - started)
+                    close_old_connections()
+                    turn += 1
+                    done.wait(options['read_interval'])
+            finally:
+                connections.close_all()
+
+        writers = [threading.Thread(target=writer, args=(i,)) for i in range(options['writers'])]
+        readers = [threading.Thread(target=reader, args=(i,)) for i in range(options['readers'])]
+        for thread in writers + readers:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        for thread in readers:
+            thread.join()
+
+        attempts = options['writers'] * options['turns']
+        return {
+            'turns_committed': stats['turns'],
+            'turns_per_second': round(stats['turns'] / elapsed, 1),
+            'lock_errors': stats['lock_errors'],
+            'lock_error_rate': round(stats['lock_errors'] / attempts, 4),
+            'other_errors': stats['other_errors'],
+            'write_latency': latency_summary(write_latencies),
+            'reads': stats['reads'],
+            'reads_per_second': round(stats['reads'] / elapsed, 1),
+            'read_errors': stats['read_errors'],
+            'read_latency': latency_summary(read_latencies),
+        }
@@ -0,0 +1,119 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand
+
+from agroai.benchmarking import Timer
+from chat.ai_processor import get_processor
+
+TEMPLATES = [
+    'What is the {parameter} trend in the {region}?',
+    'Show me a chart of {parameter} in the {region} over the past year',
+    'hello, can you help with {parameter} data?',
+    'Is the {region} ecosystem healthy for coral and plankton?',
+    'plot {parameter} near 35.2N 120.5W within 30 km at 0-100 m',
+    'Tell me about fisheries and aquaculture along the {region} coast',
+    'Why does the graph of {parameter} look so noisy this season?',
+    'I have a question about crop rotation and irrigation schedules',
+    'How do tides and currents affect {parameter} in the {region}?',
+    'Could you visualize the data for the {region} for the last 6 months please',
+]
+PARAMETERS = ['temperature', 'salinity', 'pH', 'dissolved oxygen', 'chlorophyll', 'turbidity']
+REGIONS = ['Pacific', 'Atlantic', 'Indian Ocean', 'Arctic', 'Southern Ocean', 'Mediterranean']
+
+
+class LegacyRouter:
+    # Routing as it was before the compiled matcher: a new processor (with
+    # its keyword lists) per message, substring any() scans in
+    # process_message and a second round of scans in analyze_query
+    def __init__(self):
+        self.regions = ['Pacific', 'Atlantic', 'Indian', 'Arctic', 'Southern', 'Mediterranean']
+        self.parameters = ['temperature', 'salinity', 'ph', 'dissolved_oxygen', 'chlorophyll', 'turbidity']
+        self.marine_species = ['phytoplankton', 'zooplankton', 'coral', 'fish', 'marine_mammals', 'seaweed']
+        self.greeting_patterns = ["hi", "hello", "hey", "good morning", "good afternoon", "good evening"]
+        self.ocean_keywords = [
+            'temperature', 'salinity', 'ph', 'oxygen', 'current', 'wave',
+            'tide', 'marine', 'ocean', 'sea', 'coastal', 'fishery',
+            'aquaculture', 'algae', 'plankton', 'coral', 'ecosystem'
+        ]
+
+    def route(self, message):
+        message_lower = message.lower()
+        if any(greeting in message_lower for greeting in self.greeting_patterns):
+            return ('greeting', None)
+        if any(keyword in message_lower for keyword in self.ocean_keywords):
+            region = next((r for r in self.regions if r.lower() in message_lower), None)
+            if any(word in message_lower for word in ['temperature', 'temp', 'thermal']):
+                return ('ocean', 'temperature', region)
+            elif any(word in message_lower for word in ['salinity', 'salt']):
+                return ('ocean', 'salinity', region)
+            elif any(word in message_lower for word in ['ph', 'acidity']):
+                return ('ocean', 'ph', region)
+            elif any(word in message_lower for word in ['oxygen', 'o2']):
+                return ('ocean', 'dissolved_oxygen', region)
+            elif any(word in message_lower for word in ['ecosystem', 'marine', 'species']):
+                return ('ocean', 'ecosystem', region)
+            return ('ocean', None, region)
+        if any(word in message_lower for word in ['graph', 'chart', 'plot', 'visualize', 'show data']):
+            return ('visualization', None)
+        return ('general', None)
+
+
+def compiled_route(message):
+    processor = get_processor()
+    intent, intents = processor.route(message)
+    if intent != 'ocean':
+        return (intent, None)
+    region = intents['region'][0] if intents['region'] else None
+    return (intent, processor.ocean_processor.select_analysis(intents), region)
+
+
+class Command(BaseCommand):
+    help = 'Compare messages per second of the compiled intent router against the legacy keyword scans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        get_processor()
+
+        results = []
+        changed = {}
+        for sentences in (1, 5):
+            # One template per message, then paragraph-length messages
+            messages = [
+                ' '.join(
+                    rng.choice(TEMPLATES).format(parameter=rng.choice(PARAMETERS), region=rng.choice(REGIONS))
+                    for _ in range(sentences)
+                )
+                for _ in range(options['messages'])
+            ]
+            with Timer() as legacy:
+                legacy_routes = [LegacyRouter().route(message) for message in messages]
+            with Timer() as compiled:
+                compiled_routes = [compiled_route(message) for message in messages]
+
+            changes = 0
+            for message, old, new in zip(messages, legacy_routes, compiled_routes):
+                if old != new:
+                    changes += 1
+                    if sentences == 1:
+                        changed.setdefault(message, {'legacy': old, 'compiled': new})
+            results.append({
+                'sentences_per_message': sentences,
+                'messages': len(messages),
+                'legacy_messages_per_second': round(len(messages) / legacy.elapsed),
+                'compiled_messages_per_second': round(len(messages) / compiled.elapsed),
+                'speedup': round(legacy.elapsed / compiled.elapsed, 2),
+                'routing_changes': changes,
+                'legacy_greetings': sum(route[0] == 'greeting' for route in legacy_routes),
+                'compiled_greetings': sum(route[0] == 'greeting' for route in compiled_routes),
+            })
+
+        self.stdout.write(json.dumps({
+            'benchmark': 'intent_router',
+            'results': results,
+            'routing_change_examples': dict(list(changed.items())[:5]),
+        }, indent=2))
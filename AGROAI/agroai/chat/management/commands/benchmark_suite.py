@@ -0,0 +1,251 @@
+import asyncio
+import json
+import random
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from agroai.benchmarking import (
+    Timer, benchmark_database, compare_to_baseline, generate_ocean_data, latency_report,
+)
+from chat.admission import UNLIMITED_SETTINGS, reset_admission
+from chat.consumers import ChatConsumer
+from chat.models import Conversation
+from chat.persistence import flush_messages
+from data import analysis_cache
+from data.data_sources import OceanDataProcessor
+from data.series import load_series
+from .benchmark_chat_websocket import PARAMETERS, QUESTIONS, REGIONS, websocket_application
+
+SCENARIOS = ('websocket', 'process_message', 'conversations', 'ocean_analysis')
+ANALYSIS_QUESTIONS = [
+    'What is the temperature trend in the {region}?',
+    'Show salinity levels in the {region}',
+    'Dissolved oxygen in the {region}',
+    'How healthy is the marine ecosystem in the {region}?',
+]
+VISUALIZATION_QUESTIONS = [
+    'Plot temperature in the {region} for the past year',
+    'Chart salinity and dissolved oxygen in the {region}',
+]
+
+
+class Command(BaseCommand):
+    help = ('Offline load and latency benchmarks of the chat WebSocket, the chat HTTP API and '
+            'OceanDataProcessor, with an optional comparison against a stored baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+        parser.add_argument('--clients', type=int, default=20, help='Concurrent clients per scenario')
+        parser.add_argument('--messages', type=int, default=5, help='Requests per client')
+        parser.add_argument('--points', type=int, default=100000, help='Synthetic observations')
+        parser.add_argument('--repeat', type=int, default=10, help='Runs per OceanDataProcessor call')
+        parser.add_argument('--cached', action='store_true', help='Keep the analysis cache enabled for chat')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', help='JSON output of an earlier run to compare against')
+        parser.add_argument('--save-baseline', help='Also write the results to this file')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Relative slowdown flagged as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'].split(',')
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        results = {}
+        with benchmark_database():
+            self.user = User.objects.create_user('benchmark', password='benchmark')
+            self.stderr.write(f"Generating {options['points']} observations...")
+            generate_ocean_data(self.user, options['points'], regions=[r.lower() for r in REGIONS],
+                                parameters=PARAMETERS, interval=timedelta(minutes=30), seed=options['seed'])
+            for region in REGIONS:
+                for parameter in PARAMETERS:
+                    load_series(region.lower(), parameter)
+
+            caches = dict(settings.CACHES)
+            if not options['cached']:
+                caches[settings.OCEAN_ANALYSIS_CACHE] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+            for scenario in scenarios:
+                self.stderr.write(f'Running {scenario}...')
+                if scenario == 'ocean_analysis':
+                    results[scenario] = self.ocean_analysis(options)
+                else:
+                    # One user sends every message; measure latency, not limits
+                    with override_settings(CACHES=caches, **UNLIMITED_SETTINGS):
+                        reset_admission()
+                        results[scenario] = asyncio.run(getattr(self, scenario)(options))
+                flush_messages()
+            reset_admission()
+
+        output = {
+            'benchmark': 'suite',
+            'config': {key: options[key] for key in ('clients', 'messages', 'points', 'repeat', 'cached', 'seed')},
+            'results': results,
+        }
+        regressions = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = compare_to_baseline(results, baseline['results'], options['tolerance'])
+            output['comparison'] = {
+                'baseline': options['baseline'],
+                'tolerance': options['tolerance'],
+                'regressions': regressions,
+            }
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(output, f, indent=2)
+        self.stdout.write(json.dumps(output, indent=2))
+
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(f"Regression: {regression['metric']} {regression['baseline']} -> "
+                                  f"{regression['current']} ({regression['change']:+.0%})")
+            if options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+
+    def conversations_for(self, count, title='Benchmark'):
+        return [Conversation.objects.create(user=self.user, title=f'{title} {i}').id for i in range(count)]
+
+    def session_cookie(self):
+        # A logged-in session for requests through the ASGI application
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(self.user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = self.user.get_session_auth_hash()
+        session.save()
+        return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'.encode()
+
+    async def request(self, method, path, cookie, body=b'', headers=()):
+        from agroai.asgi import application
+        communicator = HttpCommunicator(application, method, path, body=body, headers=[
+            (b'host', b'localhost'), (b'cookie', cookie), (b'content-type', b'application/json'), *headers,
+        ])
+        return await communicator.get_response(timeout=120)
+
+    async def run_clients(self, options, client):
+        # Runs client(index) for every client at once; returns wall seconds
+        started = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(options['clients'])))
+        return time.perf_counter() - started
+
+    async def websocket(self, options):
+        conversations = await sync_to_async(self.conversations_for)(options['clients'], 'WebSocket')
+        application = websocket_application(ChatConsumer)
+        latencies = []
+        ttfb = []
+
+        async def client(index):
+            rng = random.Random(options['seed'] + index)
+            conversation_id = conversations[index]
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{conversation_id}/')
+            communicator.scope['user'] = self.user
+            connected, _ = await communicator.connect()
+            assert connected
+            for _ in range(options['messages']):
+                message = rng.choice(QUESTIONS).format(region=rng.choice(REGIONS))
+                started = time.perf_counter()
+                await communicator.send_to(text_data=json.dumps({'message': message}))
+                first = None
+                while True:
+                    frame = json.loads(await communicator.receive_from(timeout=120))
+                    # Transient progress notes are not part of the reply
+                    if first is None and not frame.get('transient'):
+                        first = time.perf_counter() - started
+                        ttfb.append(first)
+                    if frame.get('type') == 'final':
+                        latencies.append(time.perf_counter() - started)
+                        break
+            await communicator.disconnect()
+
+        elapsed = await self.run_clients(options, client)
+        return {
+            'replies_per_second': round(len(latencies) / elapsed, 1),
+            'latency': latency_report(latencies),
+            'ttfb': latency_report(ttfb),
+        }
+
+    async def process_message(self, options):
+        conversations = await sync_to_async(self.conversations_for)(options['clients'], 'HTTP')
+        cookie = await sync_to_async(self.session_cookie)()
+        latencies = []
+        errors = 0
+
+        async def client(index):
+            nonlocal errors
+            rng = random.Random(options['seed'] + index)
+            for _ in range(options['messages']):
+                body = json.dumps({
+                    'conversation_id': conversations[index],
+                    'message': rng.choice(QUESTIONS).format(region=rng.choice(REGIONS)),
+                }).encode()
+                with Timer() as timer:
+                    response = await self.request('POST', '/chat/api/process-message/', cookie, body)
+                latencies.append(timer.elapsed)
+                if response['status'] != 200 or not json.loads(response['body'])['success']:
+                    errors += 1
+
+        elapsed = await self.run_clients(options, client)
+        return {
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'errors': errors,
+            'latency': latency_report(latencies),
+        }
+
+    async def conversations(self, options):
+        # A first load of the list, then polls revalidating it with the ETag
+        await sync_to_async(self.conversations_for)(50, 'Listed')
+        cookie = await sync_to_async(self.session_cookie)()
+        full = []
+        revalidated = []
+        statuses = {}
+
+        async def client(index):
+            with Timer() as timer:
+                response = await self.request('GET', '/chat/api/conversations/', cookie)
+            full.append(timer.elapsed)
+            etag = dict(response['headers']).get(b'ETag', b'')
+            for _ in range(options['messages']):
+                with Timer() as timer:
+                    response = await self.request('GET', '/chat/api/conversations/', cookie,
+                                                  headers=[(b'if-none-match', etag)])
+                revalidated.append(timer.elapsed)
+                statuses[response['status']] = statuses.get(response['status'], 0) + 1
+
+        elapsed = await self.run_clients(options, client)
+        return {
+            'requests_per_second': round((len(full) + len(revalidated)) / elapsed, 1),
+            'statuses': {str(status): count for status, count in statuses.items()},
+            'full_latency': latency_report(full),
+            'revalidate_latency': latency_report(revalidated),
+        }
+
+    def ocean_analysis(self, options):
+        processor = OceanDataProcessor()
+        timings = {'analyze_query': [], 'analyze_query_cached': [],
+                   'visualization': [], 'visualization_cached': []}
+        rng = random.Random(options['seed'])
+        for _ in range(options['repeat']):
+            region = rng.choice(REGIONS)
+            analysis_cache.bump_versions([(region.lower(), parameter) for parameter in PARAMETERS])
+            question = rng.choice(ANALYSIS_QUESTIONS).format(region=region)
+            for name in ('analyze_query', 'analyze_query_cached'):
+                with Timer() as timer:
+                    processor.analyze_query(question)
+                timings[name].append(timer.elapsed)
+            question = rng.choice(VISUALIZATION_QUESTIONS).format(region=region)
+            for name in ('visualization', 'visualization_cached'):
+                with Timer() as timer:
+                    processor.generate_visualization_data(question)
+                timings[name].append(timer.elapsed)
+        return {name: latency_report(samples) for name, samples in timings.items()}
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:45
+
+from django.db import migrations, models
+
+
+def backfill_conversation_fields(apps, schema_editor):
+    # Same preview as chat.persistence.message_preview, inlined so the
+    # migration does not depend on application code
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    for conversation in Conversation.objects.iterator():
+        messages = Message.objects.filter(conversation_id=conversation.id)
+        last = messages.order_by('-timestamp', '-id').first()
+        if last is None:
+            continue
+        Conversation.objects.filter(id=conversation.id).update(
+            message_count=messages.count(),
+            last_message_preview=' '.join(last.content.split())[:100],
+            last_message_at=last.timestamp,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', '-updated_at', '-id'], name='conversation_user_updated'),
+        ),
+        migrations.RunPython(backfill_conversation_fields, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,25 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Conversation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized from the messages for the conversation list; kept up to
+    # date by chat.persistence.write_messages
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_preview = models.CharField(max_length=200, blank=True, default='')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # Entities of the conversation so far (region, parameter, topic, days)
+    # for follow-up questions; None until built, see chat.context
+    context = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-updated_at', '-id'], name='conversation_user_updated'),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.user.username}"
@@ -14,11 +28,40 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     content = models.TextField()
     is_user = models.BooleanField(default=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is created, not when it is written, so messages
+    # saved later in a batch keep their order
+    timestamp = models.DateTimeField(default=timezone.now)
     message_type = models.CharField(max_length=20, default='text')  # text, data_analysis, visualization
 
     class Meta:
-        ordering = ['timestamp']
+        ordering = ['timestamp', 'id']
+        indexes = [
+            models.Index(fields=['conversation', 'timestamp'], name='message_conversation_time'),
+        ]
+
+    def __str__(self):
+        return f"{'User' if self.is_user else 'AI'}: {self.content[:50]}"
+
+class ArchiveDictionary(models.Model):
+    # Preset zlib dictionary of the boilerplate shared by chat messages,
+    # see chat.archive. Kept for as long as archives compressed with it.
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Dictionary {self.id} ({len(self.data)} bytes)"
+
+class ArchivedConversation(models.Model):
+    # The messages of an idle conversation packed into one compressed blob
+    # and removed from the Message table until the conversation is opened
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, primary_key=True,
+                                        related_name='archive')
+    dictionary = models.ForeignKey(ArchiveDictionary, on_delete=models.PROTECT)
+    data = models.BinaryField()
+    message_count = models.PositiveIntegerField()
+    # Size of the packed messages before compression
+    raw_size = models.PositiveIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{'User' if self.is_user else 'AI'}: {self.content[:50]}"
\ No newline at end of file
+        return f"Archive of {self.conversation_id} ({self.message_count} messages)"
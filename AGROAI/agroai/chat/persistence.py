@@ -0,0 +1,231 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from agroai.database import write
+from agroai.metrics import chat_messages_dropped_total
+
+from .conversations import bump_list_versions
+from .models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 100
+
+
+class MessageBuffer:
+    # Write-behind buffer for chat Messages shared by every consumer and
+    # view in the process. Messages are queued unsaved and written by a
+    # background thread with one bulk_create per batch, once max_size
+    # messages are waiting or the oldest has waited max_delay seconds.
+    #
+    # Ordering: Message.timestamp is set when the instance is built and
+    # the queue is a single FIFO, so each conversation's messages are
+    # inserted in the order they were queued (ids break timestamp ties).
+    # flush() waits for any batch already being written, so a caller that
+    # flushes before reading sees every message queued before the flush.
+    # The guarantee is per process: run one worker per buffer, or flush
+    # in the process that accepted the message.
+    #
+    # Failures: a batch that cannot be written is retried one message at a
+    # time, so one bad message does not hold back the others. A message
+    # that still fails is queued again, and dropped with an error log once
+    # it has failed max_attempts flushes.
+
+    def __init__(self, max_size=100, max_delay=0.05, max_attempts=5):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.pending = []
+        # Failed flushes of each queued message, by id()
+        self.failures = {}
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.thread = None
+        self.stopped = False
+
+    def add(self, message):
+        with self.condition:
+            self.pending.append(message)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='chat-message-buffer', daemon=True)
+                self.thread.start()
+            if len(self.pending) == 1 or len(self.pending) >= self.max_size:
+                self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                # Give the batch time to fill; add() wakes us when full
+                deadline = time.monotonic() + self.max_delay
+                while len(self.pending) < self.max_size and not self.stopped:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            try:
+                written = self.flush()
+            except Exception:
+                logger.exception('Could not write buffered chat messages')
+                written = None
+            finally:
+                close_old_connections()
+            if written is None or self.failures:
+                # Back off before retrying what failed
+                with self.condition:
+                    self.condition.wait(self.max_delay)
+
+    def flush(self):
+        # Writes everything queued so far. Returns the number written;
+        # messages that failed are queued again in front, see above.
+        with self.write_lock:
+            with self.condition:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            try:
+                self._write(batch)
+            except Exception:
+                logger.warning('Could not write %d buffered chat messages, writing them one at a time',
+                               len(batch), exc_info=True)
+            else:
+                self.failures.clear()
+                return len(batch)
+
+            written = 0
+            retry = []
+            # Conversations with a failed message: their later messages
+            # wait behind it, so each conversation stays in order
+            held = set()
+            for message in batch:
+                if message.conversation_id in held:
+                    retry.append(message)
+                    continue
+                try:
+                    self._write([message])
+                except Exception:
+                    attempts = self.failures.pop(id(message), 0) + 1
+                    if attempts >= self.max_attempts:
+                        logger.error('Dropping chat message of conversation %s after %d failed writes',
+                                     message.conversation_id, attempts, exc_info=True)
+                        chat_messages_dropped_total.inc()
+                        continue
+                    self.failures[id(message)] = attempts
+                    held.add(message.conversation_id)
+                    retry.append(message)
+                else:
+                    self.failures.pop(id(message), None)
+                    written += 1
+            with self.condition:
+                self.pending[:0] = retry
+            return written
+
+    def _write(self, batch):
+        write(write_messages, batch)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not write buffered chat messages at shutdown')
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_message_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = MessageBuffer(
+                    max_size=getattr(settings, 'CHAT_MESSAGE_BUFFER_SIZE', 100),
+                    max_delay=getattr(settings, 'CHAT_MESSAGE_BUFFER_DELAY', 0.05),
+                    max_attempts=getattr(settings, 'CHAT_MESSAGE_BUFFER_ATTEMPTS', 5),
+                )
+                atexit.register(_buffer.stop)
+    return _buffer
+
+
+def message_preview(content):
+    return ' '.join(content.split())[:PREVIEW_LENGTH]
+
+
+def conversation_title(content):
+    return content[:50] + '...' if len(content) > 50 else content
+
+
+def write_messages(messages):
+    # Inserts the messages with one bulk_create and folds them into the
+    # denormalized counters of their conversations, one UPDATE per
+    # conversation, in the same transaction. A conversation without
+    # messages is titled after its first user message in the same UPDATE,
+    # so concurrent writers cannot both retitle it, along with the
+    # context of the latest turn. Returns the saved messages.
+    counts = Counter()
+    latest = {}
+    titles = {}
+    for message in messages:
+        counts[message.conversation_id] += 1
+        last = latest.get(message.conversation_id)
+        if last is None or message.timestamp >= last.timestamp:
+            latest[message.conversation_id] = message
+        if message.is_user:
+            first = titles.get(message.conversation_id)
+            if first is None or message.timestamp < first.timestamp:
+                titles[message.conversation_id] = message
+
+    now = timezone.now()
+    with transaction.atomic():
+        messages = Message.objects.bulk_create(messages)
+        for conversation_id, count in counts.items():
+            last = latest[conversation_id]
+            fields = {
+                'message_count': F('message_count') + count,
+                'last_message_preview': message_preview(last.content),
+                'last_message_at': last.timestamp,
+                'updated_at': now,
+            }
+            if last.conversation.context is not None:
+                fields['context'] = last.conversation.context
+            if conversation_id in titles:
+                fields['title'] = Case(
+                    When(message_count=0, then=Value(conversation_title(titles[conversation_id].content))),
+                    default=F('title'),
+                )
+            Conversation.objects.filter(id=conversation_id).update(**fields)
+        user_ids = {message.conversation.user_id for message in messages}
+        transaction.on_commit(lambda: bump_list_versions(user_ids))
+    return messages
+
+
+def save_message(conversation, content, is_user=True, message_type='text'):
+    # Queues a Message for the write-behind buffer and returns it unsaved
+    message = Message(conversation=conversation, content=content, is_user=is_user, message_type=message_type)
+    get_message_buffer().add(message)
+    return message
+
+
+def flush_messages():
+    return get_message_buffer().flush()
+
+
+def pending_messages():
+    # Messages queued and not yet written, or None before the first one
+    buffer = _buffer
+    return len(buffer.pending) if buffer is not None else None
@@ -0,0 +1,105 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Message
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Words of a query beyond this are ignored
+MAX_TERMS = 16
+WORD = re.compile(r'\w+')
+
+# Ranks and cuts the page on the index alone (joining only to scope it),
+# then joins the page's rows for display. Joining first made SQLite build
+# every matching row before sorting. Unscoped, ordering by the rank column
+# lets FTS5 pick the top rows itself; scoped, the join filters first and
+# calling bm25() on what is left is cheaper. Ties go newest first, the same
+# in every page, so pages neither repeat nor skip rows.
+SEARCH_SQL = """
+    WITH page AS (
+        SELECT f.rowid AS id, {rank} AS rank,
+               snippet(chat_message_fts, 0, '[', ']', '…', 12) AS snippet
+        FROM chat_message_fts f {join}
+        WHERE chat_message_fts MATCH %s {scope}
+        ORDER BY rank, f.rowid DESC
+        LIMIT %s OFFSET %s
+    )
+    SELECT m.id, m.conversation_id, m.is_user, m.message_type, m.timestamp,
+           c.title AS conversation_title, page.snippet, page.rank
+    FROM page
+    JOIN chat_message m ON m.id = page.id
+    JOIN chat_conversation c ON c.id = m.conversation_id
+    ORDER BY page.rank, m.id DESC
+"""
+SCOPE_JOIN = """
+        JOIN chat_message m ON m.id = f.rowid
+        JOIN chat_conversation c ON c.id = m.conversation_id"""
+
+
+def fts_available():
+    # The chat_message_fts index only exists on SQLite, see migration 0005
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(text):
+    # FTS5 query for free text, or None when it has no words. Every word
+    # must occur, the last one as a prefix so results follow typing. Words
+    # are quoted, so FTS5 syntax in the text is searched for literally.
+    terms = WORD.findall(text.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+
+def search_messages(text, user=None, page=1, page_size=DEFAULT_PAGE_SIZE):
+    # (messages, has_next) for a page of messages matching text, best
+    # first, from the conversations of user or from all conversations.
+    # Messages of archived conversations are not searched, see
+    # chat.archive; opening a conversation brings them back.
+    # Messages carry conversation_title, snippet and rank (lower is better)
+    # and load other fields on access.
+    expression = match_expression(text)
+    if expression is None:
+        return [], False
+    offset = (page - 1) * page_size
+    if not fts_available():
+        return _like_search(text, user, offset, page_size)
+
+    if user is None:
+        sql = SEARCH_SQL.format(rank='f.rank', join='', scope='')
+        params = [expression]
+    else:
+        sql = SEARCH_SQL.format(rank='bm25(chat_message_fts)', join=SCOPE_JOIN, scope='AND c.user_id = %s')
+        params = [expression, user.id]
+    messages = list(Message.objects.raw(sql, params + [page_size + 1, offset]))
+    return messages[:page_size], len(messages) > page_size
+
+
+def _like_search(text, user, offset, page_size):
+    queryset = Message.objects.filter(content__icontains=text.strip()).select_related('conversation')
+    if user is not None:
+        queryset = queryset.filter(conversation__user=user)
+    messages = list(queryset.order_by('-timestamp', '-id')[offset:offset + page_size + 1])
+    for message in messages:
+        message.conversation_title = message.conversation.title
+        message.snippet = message.content[:200]
+        message.rank = None
+    return messages[:page_size], len(messages) > page_size
+
+
+def matching_ids(text):
+    # Subquery of the ids of messages matching text, for filter(id__in=...)
+    expression = match_expression(text)
+    if expression is None or not fts_available():
+        return None
+    return RawSQL('SELECT rowid FROM chat_message_fts WHERE chat_message_fts MATCH %s', [expression])
+
+
+def optimize_index():
+    # Merges the index segments. FTS5 records deletes as tombstones, so
+    # after removing many messages the index is larger until merged.
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO chat_message_fts(chat_message_fts) VALUES ('optimize')")
@@ -1,3 +1,838 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from agroai import database, metrics
+from agroai.sqlite.base import DatabaseWrapper
+
+from . import admission, archive, context, persistence, search
+from .admin import MessageAdmin
+from .layers import SQLiteChannelLayer
+from .ai_processor import AgroAIProcessor, assemble
+from .models import ArchivedConversation, Conversation, Message
+from .routing import websocket_urlpatterns
+
+
+class ProcessMessageQueryBudgetTests(TestCase):
+    # A turn may cost the request two queries: the session's user and the
+    # conversation. Its messages are written by the buffer, one INSERT per
+    # batch plus one UPDATE per conversation.
+    REQUEST_QUERIES = 2
+
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.conversation = Conversation.objects.create(user=self.user, title='New Conversation')
+        self.client.force_login(self.user)
+
+        # A buffer of our own that only writes when flushed by the test
+        self.buffer = persistence.MessageBuffer(max_size=1000, max_delay=3600)
+        self.previous_buffer, persistence._buffer = persistence._buffer, self.buffer
+        admission.reset_admission()
+
+    def tearDown(self):
+        persistence._buffer = self.previous_buffer
+        self.buffer.stop()
+
+    def post(self, message, conversation=None, status=200):
+        response = self.client.post('/chat/api/process-message/', json.dumps({
+            'conversation_id': (conversation or self.conversation).id,
+            'message': message,
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, status)
+        return response.json()
+
+    def test_turn_within_budget(self):
+        with self.assertNumQueries(self.REQUEST_QUERIES):
+            data = self.post('hello')
+        self.assertTrue(data['success'])
+
+    def test_later_turn_within_budget(self):
+        self.post('hello')
+        persistence.flush_messages()
+        with self.assertNumQueries(self.REQUEST_QUERIES):
+            data = self.post('what can you do?')
+        self.assertTrue(data['success'])
+
+    def test_batch_writes_in_two_queries(self):
+        for message in ('hello', 'hi again', 'thanks'):
+            self.post(message)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(persistence.flush_messages(), 6)
+        # Outside tests the transaction is not nested in a savepoint
+        statements = [q['sql'] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 2, statements)
+        self.assertEqual(self.conversation.messages.count(), 6)
+
+    def test_first_message_titles_conversation(self):
+        self.post('hello there')
+        persistence.flush_messages()
+        self.post('a second question')
+        persistence.flush_messages()
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.title, 'hello there')
+        self.assertEqual(self.conversation.message_count, 4)
+        self.assertEqual(self.conversation.last_message_at,
+                         Message.objects.filter(conversation=self.conversation).last().timestamp)
+
+    def test_long_first_message_title_truncated(self):
+        self.post('x' * 80)
+        persistence.flush_messages()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.title, 'x' * 50 + '...')
+
+    def test_other_users_conversation(self):
+        other = Conversation.objects.create(user=User.objects.create_user('other'), title='Theirs')
+        with self.assertNumQueries(self.REQUEST_QUERIES):
+            data = self.post('hello', conversation=other, status=404)
+        self.assertEqual(data, {'success': False, 'error': 'Conversation not found'})
+        self.assertEqual(persistence.flush_messages(), 0)
+
+    def test_missing_conversation(self):
+        missing = Conversation(id=self.conversation.id + 100)
+        data = self.post('hello', conversation=missing, status=404)
+        self.assertFalse(data['success'])
+
+    def test_message_id_is_null(self):
+        # The reply is still buffered when the response goes out
+        data = self.post('hello')
+        self.assertIn('message_id', data)
+        self.assertIsNone(data['message_id'])
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.post('/chat/api/process-message/', '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 302)
+
+
+class ConversationListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.client.force_login(self.user)
+
+    def get(self, **params):
+        return self.client.get('/chat/api/conversations/', params)
+
+    def test_cursor_walk_returns_every_row_once(self):
+        conversations = [Conversation.objects.create(user=self.user, title=f'c{i}') for i in range(7)]
+        Conversation.objects.create(user=User.objects.create_user('other'), title='Theirs')
+        # Ties on updated_at fall back to the id
+        tied = timezone.now()
+        Conversation.objects.filter(id__in=[c.id for c in conversations[2:5]]).update(updated_at=tied)
+
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.get(**params).json()
+            self.assertLessEqual(len(data['results']), 2)
+            seen.extend(row['id'] for row in data['results'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+
+        expected = list(Conversation.objects.filter(user=self.user)
+                        .order_by('-updated_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(set(seen)), 7)
+
+    def test_bad_cursor_or_limit(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'limit': 'ten'}):
+            response = self.get(**params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertFalse(response.json()['success'])
+
+    def test_denormalized_fields(self):
+        conversation = Conversation.objects.create(user=self.user, title='New Conversation')
+        start = timezone.now()
+        persistence.write_messages([
+            Message(conversation=conversation, content='how warm is it?', is_user=True,
+                    timestamp=start),
+            Message(conversation=conversation, content='About 18 degrees.', is_user=False,
+                    timestamp=start + timedelta(seconds=1)),
+        ])
+
+        row = self.get().json()['results'][0]
+        self.assertEqual(row['title'], 'how warm is it?')
+        self.assertEqual(row['message_count'], 2)
+        self.assertEqual(row['last_message_preview'], 'About 18 degrees.')
+        self.assertEqual(row['last_message_at'], (start + timedelta(seconds=1)).isoformat())
+
+    def test_unchanged_list_costs_no_queries(self):
+        conversation = Conversation.objects.create(user=self.user, title='New Conversation')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.get()
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/chat/api/conversations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            persistence.write_messages([Message(conversation=conversation, content='hello', is_user=True)])
+        response = self.client.get('/chat/api/conversations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['message_count'], 1)
+
+
+class MetricsEndpointTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.conversation = Conversation.objects.create(user=self.user, title='New Conversation')
+        self.client.force_login(self.user)
+        self.buffer = persistence.MessageBuffer(max_size=1000, max_delay=3600)
+        self.previous_buffer, persistence._buffer = persistence._buffer, self.buffer
+        admission.reset_admission()
+        metrics.reset()
+
+    def tearDown(self):
+        persistence._buffer = self.previous_buffer
+        self.buffer.stop()
+
+    def scrape(self):
+        with self.settings(METRICS_TOKEN='s3cret'):
+            return self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret').content.decode()
+
+    def test_turn_recorded(self):
+        self.client.post('/chat/api/process-message/', json.dumps({
+            'conversation_id': self.conversation.id,
+            'message': 'hello',
+        }), content_type='application/json')
+        body = self.scrape()
+        self.assertIn('agroai_http_request_queries_count{view="process_message"} 1', body)
+        self.assertIn('agroai_http_request_queries_sum{view="process_message"} 2', body)
+        self.assertIn('agroai_chat_turns_total{transport="http",outcome="ok"} 1', body)
+        for stage in ('auth', 'fetch', 'route', 'analysis', 'persist'):
+            self.assertIn(f'agroai_chat_stage_seconds_count{{transport="http",stage="{stage}"}}', body)
+
+    def test_histogram_buckets_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        body = histogram.render()
+        self.assertIn('test_seconds_bucket{le="0.1"} 1', body)
+        self.assertIn('test_seconds_bucket{le="1"} 2', body)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 3', body)
+        self.assertIn('test_seconds_count 3', body)
+
+    def test_forbidden_by_default(self):
+        # Even from loopback, which is every request behind a local proxy
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    def test_staff(self):
+        User.objects.filter(id=self.user.id).update(is_staff=True)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_token(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer guess').status_code, 403)
+        with self.settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_allowed_addresses(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.2').status_code, 403)
+
+
+@override_settings(CHAT_USER_RATE=0.5, CHAT_USER_BURST=2)
+class AdmissionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.conversation = Conversation.objects.create(user=self.user, title='New Conversation')
+        self.client.force_login(self.user)
+        self.buffer = persistence.MessageBuffer(max_size=1000, max_delay=3600)
+        self.previous_buffer, persistence._buffer = persistence._buffer, self.buffer
+        admission.reset_admission()
+        metrics.reset()
+
+    def tearDown(self):
+        persistence._buffer = self.previous_buffer
+        self.buffer.stop()
+        admission.reset_admission()
+
+    def post(self, message):
+        return self.client.post('/chat/api/process-message/', json.dumps({
+            'conversation_id': self.conversation.id,
+            'message': message,
+        }), content_type='application/json')
+
+    def test_user_rate_limited(self):
+        self.assertEqual(self.post('hello').status_code, 200)
+        self.assertEqual(self.post('hi').status_code, 200)
+        # Refused before the conversation is looked up
+        with self.assertNumQueries(1):
+            response = self.post('hi again')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(response.json()['reason'], 'user_rate')
+        self.assertEqual(admission.in_flight(), 0)
+        with self.settings(METRICS_TOKEN='s3cret'):
+            body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret').content.decode()
+        self.assertIn('agroai_chat_shed_total{transport="http",reason="user_rate"} 1', body)
+
+    def test_capacity(self):
+        controller = admission.AdmissionController(
+            user_rate=1, user_burst=5, connection_rate=1, connection_burst=5, max_in_flight=1)
+        bucket = controller.connection_bucket()
+        ticket = controller.admit(1, bucket)
+        with self.assertRaises(admission.Rejected) as rejected:
+            controller.admit(2, bucket)
+        self.assertEqual(rejected.exception.reason, 'capacity')
+        # The shed turn's tokens were given back
+        self.assertEqual(int(bucket.tokens), 4)
+        ticket.release()
+        ticket.release()
+        self.assertEqual(controller.in_flight, 0)
+        controller.admit(2).release()
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.conversation = Conversation.objects.create(user=self.user, title='Tides')
+        old = timezone.now() - timedelta(days=90)
+        persistence.write_messages([
+            Message(conversation=self.conversation, content=f'Question {i} about the Pacific?',
+                    is_user=i % 2 == 0, timestamp=old + timedelta(seconds=i))
+            for i in range(6)
+        ])
+        Conversation.objects.filter(id=self.conversation.id).update(updated_at=old)
+        self.contents = list(self.conversation.messages.values_list('id', 'content'))
+
+    def test_archive_and_reopen(self):
+        totals = archive.archive_idle_conversations(days=30)
+        self.assertEqual((totals['conversations'], totals['messages']), (1, 6))
+        self.assertFalse(Message.objects.exists())
+
+        self.client.force_login(self.user)
+        response = self.client.get(f'/chat/conversation/{self.conversation.id}/')
+        self.assertEqual([(m.id, m.content) for m in response.context['history']], self.contents)
+        self.assertFalse(ArchivedConversation.objects.exists())
+
+    def test_active_conversation_kept(self):
+        self.assertEqual(archive.archive_idle_conversations(days=365)['conversations'], 0)
+        self.assertEqual(Message.objects.count(), 6)
+
+    def test_later_messages_merged(self):
+        archive.archive_idle_conversations(days=30)
+        Message.objects.create(conversation=self.conversation, content='Back again',
+                               timestamp=timezone.now() - timedelta(days=60))
+        archive.archive_idle_conversations(days=30)
+        self.assertEqual(ArchivedConversation.objects.get().message_count, 7)
+        self.assertEqual(archive.rehydrate(Conversation.objects.get(id=self.conversation.id)), 7)
+
+    def test_rehydrated_conversation_not_archived_again(self):
+        archive.archive_idle_conversations(days=30)
+        conversation = Conversation.objects.get(id=self.conversation.id)
+        self.assertEqual(archive.rehydrate(conversation), 6)
+        self.assertGreater(conversation.updated_at, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(archive.archive_idle_conversations(days=30)['conversations'], 0)
+        self.assertEqual(Message.objects.count(), 6)
+
+    def test_context_of_archived_conversation(self):
+        # A turn over the WebSocket or the API, without opening the page
+        archive.archive_idle_conversations(days=30)
+        conversation = Conversation.objects.get(id=self.conversation.id)
+        conversation.context = None
+        self.assertEqual(context.load_context(conversation)['region'], ['Pacific'])
+        self.assertFalse(ArchivedConversation.objects.exists())
+
+    def test_archived_messages_not_searched(self):
+        self.assertEqual(len(search.search_messages('pacific', user=self.user)[0]), 6)
+        archive.archive_idle_conversations(days=30)
+        self.assertEqual(search.search_messages('pacific', user=self.user), ([], False))
+        archive.rehydrate(Conversation.objects.get(id=self.conversation.id))
+        self.assertEqual(len(search.search_messages('pacific', user=self.user)[0]), 6)
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    def wrapper(self, **options):
+        return DatabaseWrapper({
+            'ENGINE': 'agroai.sqlite', 'NAME': ':memory:', 'OPTIONS': options, 'TIME_ZONE': None,
+            'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'AUTOCOMMIT': True, 'ATOMIC_REQUESTS': False,
+            'USER': '', 'PASSWORD': '', 'HOST': '', 'PORT': '', 'TEST': {},
+        }, alias='profile-test')
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    @override_settings(SQLITE_PRAGMAS={'cache_size': -1234, 'journal_mode': 'MEMORY'})
+    def test_pragmas_applied(self):
+        writer, reader = self.wrapper(), self.wrapper(read_only=True)
+        try:
+            self.assertEqual(self.pragma(writer, 'cache_size'), -1234)
+            self.assertEqual(self.pragma(writer, 'journal_mode'), 'memory')
+            self.assertEqual(self.pragma(writer, 'query_only'), 0)
+            self.assertEqual(self.pragma(reader, 'cache_size'), -1234)
+            self.assertEqual(self.pragma(reader, 'query_only'), 1)
+        finally:
+            writer.close()
+            reader.close()
+
+    def test_immediate_transactions(self):
+        wrapper = self.wrapper(transaction_mode='IMMEDIATE')
+        try:
+            with CaptureQueriesContext(wrapper) as queries:
+                wrapper._start_transaction_under_autocommit()
+            self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+            wrapper.rollback()
+        finally:
+            wrapper.close()
+
+    def test_bad_transaction_mode(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.wrapper(transaction_mode='LAZY').get_connection_params()
+
+    def test_reads_routed_outside_transactions(self):
+        router = database.ReadOnlyRouter()
+        self.assertEqual(router.db_for_read(Conversation), database.READ_ALIAS)
+        self.assertEqual(router.db_for_write(Conversation), 'default')
+
+    def test_write_queue_single_thread(self):
+        writer = database.WriteQueue()
+        try:
+            names = {writer.submit(lambda: threading.current_thread().name).result() for _ in range(5)}
+            self.assertEqual(names, {'db-writer'})
+            with self.assertRaises(ZeroDivisionError):
+                writer.submit(lambda: 1 / 0).result()
+        finally:
+            writer.stop()
+
+
+class IntentRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.processor = AgroAIProcessor()
+
+    def test_greetings(self):
+        self.assertEqual(self.processor.route('Hi there')[0], 'greeting')
+        self.assertEqual(self.processor.route('Good morning!')[0], 'greeting')
+
+    def test_greeting_words_only_as_written(self):
+        intent, intents = self.processor.route('Show his salinity chart for the Pacific')
+        self.assertEqual(intent, 'ocean')
+        self.assertNotIn('greeting', intents['intent'])
+        self.assertEqual(intents['region'], ('Pacific',))
+
+    def test_parameter_without_ocean_keyword(self):
+        self.assertEqual(self.processor.route('temps off Chile')[0], 'ocean')
+        self.assertEqual(self.processor.route('plot it')[0], 'visualization')
+        self.assertEqual(self.processor.route('what time is it')[0], 'general')
+
+
+class VisualizationStreamTests(TestCase):
+    def test_without_intents(self):
+        # Classified from the message when the caller has not routed it
+        response = assemble(AgroAIProcessor()._stream_visualization('plot temperature over the past 2 weeks'))
+        self.assertEqual(response['type'], 'visualization')
+        self.assertEqual(response['visualization_data']['time_range'], '14 days')
+
+
+@override_settings(**admission.UNLIMITED_SETTINGS)
+class ChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.conversation = Conversation.objects.create(user=self.user, title='New Conversation')
+        self.buffer = persistence.MessageBuffer(max_size=1000, max_delay=3600)
+        self.previous_buffer, persistence._buffer = persistence._buffer, self.buffer
+        admission.reset_admission()
+
+    def tearDown(self):
+        persistence._buffer = self.previous_buffer
+        self.buffer.stop()
+        admission.reset_admission()
+
+    async def connect(self, user=None, conversation=None):
+        conversation = conversation or self.conversation
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{conversation.id}/')
+        communicator.scope['user'] = user or self.user
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def test_anonymous_rejected(self):
+        communicator, connected = await self.connect(user=AnonymousUser())
+        self.assertFalse(connected)
+
+    async def test_other_users_conversation_rejected(self):
+        other = await database_sync_to_async(User.objects.create_user)('pirate', password='secret')
+        communicator, connected = await self.connect(user=other)
+        self.assertFalse(connected)
+
+    async def test_reply(self):
+        communicator, connected = await self.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to({'message': 'Hello there'})
+        frames = [await communicator.receive_json_from(timeout=5) for _ in range(2)]
+        self.assertEqual([frame['type'] for frame in frames], ['chunk', 'final'])
+        self.assertEqual(frames[1]['message']['content'], frames[0]['content'])
+        await communicator.disconnect()
+        # Both messages were written out on disconnect
+        self.assertEqual(await Message.objects.filter(conversation=self.conversation).acount(), 2)
+
+    async def test_failed_turn_keeps_inbox_running(self):
+        # Saving the first reply fails after it was streamed
+        failures = [DatabaseError('disk full')]
+
+        def save_message(conversation, content, is_user=True, message_type='text'):
+            if not is_user and failures:
+                raise failures.pop()
+            return persistence.save_message(conversation, content, is_user, message_type)
+
+        communicator, _ = await self.connect()
+        with mock.patch('chat.consumers.save_message', save_message), self.assertLogs('chat.consumers', 'ERROR'):
+            await communicator.send_json_to({'message': 'Hello there'})
+            # The error frame is sent directly and can overtake the group's
+            frames = {frame['type']: frame for frame in
+                      [await communicator.receive_json_from(timeout=5) for _ in range(3)]}
+            self.assertEqual(sorted(frames), ['chunk', 'error', 'final'])
+            self.assertEqual(frames['error']['error'], 'disk full')
+
+            await communicator.send_json_to({'message': 'Hello again'})
+            frames = [await communicator.receive_json_from(timeout=5) for _ in range(2)]
+            self.assertEqual([frame['type'] for frame in frames], ['chunk', 'final'])
+        await communicator.disconnect()
+        self.assertEqual(await Message.objects.filter(conversation=self.conversation).acount(), 3)
+        self.assertEqual(admission.in_flight(), 0)
+
+    async def test_streamed_sections(self):
+        communicator, _ = await self.connect()
+        await communicator.send_json_to({'message': 'What is the temperature in the Pacific?'})
+        frames = []
+        while not frames or frames[-1]['type'] != 'final':
+            frames.append(await communicator.receive_json_from(timeout=30))
+        chunks, final = frames[:-1], frames[-1]
+        self.assertTrue(chunks[0]['transient'])
+        self.assertEqual([chunk['seq'] for chunk in chunks], list(range(1, len(chunks) + 1)))
+        self.assertEqual(final['seq'], len(chunks) + 1)
+        # The message is the content sections, without the progress note
+        content = ''.join(chunk['content'] for chunk in chunks if not chunk.get('transient'))
+        self.assertEqual(final['message']['content'], content)
+        self.assertEqual(final['message']['type'], 'data_analysis')
+        await communicator.disconnect()
+        saved = await Message.objects.filter(conversation=self.conversation, is_user=False).aget()
+        self.assertEqual(saved.content, content)
+
+    @override_settings(CHAT_CONNECTION_RATE=0.1, CHAT_CONNECTION_BURST=1)
+    async def test_rate_limited(self):
+        communicator, _ = await self.connect()
+        await communicator.send_json_to({'message': 'Hello'})
+        await communicator.send_json_to({'message': 'Hello again'})
+        frames = [await communicator.receive_json_from(timeout=5) for _ in range(3)]
+        limited = [frame for frame in frames if frame['type'] == 'rate_limited']
+        self.assertEqual(len(limited), 1)
+        self.assertEqual((limited[0]['message'], limited[0]['reason']), ('Hello again', 'connection_rate'))
+        self.assertGreater(limited[0]['retry_after'], 5)
+        self.assertEqual([frame['type'] for frame in frames if frame is not limited[0]], ['chunk', 'final'])
+        await communicator.disconnect()
+        # The refused message was neither answered nor saved
+        self.assertEqual(await Message.objects.filter(conversation=self.conversation).acount(), 2)
+        self.assertEqual(admission.in_flight(), 0)
+
+    @override_settings(CHAT_INBOX_SIZE=1)
+    async def test_busy_when_inbox_full(self):
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def stream_reply(consumer, message):
+            started.set()
+            await release.wait()
+            return {'content': message, 'type': 'text'}
+
+        with mock.patch('chat.consumers.ChatConsumer.stream_reply', stream_reply):
+            communicator, _ = await self.connect()
+            await communicator.send_json_to({'message': 'first'})
+            await started.wait()
+            await communicator.send_json_to({'message': 'second'})
+            await communicator.send_json_to({'message': 'third'})
+            frame = await communicator.receive_json_from(timeout=5)
+            self.assertEqual((frame['type'], frame['message']), ('busy', 'third'))
+            release.set()
+            await communicator.disconnect()
+
+
+class PoisonedBuffer(persistence.MessageBuffer):
+    # Fails every write that includes a message saying 'poison'
+    def _write(self, batch):
+        if any(message.content == 'poison' for message in batch):
+            raise DatabaseError('cannot write poison')
+        super()._write(batch)
+
+
+class MessageBufferFailureTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.first = Conversation.objects.create(user=self.user, title='First')
+        self.second = Conversation.objects.create(user=self.user, title='Second')
+        self.buffer = PoisonedBuffer(max_size=1000, max_delay=3600, max_attempts=3)
+        self.addCleanup(self.buffer.stop)
+        metrics.reset()
+
+    def add(self, conversation, content):
+        self.buffer.add(Message(conversation=conversation, content=content, is_user=True))
+
+    def contents(self, conversation):
+        return list(conversation.messages.order_by('id').values_list('content', flat=True))
+
+    def test_failing_message_is_retried_alone_then_dropped(self):
+        self.add(self.first, 'one')
+        self.add(self.first, 'poison')
+        self.add(self.first, 'three')
+        self.add(self.second, 'four')
+        with self.assertLogs('chat.persistence', 'WARNING'):
+            self.assertEqual(self.buffer.flush(), 2)
+        # Later messages of the conversation wait behind the failed one
+        self.assertEqual(self.contents(self.first), ['one'])
+        self.assertEqual(self.contents(self.second), ['four'])
+        self.assertEqual([message.content for message in self.buffer.pending], ['poison', 'three'])
+
+        with self.assertLogs('chat.persistence', 'WARNING'):
+            self.assertEqual(self.buffer.flush(), 0)
+        with self.assertLogs('chat.persistence', 'ERROR') as logs:
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertIn('Dropping chat message', logs.output[-1])
+        self.assertEqual(self.contents(self.first), ['one', 'three'])
+        self.assertEqual(self.buffer.pending, [])
+        self.assertEqual(self.buffer.failures, {})
+        self.assertIn('agroai_chat_messages_dropped_total 1', metrics.render())
+
+
+class ConversationContextTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.conversation = Conversation.objects.create(user=self.user, title='New Conversation')
+        self.processor = AgroAIProcessor()
+
+    def turn(self, message):
+        return self.processor.route(message, self.conversation)[1]
+
+    def test_follow_ups(self):
+        self.turn('Temperature in the Pacific over the last 7 days')
+        intents = self.turn('and salinity?')
+        self.assertEqual((intents['parameter'], intents['region'], intents['days']), (('salinity',), ('Pacific',), 7))
+        intents = self.turn('What about the Atlantic?')
+        self.assertEqual((intents['parameter'], intents['region']), (('salinity',), ('Atlantic',)))
+        intents = self.turn('marine ecosystem health')
+        self.assertEqual((intents['parameter'], intents['topic']), ((), ('ecosystem',)))
+
+    def test_every_region_kept(self):
+        self.turn('Compare pH in the Pacific and the Atlantic')
+        intents = self.turn('and oxygen?')
+        self.assertEqual(intents['region'], ('Pacific', 'Atlantic'))
+        self.assertEqual(self.conversation.context['region'], ['Pacific', 'Atlantic'])
+
+    def test_unrelated_turn_keeps_context(self):
+        self.turn('pH in the Arctic')
+        saved = dict(self.conversation.context)
+        self.assertEqual(self.processor.route('Hello!', self.conversation)[0], 'greeting')
+        self.assertEqual(self.conversation.context, saved)
+
+    def test_load_context_from_history(self):
+        for content in ('Temperature in the Indian ocean', 'Show me a chart for the past month', 'hi'):
+            Message.objects.create(conversation=self.conversation, content=content, is_user=True)
+            Message.objects.create(conversation=self.conversation, content='reply', is_user=False)
+        Conversation.objects.filter(id=self.conversation.id).update(message_count=6)
+        self.conversation.refresh_from_db()
+        self.assertIsNone(self.conversation.context)
+        with self.assertNumQueries(1):
+            loaded = context.load_context(self.conversation)
+        self.assertEqual(loaded, {'region': ['Indian'], 'parameter': ['temperature'], 'topic': [], 'days': 30})
+        with self.assertNumQueries(0):
+            context.load_context(self.conversation)
+
+    def test_recent_messages_use_index(self):
+        plan = (Message.objects.filter(conversation_id=self.conversation.id, is_user=True)
+                .order_by('-timestamp', '-id').explain())
+        self.assertIn('message_conversation_time', plan)
+        for i in range(12):
+            Message.objects.create(conversation=self.conversation, content=f'turn {i}', is_user=True)
+        rows = context.recent_messages(self.conversation.id, turns=3)
+        self.assertEqual([row['content'] for row in rows], ['turn 9', 'turn 10', 'turn 11'])
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.other = User.objects.create_user('pirate', password='secret')
+        self.conversation = Conversation.objects.create(user=self.user, title='Pacific survey')
+        self.foreign = Conversation.objects.create(user=self.other, title='Hidden cove')
+
+    def add(self, content, conversation=None):
+        return Message.objects.create(conversation=conversation or self.conversation, content=content, is_user=True)
+
+    def ids(self, text, user=None, **kwargs):
+        return [message.id for message in search.search_messages(text, user=user or self.user, **kwargs)[0]]
+
+    def test_ranked_best_first(self):
+        once = self.add('The survey logged temperature, oxygen, turbidity, chlorophyll and salinity near the reef')
+        often = self.add('Salinity, salinity and more salinity')
+        self.add('Nothing relevant here')
+        self.assertEqual(self.ids('salinity'), [often.id, once.id])
+
+    def test_scoped_to_user(self):
+        own = self.add('Salinity near Hawaii')
+        foreign = self.add('Salinity near the hidden cove', self.foreign)
+        self.assertEqual(self.ids('salinity'), [own.id])
+        self.assertEqual(self.ids('salinity', user=self.other), [foreign.id])
+        self.assertCountEqual([m.id for m in search.search_messages('salinity')[0]], [own.id, foreign.id])
+
+    def test_prefix_and_every_word(self):
+        message = self.add('Temperatures are rising in the Pacific')
+        self.add('Temperatures are rising in the Atlantic')
+        self.assertEqual(self.ids('pacific tempera'), [message.id])
+        self.assertEqual(self.ids('temperature pacif'), [message.id])
+        self.assertEqual(self.ids('"NEAR( pacific'), [])
+        self.assertEqual(search.search_messages('?!', user=self.user), ([], False))
+
+    def test_pages(self):
+        for i in range(5):
+            self.add(f'Oxygen reading {i}')
+        first, has_next = search.search_messages('oxygen', user=self.user, page_size=3)
+        second, last = search.search_messages('oxygen', user=self.user, page=2, page_size=3)
+        self.assertEqual((len(first), has_next, len(second), last), (3, True, 2, False))
+        self.assertFalse({m.id for m in first} & {m.id for m in second})
+        self.assertIn('[Oxygen]', first[0].snippet)
+        self.assertEqual(first[0].conversation_title, 'Pacific survey')
+
+    def test_index_follows_writes(self):
+        message = self.add('Chlorophyll bloom')
+        Message.objects.bulk_create([Message(conversation=self.conversation, content='Plankton bloom', is_user=False)])
+        self.assertEqual(len(self.ids('bloom')), 2)
+        message.content = 'Algae bloom'
+        message.save()
+        self.assertEqual(self.ids('chlorophyll'), [])
+        self.assertEqual(self.ids('algae'), [message.id])
+        message.delete()
+        self.assertEqual(self.ids('algae'), [])
+        search.optimize_index()
+        self.assertEqual(len(self.ids('bloom')), 1)
+
+    def test_admin_search(self):
+        content = self.add('Salinity near Hawaii')
+        titled = self.add('Unrelated words', self.foreign)
+        self.add('Nothing relevant')
+        model_admin = MessageAdmin(Message, admin.site)
+        request = RequestFactory().get('/admin/chat/message/', {'q': 'salinity'})
+        results, may_have_duplicates = model_admin.get_search_results(request, Message.objects.all(), 'salinity')
+        self.assertFalse(may_have_duplicates)
+        self.assertEqual(list(results), [content])
+        results, _ = model_admin.get_search_results(request, Message.objects.all(), 'hidden cove')
+        self.assertEqual(list(results), [titled])
+
+    def test_view(self):
+        self.add('Salinity near Hawaii')
+        self.add('Salinity near the hidden cove', self.foreign)
+        self.client.force_login(self.user)
+        response = self.client.get('/chat/api/search/', {'q': 'salin'})
+        self.assertEqual([r['conversation_title'] for r in response.json()['results']], ['Pacific survey'])
+        self.assertEqual(self.client.get('/chat/api/search/', {'q': ' '}).status_code, 400)
+
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    # Two layers on one file stand in for two worker processes
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'channels.sqlite3')
+
+    def layers(self, **config):
+        return SQLiteChannelLayer(self.path, **config), SQLiteChannelLayer(self.path, **config)
+
+    async def close(self, *layers):
+        for layer in layers:
+            await layer.close()
+
+    async def assertNothingReceived(self, layer, channel):
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.3)
+
+    async def test_group_fan_out_between_processes(self):
+        first, second = self.layers()
+        try:
+            channels = [await first.new_channel(), await second.new_channel()]
+            for layer, channel in zip((first, second), channels):
+                await layer.group_add('chat_1', channel)
+            await first.group_send('chat_1', {'type': 'chat.message', 'payload': b'\x00\xff', 'seq': 1})
+            for layer, channel in zip((first, second), channels):
+                message = await asyncio.wait_for(layer.receive(channel), 5)
+                self.assertEqual(message, {'type': 'chat.message', 'payload': b'\x00\xff', 'seq': 1})
+            await second.group_discard('chat_1', channels[1])
+            await first.group_send('chat_1', {'type': 'chat.message'})
+            self.assertEqual(await asyncio.wait_for(first.receive(channels[0]), 5), {'type': 'chat.message'})
+            await self.assertNothingReceived(second, channels[1])
+        finally:
+            await self.close(first, second)
+
+    async def test_capacity(self):
+        sender, receiver = self.layers(capacity=2)
+        try:
+            channel = await receiver.new_channel()
+            for seq in range(2):
+                await sender.send(channel, {'type': 'm', 'seq': seq})
+            with self.assertRaises(ChannelFull):
+                await sender.send(channel, {'type': 'm', 'seq': 2})
+            self.assertEqual((await asyncio.wait_for(receiver.receive(channel), 5))['seq'], 0)
+            # The receiver took both; one is buffered, so it takes one more
+            # and leaves the next stored, where it still counts
+            for seq in (2, 3):
+                await sender.send(channel, {'type': 'm', 'seq': seq})
+            while receiver.queue_depth() < 2:
+                await asyncio.sleep(0.01)
+            await sender.send(channel, {'type': 'm', 'seq': 4})
+            with self.assertRaises(ChannelFull):
+                await sender.send(channel, {'type': 'm', 'seq': 5})
+            self.assertEqual(receiver.queue_depth(), 2)
+            received = [(await asyncio.wait_for(receiver.receive(channel), 5))['seq'] for _ in range(4)]
+            self.assertEqual(received, [1, 2, 3, 4])
+        finally:
+            await self.close(sender, receiver)
+
+    async def test_expiry(self):
+        sender, receiver = self.layers(expiry=0.1)
+        try:
+            channel = await receiver.new_channel()
+            await receiver.group_add('chat_1', channel)
+            await sender.send(channel, {'type': 'm'})
+            await asyncio.sleep(0.2)
+            await self.assertNothingReceived(receiver, channel)
+            # Expired messages no longer count against capacity
+            await sender.send(channel, {'type': 'm', 'fresh': True})
+            self.assertEqual(await asyncio.wait_for(receiver.receive(channel), 5), {'type': 'm', 'fresh': True})
+        finally:
+            await self.close(sender, receiver)
+
+    async def test_flush(self):
+        sender, receiver = self.layers()
+        try:
+            channel = await receiver.new_channel()
+            await receiver.group_add('chat_1', channel)
+            await sender.send(channel, {'type': 'm'})
+            await sender.flush()
+            await sender.group_send('chat_1', {'type': 'm'})
+            await self.assertNothingReceived(receiver, channel)
+        finally:
+            await self.close(sender, receiver)
@@ -1,12 +1,28 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import login, authenticate, logout
-from django.views.decorators.csrf import csrf_exempt
+from django.contrib.auth import login, authenticate, logout, get_user, SESSION_KEY
+from django.contrib.auth.views import redirect_to_login
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control
 from django.contrib import messages
+import functools
+import hashlib
 import json
-from .models import Conversation, Message
-from .ai_processor import AgroAIProcessor
+import math
+from asgiref.sync import sync_to_async
+from agroai.database import write
+from agroai.metrics import chat_shed_total, chat_stage_seconds, chat_turns_total
+from data.queries import InvalidQuery
+from .models import Conversation
+from .admission import Rejected, get_admission
+from .ai_processor import get_processor
+from .archive import rehydrate
+from .context import load_context
+from .conversations import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, conversations_page, list_version
+from .executor import run_in_executor
+from .persistence import flush_messages, save_message
+from .search import DEFAULT_PAGE_SIZE as SEARCH_PAGE_SIZE, MAX_PAGE_SIZE as MAX_SEARCH_PAGE_SIZE, search_messages
 
 def home(request):
     return render(request, 'chat/home.html')
@@ -55,35 +71,124 @@ def register_view(request):
 @login_required
 def chat_interface(request, conversation_id=None):
     if conversation_id:
-        conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
+        conversation = get_object_or_404(Conversation.objects.select_related('archive'),
+                                         id=conversation_id, user=request.user)
     else:
         # Get or create a default conversation
-        conversation, created = Conversation.objects.get_or_create(
+        conversation, created = write(
+            Conversation.objects.get_or_create,
             user=request.user,
             title="New Conversation",
             defaults={'title': 'New Conversation'}
         )
         conversation_id = conversation.id
     
+    # Write out buffered messages first and bring back archived ones, so
+    # the history includes them
+    flush_messages()
+    rehydrate(conversation)
     return render(request, 'chat/chat_interface.html', {
         'conversation': conversation,
-        'conversation_id': conversation_id
+        'conversation_id': conversation_id,
+        'history': conversation.messages.all(),
     })
 
+def _conversation_list_etag(request):
+    # Read from the session and the default cache only, so a client whose
+    # list has not changed gets its 304 without a database query
+    user_id = request.session.get(SESSION_KEY)
+    if user_id is None:
+        return None
+    # Each page of the list has its own tag
+    query = hashlib.sha1(request.GET.urlencode().encode('utf-8')).hexdigest()[:12]
+    return f'{list_version(user_id)}-{query}'
+
+# condition() goes outside login_required so that 304s skip the user lookup.
+# Only an ETag is sent: Last-Modified has whole-second precision, so two
+# writes within a second would leave If-Modified-Since clients on a stale 304.
+@condition(etag_func=_conversation_list_etag)
 @login_required
 def get_conversations(request):
-    conversations = Conversation.objects.filter(user=request.user).order_by('-updated_at')
-    data = [{
-        'id': conv.id,
-        'title': conv.title,
-        'updated_at': conv.updated_at.strftime('%Y-%m-%d %H:%M')
-    } for conv in conversations]
-    return JsonResponse(data, safe=False)
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        rows, next_cursor = conversations_page(request.user, request.GET.get('cursor'), limit)
+    except (ValueError, InvalidQuery) as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    results = [{
+        'id': conv['id'],
+        'title': conv['title'],
+        'updated_at': conv['updated_at'].strftime('%Y-%m-%d %H:%M'),
+        'message_count': conv['message_count'],
+        'last_message_preview': conv['last_message_preview'],
+        'last_message_at': conv['last_message_at'].isoformat() if conv['last_message_at'] else None,
+    } for conv in rows]
+    response = JsonResponse({'success': True, 'results': results, 'next_cursor': next_cursor})
+    # Let browsers keep the page but revalidate it on every poll
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 @login_required
-@csrf_exempt
-def process_message(request):
+def search_conversations(request):
+    # Ranked full-text search over the user's own messages
+    query = request.GET.get('q', '')
+    if not query.strip():
+        return JsonResponse({'success': False, 'error': 'Missing q'}, status=400)
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        page_size = min(max(int(request.GET.get('limit', SEARCH_PAGE_SIZE)), 1), MAX_SEARCH_PAGE_SIZE)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    # Write out buffered messages first so they can be found
+    flush_messages()
+    results, has_next = search_messages(query, user=request.user, page=page, page_size=page_size)
+    return JsonResponse({
+        'success': True,
+        'results': [{
+            'id': message.id,
+            'conversation_id': message.conversation_id,
+            'conversation_title': message.conversation_title,
+            'snippet': message.snippet,
+            'is_user': message.is_user,
+            'message_type': message.message_type,
+            'timestamp': message.timestamp.isoformat(),
+        } for message in results],
+        'page': page,
+        'has_next': has_next,
+    })
+
+# Async, so a turn waiting on its analysis holds no worker thread. Django
+# 4.2's login_required and csrf_exempt wrap views in sync functions, hence
+# the inline login check and the csrf_exempt attribute below. A turn costs
+# two queries (the session's user and the conversation); both messages go
+# to the write-behind buffer, which also keeps the conversation's counters
+# and sets its title from the first message. Every stage of the turn is
+# timed into agroai_chat_stage_seconds. Turns refused by admission control
+# get a 429 with Retry-After before any further query, and a conversation
+# that is missing or belongs to another user gets a 404.
+async def process_message(request):
+    timed = functools.partial(chat_stage_seconds.time, transport='http')
+    with timed(stage='auth'):
+        user = await sync_to_async(get_user)(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
     if request.method == 'POST':
+        try:
+            ticket = get_admission().admit(user.pk)
+        except Rejected as e:
+            chat_shed_total.inc(transport='http', reason=e.reason)
+            chat_turns_total.inc(transport='http', outcome='shed')
+            response = JsonResponse({
+                'success': False,
+                'error': str(e),
+                'reason': e.reason,
+                'retry_after': round(e.retry_after, 2),
+            }, status=429)
+            response['Retry-After'] = str(math.ceil(e.retry_after))
+            return response
+
         try:
             data = json.loads(request.body)
             conversation_id = data.get('conversation_id')
@@ -92,39 +197,50 @@ def process_message(request):
             if not conversation_id or not message:
                 return JsonResponse({'success': False, 'error': 'Missing conversation_id or message'})
             
-            conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
+            with timed(stage='fetch'):
+                conversation = await Conversation.objects.filter(id=conversation_id, user=user).afirst()
+            if conversation is None:
+                chat_turns_total.inc(transport='http', outcome='error')
+                return JsonResponse({'success': False, 'error': 'Conversation not found'}, status=404)
             
             # Save user message
-            user_message = Message.objects.create(
-                conversation=conversation,
-                content=message,
-                is_user=True
-            )
+            with timed(stage='persist'):
+                save_message(conversation, message, is_user=True)
             
-            # Process with AgroAI
-            ai_processor = AgroAIProcessor()
-            response = ai_processor.process_message(message, conversation)
+            # Process with AgroAI; analyses run on the chat executor
+            processor = get_processor()
+            if conversation.context is None:
+                with timed(stage='context'):
+                    await sync_to_async(load_context)(conversation)
+            with timed(stage='route'):
+                intent, intents = processor.route(message, conversation)
+            with timed(stage='analysis'):
+                if intent in processor.DATA_INTENTS:
+                    response = await run_in_executor(processor.respond, intent, intents, message, conversation)
+                else:
+                    response = processor.respond(intent, intents, message, conversation)
             
             # Save AI response
-            ai_message = Message.objects.create(
-                conversation=conversation,
-                content=response['content'],
-                is_user=False,
-                message_type=response.get('type', 'text')
-            )
-            
-            # Update conversation title if it's the first message
-            if conversation.messages.count() == 2:  # User message + AI response
-                conversation.title = message[:50] + "..." if len(message) > 50 else message
-                conversation.save()
+            with timed(stage='persist'):
+                save_message(conversation, response['content'], is_user=False,
+                             message_type=response.get('type', 'text'))
+            chat_turns_total.inc(transport='http', outcome='ok')
             
+            # The reply is still in the write-behind buffer, which assigns
+            # its id when it is flushed, so message_id is always null here.
+            # Clients needing the id read it from the conversation history.
             return JsonResponse({
                 'success': True,
                 'response': response,
-                'message_id': ai_message.id
+                'message_id': None,
             })
         
         except Exception as e:
+            chat_turns_total.inc(transport='http', outcome='error')
             return JsonResponse({'success': False, 'error': str(e)})
+        finally:
+            ticket.release()
     
-    return JsonResponse({'success': False, 'error': 'Invalid request method'})
\ No newline at end of file
+    return JsonResponse({'success': False, 'error': 'Invalid request method'})
+
+process_message.csrf_exempt = True
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+KEY_PREFIX = 'ocean-analysis'
+VERSION_PREFIX = 'ocean-data-version'
+# Version slot of analyses that span every region
+ALL_REGIONS = '*'
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def get_analysis_cache():
+    # Size bound and TTL come from the CACHES entry: LocMemCache evicts
+    # least recently used entries, FileBasedCache is shared by workers
+    return caches[getattr(settings, 'OCEAN_ANALYSIS_CACHE', 'default')]
+
+
+def _version_key(region, parameter):
+    return f'{VERSION_PREFIX}:{region.lower() if region else ALL_REGIONS}:{parameter}'
+
+
+def data_versions(cache, region, parameters):
+    # Current data version token of each parameter in the region. Tokens
+    # are random rather than counters, so a token lost to eviction comes
+    # back as a new value and can never revive stale entries.
+    keys = [_version_key(region, parameter) for parameter in parameters]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = cache.get_or_set(key, uuid.uuid4().hex, timeout=None)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(pairs):
+    # Marks every cached analysis over the (region, parameter) pairs, and
+    # over all regions for those parameters, as stale
+    tokens = {}
+    for region, parameter in pairs:
+        tokens[_version_key(region, parameter)] = uuid.uuid4().hex
+        tokens[_version_key(None, parameter)] = uuid.uuid4().hex
+    if tokens:
+        get_analysis_cache().set_many(tokens, timeout=None)
+
+
+def cached_analysis(kind, key_parts, region, parameters, compute):
+    # compute() once per normalized request and data version. The versions
+    # are read before computing, so a batch ingested meanwhile leaves the
+    # result under a key that is never looked up again.
+    cache = get_analysis_cache()
+    versions = data_versions(cache, region, parameters)
+    digest = hashlib.sha1(
+        json.dumps([kind, key_parts, versions], sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+    key = f'{KEY_PREFIX}:{kind}:{digest}'
+
+    result = cache.get(key)
+    if result is not None:
+        _count('hits')
+        return result
+    _count('misses')
+    result = compute()
+    cache.set(key, result)
+    return result
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    # Hit and miss counters of this process
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / lookups, 4) if lookups else None,
+    }
+
+
+def lookup_counts():
+    # For the agroai_cache_lookups_total metric
+    counts = stats()
+    return {('analysis', 'hit'): counts['hits'], ('analysis', 'miss'): counts['misses']}
+
+
+def hit_ratio():
+    ratio = stats()['hit_ratio']
+    return {('analysis',): ratio} if ratio is not None else None
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats['hits'] = _stats['misses'] = 0
+
+
+def bump_ingested_versions(sender, batch_id, rows, **kwargs):
+    # ocean_data_ingested receiver
+    bump_versions({(row.region, row.parameter) for row in rows})
+
+
+def bump_changed_row_version(sender, instance, **kwargs):
+    # post_save/post_delete receiver for writes outside the ingestion path
+    pair = (instance.region, instance.parameter)
+    transaction.on_commit(lambda: bump_versions([pair]))
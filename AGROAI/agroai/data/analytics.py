@@ -0,0 +1,89 @@
+import numpy as np
+
+DAY = 86400.0
+DECADE = 10 * 365.25 * DAY
+
+# Dissolved oxygen below this is hypoxic (mg/L)
+HYPOXIA_THRESHOLD = 2.0
+
+# Shorter records cannot separate a trend from the seasonal cycle
+MIN_TREND_SPAN_DAYS = 365
+
+
+def month_index(timestamps):
+    # Calendar month (0-11) of each epoch-seconds timestamp
+    return timestamps.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64) % 12
+
+
+def monthly_climatology(timestamps, values):
+    # Mean value per calendar month over the whole record; NaN for months
+    # with no observations.
+    months = month_index(timestamps)
+    counts = np.bincount(months, minlength=12)
+    sums = np.bincount(months, weights=values, minlength=12)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def anomalies(timestamps, values, climatology=None):
+    if climatology is None:
+        climatology = monthly_climatology(timestamps, values)
+    return values - climatology[month_index(timestamps)]
+
+
+def recent_mask(timestamps, window_days):
+    return timestamps >= timestamps[-1] - window_days * DAY
+
+
+def current_value(timestamps, values, window_days=7):
+    # Mean of the most recent `window_days` of data, so one noisy
+    # reading does not dominate.
+    return float(values[recent_mask(timestamps, window_days)].mean())
+
+
+def trend_per_decade(timestamps, values):
+    # Ordinary least-squares slope in units per decade, or None when the
+    # record is too short for a meaningful trend
+    if timestamps.size < 2 or timestamps[-1] - timestamps[0] < MIN_TREND_SPAN_DAYS * DAY:
+        return None
+    t = timestamps - timestamps.mean()
+    return float(np.dot(t, values - values.mean()) / np.dot(t, t) * DECADE)
+
+
+def deseasonalized_trend(timestamps, values, climatology=None):
+    # Trend of the monthly anomalies, so a record that starts in winter and
+    # ends in summer does not look like warming.
+    return trend_per_decade(timestamps, anomalies(timestamps, values, climatology))
+
+
+def recent_anomaly(timestamps, values, climatology, window_days=30):
+    # Departure of the last `window_days` from the climatology baseline
+    recent = recent_mask(timestamps, window_days)
+    return float(anomalies(timestamps[recent], values[recent], climatology).mean())
+
+
+def seasonal_range(climatology):
+    observed = climatology[~np.isnan(climatology)]
+    if observed.size == 0:
+        return 0.0
+    return float(observed.max() - observed.min())
+
+
+def count_grid_cells(latitudes, longitudes, cell_degrees=1.0):
+    # Number of distinct lat/lon grid cells touched by the given points
+    located = ~(np.isnan(latitudes) | np.isnan(longitudes))
+    if not located.any():
+        return 0
+    rows = np.floor((latitudes[located] + 90.0) / cell_degrees).astype(np.int64)
+    cols = np.floor((longitudes[located] + 180.0) / cell_degrees).astype(np.int64)
+    return int(np.unique(rows * 100000 + cols).size)
+
+
+def classify_trend(slope, threshold):
+    if slope is None:
+        return 'undetermined'
+    if slope > threshold:
+        return 'increasing'
+    if slope < -threshold:
+        return 'decreasing'
+    return 'stable'
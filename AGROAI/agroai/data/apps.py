@@ -2,4 +2,29 @@ from django.apps import AppConfig
 
 class DataConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'data'
\ No newline at end of file
+    name = 'data'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from agroai import metrics
+        from .analysis_cache import bump_changed_row_version, bump_ingested_versions, hit_ratio, lookup_counts
+        from .dashboard import refresh_tiles_on_ingest
+        from .models import OceanData
+        from .rollups import refresh_rollups_on_ingest
+        from .series_cache import append_ingested_batch, invalidate_changed_row
+        from .signals import ocean_data_ingested
+
+        ocean_data_ingested.connect(refresh_rollups_on_ingest, dispatch_uid='data.refresh_rollups')
+        # After the rollups, which the tiles are built from
+        ocean_data_ingested.connect(refresh_tiles_on_ingest, dispatch_uid='data.refresh_dashboard_tiles')
+        ocean_data_ingested.connect(append_ingested_batch, dispatch_uid='data.series_cache_append')
+        ocean_data_ingested.connect(bump_ingested_versions, dispatch_uid='data.analysis_cache_versions')
+        post_save.connect(invalidate_changed_row, sender=OceanData, dispatch_uid='data.series_cache_save')
+        post_delete.connect(invalidate_changed_row, sender=OceanData, dispatch_uid='data.series_cache_delete')
+        post_save.connect(bump_changed_row_version, sender=OceanData, dispatch_uid='data.analysis_cache_save')
+        post_delete.connect(bump_changed_row_version, sender=OceanData, dispatch_uid='data.analysis_cache_delete')
+
+        metrics.Counter('agroai_cache_lookups_total', 'Cache lookups, by cache and result.',
+                        labels=('cache', 'result'), collect=lookup_counts)
+        metrics.Gauge('agroai_cache_hit_ratio', 'Share of cache lookups that hit since the process started.',
+                      labels=('cache',), collect=hit_ratio)
@@ -0,0 +1,159 @@
+import uuid
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import DashboardTile, OceanData, OceanDataRollup
+from .rollups import aggregate_series
+
+# period: (length, rollup resolution of its series)
+PERIODS = {
+    '24h': (timedelta(hours=24), 'hour'),
+    '7d': (timedelta(days=7), 'hour'),
+    '30d': (timedelta(days=30), 'day'),
+    '1y': (timedelta(days=365), 'day'),
+}
+DEFAULT_PERIOD = '7d'
+RESOLUTION_WIDTHS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+
+# One version for everyone: tiles summarize all readings, whoever
+# ingested them, and are shared by every user
+VERSION_KEY = 'dashboard-tiles-version'
+
+
+def tiles_version():
+    # (token, time) of the current tiles, from the default cache so
+    # revalidating a dashboard costs no query; a new token after every
+    # refresh_tiles
+    return caches['default'].get_or_set(
+        VERSION_KEY, lambda: (uuid.uuid4().hex, timezone.now().replace(microsecond=0)), timeout=None
+    )
+
+
+def bump_tiles_version():
+    caches['default'].set(VERSION_KEY, (uuid.uuid4().hex, timezone.now().replace(microsecond=0)), timeout=None)
+
+
+def _summarize(rows):
+    # Summary of [bucket start, count, total, min, max] rows
+    count = sum(row[1] for row in rows)
+    if not count:
+        return {'count': 0, 'mean': None, 'min': None, 'max': None}
+    return {
+        'count': count,
+        'mean': round(sum(row[2] for row in rows) / count, 4),
+        'min': min(row[3] for row in rows),
+        'max': max(row[4] for row in rows),
+    }
+
+
+def build_tiles(region, parameter):
+    # DashboardTiles of one pair for every period, from the rollups through
+    # aggregate_series: four queries whatever the amount of data. Periods end at the pair's latest
+    # hourly bucket, so historical data still fills the dashboard.
+    latest_bucket = (
+        OceanDataRollup.objects.filter(resolution='hour', region=region, parameter=parameter)
+        .aggregate(latest=Max('bucket_start'))['latest']
+    )
+    if latest_bucket is None:
+        return []
+    end = latest_bucket + RESOLUTION_WIDTHS['hour']
+    latest = (
+        OceanData.objects.filter(region=region, parameter=parameter)
+        .order_by('-timestamp').values('timestamp', 'value').first()
+    )
+
+    # Two periods' worth of buckets of each resolution, for the change
+    rows = {}
+    for resolution, width in RESOLUTION_WIDTHS.items():
+        longest = max(length for length, source in PERIODS.values() if source == resolution)
+        series = aggregate_series(region, parameter, end - 2 * longest - width, end, int(width.total_seconds()))
+        rows[resolution] = [
+            (bucket['bucket_start'], bucket['count'], bucket['total'], bucket['min'], bucket['max'])
+            for bucket in series['buckets']
+        ]
+
+    tiles = []
+    for period, (length, resolution) in PERIODS.items():
+        width = RESOLUTION_WIDTHS[resolution]
+        # Whole buckets only: the window starts on a bucket boundary
+        start = end - length
+        start -= (start - start.replace(hour=0, minute=0, second=0, microsecond=0)) % width
+        previous_start = start - length
+        current = [row for row in rows[resolution] if row[0] >= start]
+        previous = [row for row in rows[resolution] if previous_start <= row[0] < start]
+
+        summary = _summarize(current)
+        previous_mean = _summarize(previous)['mean']
+        summary['previous_mean'] = previous_mean
+        summary['change'] = (round(summary['mean'] - previous_mean, 4)
+                             if summary['mean'] is not None and previous_mean is not None else None)
+        summary['latest'] = {'timestamp': latest['timestamp'].isoformat(), 'value': latest['value']} if latest else None
+        tiles.append(DashboardTile(
+            region=region, parameter=parameter, period=period, start=start, end=end, summary=summary,
+            series=[[bucket.isoformat(), count, round(total / count, 4), minimum, maximum]
+                    for bucket, count, total, minimum, maximum in current],
+        ))
+    return tiles
+
+
+def refresh_tiles(pairs=None):
+    # Rebuilds the tiles of the (region, parameter) pairs, or of every pair
+    # with rollups. Returns the number of tiles written.
+    rebuild = pairs is None
+    if rebuild:
+        pairs = set(
+            OceanDataRollup.objects.filter(resolution='hour')
+            .values_list('region', 'parameter').distinct()
+        )
+    tiles = [tile for region, parameter in sorted(pairs) for tile in build_tiles(region, parameter)]
+    with transaction.atomic():
+        if rebuild:
+            DashboardTile.objects.all().delete()
+        DashboardTile.objects.bulk_create(
+            tiles,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['period', 'region', 'parameter'],
+            update_fields=['start', 'end', 'summary', 'series', 'updated_at'],
+        )
+        transaction.on_commit(bump_tiles_version)
+    return len(tiles)
+
+
+def refresh_tiles_on_ingest(sender, batch_id, rows, **kwargs):
+    # ocean_data_ingested receiver, connected after the rollups refresh
+    refresh_tiles({(row.region, row.parameter) for row in rows})
+
+
+def summary_cards(period):
+    return [
+        dict(tile['summary'], region=tile['region'], parameter=tile['parameter'],
+             start=tile['start'], end=tile['end'])
+        for tile in DashboardTile.objects.filter(period=period)
+        .values('region', 'parameter', 'start', 'end', 'summary')
+    ]
+
+
+def series_tiles(period, parameter, regions=None):
+    queryset = DashboardTile.objects.filter(period=period, parameter=parameter)
+    if regions:
+        queryset = queryset.filter(region__in=regions)
+    return list(queryset.values('region', 'start', 'end', 'series'))
+
+
+def heatmap(period, parameter):
+    # Regions by buckets of mean values, None where a region has no data
+    tiles = series_tiles(period, parameter)
+    buckets = sorted({row[0] for tile in tiles for row in tile['series']})
+    position = {bucket: i for i, bucket in enumerate(buckets)}
+    values = []
+    for tile in tiles:
+        means = [None] * len(buckets)
+        for row in tile['series']:
+            means[position[row[0]]] = row[2]
+        values.append(means)
+    return {'regions': [tile['region'] for tile in tiles], 'buckets': buckets, 'values': values}
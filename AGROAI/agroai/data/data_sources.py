@@ -1,6 +1,51 @@
-import random
-import json
-from datetime import datetime, timedelta
+import re
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+
+from . import analytics
+from .analysis_cache import cached_analysis, data_versions, get_analysis_cache
+from . import spatial
+from .downsampling import downsample
+from .keywords import ocean_matcher
+from .models import OceanData
+from .query_plan import execute_plan, plan_query, shared_loads
+from .series import load_series, load_series_near, series_queryset
+
+# "near 35.2N 120.5W", "at 35.2, -120.5", "around lat 35.2 lon -120.5"
+COORDINATES = re.compile(
+    r'\b(?:near|at|around|off|lat(?:itude)?)\s*(?P<lat>-?\d{1,2}(?:\.\d+)?)\s*°?\s*(?P<ns>[ns])?\b(?:\s*,\s*|\s+)'
+    r'(?:lon(?:gitude)?\s*)?(?P<lon>-?\d{1,3}(?:\.\d+)?)\s*°?\s*(?P<ew>[ew])?\b'
+)
+RADIUS = re.compile(r'\bwithin\s+(\d+(?:\.\d+)?)\s*(km|kilomet\w*|mi\w*|nm|nautical)\b')
+DEPTH_BAND = re.compile(r'\b(\d+(?:\.\d+)?)\s*(?:-|–|to)\s*(\d+(?:\.\d+)?)\s*m\b')
+DISTANCE_UNITS = {'km': 1.0, 'ki': 1.0, 'mi': 1.609344, 'nm': 1.852, 'na': 1.852}
+DEFAULT_RADIUS_KM = 50.0
+
+# Series each analysis reads, for cache invalidation
+ANALYSIS_PARAMETERS = {
+    'temperature': ['temperature'],
+    'salinity': ['salinity'],
+    'ph': ['ph'],
+    'dissolved_oxygen': ['dissolved_oxygen'],
+    'ecosystem': ['chlorophyll', 'dissolved_oxygen'],
+}
+ANALYSIS_LABELS = {
+    'temperature': 'Temperature',
+    'salinity': 'Salinity',
+    'ph': 'pH',
+    'dissolved_oxygen': 'Dissolved oxygen',
+    'ecosystem': 'Ecosystem health',
+}
+
+# Charts: "past 6 months", "last 2 years", "past week"
+TIME_RANGE = re.compile(r'\b(?:past|last)\s+(\d+)?\s*(day|week|month|year)s?\b')
+TIME_RANGE_DAYS = {'day': 1, 'week': 7, 'month': 30, 'year': 365}
+DEFAULT_VISUALIZATION_DAYS = 365
+DEFAULT_VISUALIZATION_WIDTH = 800
+MIN_VISUALIZATION_WIDTH = 10
+MAX_VISUALIZATION_WIDTH = 4000
+VISUALIZATION_CACHE_TIMEOUT = 3600
 
 class OceanDataProcessor:
     def __init__(self):
@@ -8,100 +53,334 @@ class OceanDataProcessor:
         self.parameters = ['temperature', 'salinity', 'ph', 'dissolved_oxygen', 'chlorophyll', 'turbidity']
         self.marine_species = ['phytoplankton', 'zooplankton', 'coral', 'fish', 'marine_mammals', 'seaweed']
 
-    def analyze_query(self, query):
+    def analyze_query(self, query, matches=None):
+        # matches: a keyword classification the caller already made with a
+        # matcher covering OCEAN_KEYWORDS, saving a second pass over the text.
+        # A question naming several parameters or regions is answered for
+        # every combination, computed concurrently; see data.query_plan.
         query_lower = query.lower()
-        
-        # Simulate data analysis based on query
-        if any(word in query_lower for word in ['temperature', 'temp', 'thermal']):
-            return self._analyze_temperature_data(query)
-        elif any(word in query_lower for word in ['salinity', 'salt']):
-            return self._analyze_salinity_data(query)
-        elif any(word in query_lower for word in ['ph', 'acidity']):
-            return self._analyze_ph_data(query)
-        elif any(word in query_lower for word in ['oxygen', 'o2']):
-            return self._analyze_oxygen_data(query)
-        elif any(word in query_lower for word in ['ecosystem', 'marine', 'species']):
-            return self._analyze_ecosystem_data(query)
-        else:
+        matches = matches or ocean_matcher.match(query_lower)
+        location = self._detect_location(query_lower)
+        plan = plan_query(self.select_analyses(matches), matches['region'])
+        if not plan:
             return self._generate_general_analysis(query)
 
-    def _analyze_temperature_data(self, query):
+        results = execute_plan(plan, lambda analysis, region: self._cached_analysis(analysis, query, region, location))
+        if len(plan) == 1:
+            return results[0]
+        return self._merge_results(plan, results, location)
+
+    def _cached_analysis(self, analysis, query, region, location):
+        # Cached on the normalized request rather than the wording, so
+        # every phrasing of the same question shares one entry, and the
+        # parts of a compound question share entries with single ones
+        return cached_analysis(
+            'analysis', [analysis, region, location], region, ANALYSIS_PARAMETERS[analysis],
+            lambda: self._run_analysis(analysis, query, region, location),
+        )
+
+    def _merge_results(self, plan, results, location):
+        # One response for the parts of a compound question, in plan order
+        parts = []
+        insights = []
+        summaries = []
+        recommendations = []
+        for (analysis, region), result in zip(plan, results):
+            parts.append({
+                'analysis': analysis,
+                'region': self._region_label(region),
+                'has_data': result['has_data'],
+                'data': result.get('data', {}),
+            })
+            insights.append(f"**{ANALYSIS_LABELS[analysis]}, {self._area(region, location)}**\n{result['insights']}")
+            if result['has_data']:
+                summaries.append(result['summary'])
+                if result['recommendations'] not in recommendations:
+                    recommendations.append(result['recommendations'])
+        return {
+            'has_data': any(part['has_data'] for part in parts),
+            'insights': '\n\n'.join(insights),
+            'summary': ' '.join(summaries),
+            'recommendations': ' '.join(recommendations),
+            'data': {
+                'analyses': list(dict.fromkeys(analysis for analysis, _ in plan)),
+                'regions': list(dict.fromkeys(self._region_label(region) for _, region in plan)),
+                'parts': parts,
+            },
+        }
+
+    def _run_analysis(self, analysis, query, region, location):
+        # Run the analysis matching the query against stored observations
+        if analysis == 'temperature':
+            return self._analyze_temperature_data(query, region, location)
+        elif analysis == 'salinity':
+            return self._analyze_salinity_data(query, region, location)
+        elif analysis == 'ph':
+            return self._analyze_ph_data(query, region, location)
+        elif analysis == 'dissolved_oxygen':
+            return self._analyze_oxygen_data(query, region, location)
+        else:
+            return self._analyze_ecosystem_data(query, region, location)
+
+    def select_analyses(self, matches):
+        # Every analysis the query asks for, in a fixed order
+        analyses = [parameter for parameter in ('temperature', 'salinity', 'ph', 'dissolved_oxygen')
+                    if parameter in matches['parameter']]
+        if 'ecosystem' in matches['topic'] or 'chlorophyll' in matches['parameter']:
+            analyses.append('ecosystem')
+        return analyses
+
+    def select_analysis(self, matches):
+        # The first of select_analyses(), or None
+        analyses = self.select_analyses(matches)
+        return analyses[0] if analyses else None
+
+    def _detect_region(self, matches):
+        return matches['region'][0] if matches['region'] else None
+
+    def _detect_location(self, query_lower):
+        # Point, search radius and depth band of a location-qualified
+        # question such as "oxygen near 35.2N 120.5W within 30 km at 0-100 m"
+        match = COORDINATES.search(query_lower)
+        if not match:
+            return None
+        latitude, longitude = float(match.group('lat')), float(match.group('lon'))
+        if match.group('ns') == 's':
+            latitude = -abs(latitude)
+        if match.group('ew') == 'w':
+            longitude = -abs(longitude)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return None
+
+        location = {
+            'latitude': latitude,
+            'longitude': longitude,
+            'radius_km': DEFAULT_RADIUS_KM,
+            'min_depth': None,
+            'max_depth': None,
+        }
+        radius = RADIUS.search(query_lower)
+        if radius:
+            location['radius_km'] = min(float(radius.group(1)) * DISTANCE_UNITS[radius.group(2)[:2]], 2000.0)
+        depth = DEPTH_BAND.search(query_lower)
+        if depth:
+            location['min_depth'], location['max_depth'] = sorted([float(depth.group(1)), float(depth.group(2))])
+        return location
+
+    def _load(self, parameter, region, location=None):
+        # (timestamps, values) for the region, or all regions when none was
+        # named, optionally restricted to the area around a point. Loaded
+        # once per plan while executing one.
+        loads = shared_loads.get()
+        if loads is None:
+            return self._load_series(parameter, region, location)
+        key = (parameter, region, tuple(sorted(location.items())) if location else None)
+        return loads.get(key, lambda: self._load_series(parameter, region, location))
+
+    def _load_series(self, parameter, region, location):
+        if location:
+            timestamps, values = load_series_near(region.lower() if region else None, parameter, **location)
+        else:
+            timestamps, values = load_series(region.lower() if region else None, parameter)
+        if timestamps.size == 0:
+            return None
+        return timestamps, values
+
+    def _region_label(self, region):
+        return region or 'Global'
+
+    def _area(self, region, location):
+        if not location:
+            return f"{self._region_label(region)} Ocean"
+        latitude, longitude = location['latitude'], location['longitude']
+        point = f"{abs(latitude):.2f}°{'N' if latitude >= 0 else 'S'}, {abs(longitude):.2f}°{'E' if longitude >= 0 else 'W'}"
+        area = f"the area within {location['radius_km']:g} km of {point}"
+        if location['max_depth'] is not None:
+            area += f" ({location['min_depth']:g}-{location['max_depth']:g} m depth)"
+        return area
+
+    def _round(self, value, digits=2):
+        # Rounded for display; None stays None and -0.0 becomes 0.0
+        return None if value is None else round(value, digits) + 0.0
+
+    def _per_decade(self, trend, unit, parenthesized=True):
+        if trend is None:
+            return '' if parenthesized else 'undetermined (under a year of data)'
+        text = f"{trend}{unit} per decade"
+        return f" ({text})" if parenthesized else text
+
+    def _no_data(self, parameter, region, location=None):
+        label = {'ph': 'pH', 'dissolved_oxygen': 'dissolved oxygen'}.get(parameter, parameter)
+        insights = f"No {label} observations are stored for {self._area(region, location)} yet."
+        if location:
+            stations = spatial.nearest_stations(
+                spatial.filter_depth(
+                    series_queryset(region.lower() if region else None, parameter),
+                    location['min_depth'], location['max_depth'],
+                ),
+                location['latitude'], location['longitude'],
+            )
+            if stations:
+                station = stations[0]
+                insights += (f" The nearest station with {label} data is {station['distance_km']:.0f} km away"
+                             f" at {station['latitude']:.2f}, {station['longitude']:.2f}.")
+        return {
+            'has_data': False,
+            'insights': insights,
+            'summary': "Ingest sensor data for this region and parameter to enable analysis.",
+            'recommendations': "Load buoy or CTD feeds with the ingest_ocean_data command, or ask about another region."
+        }
+
+    def _analyze_temperature_data(self, query, region=None, location=None):
+        series = self._load('temperature', region, location)
+        if series is None:
+            return self._no_data('temperature', region, location)
+        timestamps, values = series
+        area = self._area(region, location)
+        climatology = analytics.monthly_climatology(timestamps, values)
+        trend = analytics.deseasonalized_trend(timestamps, values, climatology)
         data = {
-            'current_temp': round(random.uniform(15, 30), 2),
-            'trend': random.choice(['increasing', 'decreasing', 'stable']),
-            'anomaly': round(random.uniform(-2, 2), 2),
-            'region': random.choice(self.regions)
+            'current_temp': self._round(analytics.current_value(timestamps, values), 2),
+            'trend': analytics.classify_trend(trend, 0.05),
+            'trend_per_decade': self._round(trend, 3),
+            'anomaly': self._round(analytics.recent_anomaly(timestamps, values, climatology), 2),
+            'region': self._region_label(region),
+            'observations': int(values.size),
         }
         
         return {
             'has_data': True,
-            'insights': f"- Sea surface temperature: {data['current_temp']}°C\n- Trend: {data['trend']}\n- Temperature anomaly: {data['anomaly']}°C\n- Region: {data['region']} Ocean",
-            'summary': f"Temperature analysis shows {data['trend']} trend with {data['anomaly']}°C anomaly in {data['region']} Ocean.",
+            'insights': f"- Sea surface temperature: {data['current_temp']}°C\n- Trend: {data['trend']}{self._per_decade(data['trend_per_decade'], '°C')}\n- Temperature anomaly: {data['anomaly']}°C\n- Region: {area}",
+            'summary': f"Temperature analysis of {data['observations']} observations shows {data['trend']} trend with {data['anomaly']}°C anomaly in {area}.",
             'recommendations': "Monitor seasonal variations, check for coral bleaching alerts, analyze thermal stress patterns.",
             'data': data
         }
 
-    def _analyze_salinity_data(self, query):
+    def _analyze_salinity_data(self, query, region=None, location=None):
+        series = self._load('salinity', region, location)
+        if series is None:
+            return self._no_data('salinity', region, location)
+        timestamps, values = series
+        area = self._area(region, location)
+        climatology = analytics.monthly_climatology(timestamps, values)
+        variation = analytics.seasonal_range(climatology)
         data = {
-            'salinity': round(random.uniform(30, 40), 2),
-            'variation': round(random.uniform(0.5, 5), 2),
-            'freshwater_influence': random.choice(['low', 'moderate', 'high']),
-            'region': random.choice(self.regions)
+            'salinity': self._round(analytics.current_value(timestamps, values), 2),
+            'variation': self._round(variation, 2),
+            'freshwater_influence': 'high' if variation > 2 else 'moderate' if variation > 1 else 'low',
+            'anomaly': self._round(analytics.recent_anomaly(timestamps, values, climatology), 2),
+            'region': self._region_label(region),
+            'observations': int(values.size),
         }
         
         return {
             'has_data': True,
-            'insights': f"- Salinity level: {data['salinity']} PSU\n- Seasonal variation: {data['variation']} PSU\n- Freshwater influence: {data['freshwater_influence']}\n- Region: {data['region']} Ocean",
-            'summary': f"Salinity patterns show {data['freshwater_influence']} freshwater influence in {data['region']} Ocean.",
+            'insights': f"- Salinity level: {data['salinity']} PSU\n- Seasonal variation: {data['variation']} PSU\n- Salinity anomaly: {data['anomaly']} PSU\n- Freshwater influence: {data['freshwater_influence']}\n- Region: {area}",
+            'summary': f"Salinity patterns show {data['freshwater_influence']} freshwater influence in {area}.",
             'recommendations': "Analyze evaporation-precipitation balance, monitor river discharge impacts, study density currents.",
             'data': data
         }
 
-    def _analyze_ph_data(self, query):
+    def _analyze_ph_data(self, query, region=None, location=None):
+        series = self._load('ph', region, location)
+        if series is None:
+            return self._no_data('ph', region, location)
+        timestamps, values = series
+        area = self._area(region, location)
+        climatology = analytics.monthly_climatology(timestamps, values)
+        ph = analytics.current_value(timestamps, values)
         data = {
-            'ph': round(random.uniform(7.8, 8.3), 2),
-            'acidification_trend': round(random.uniform(-0.02, 0), 3),
-            'carbonate_saturation': random.choice(['adequate', 'marginal', 'low']),
-            'region': random.choice(self.regions)
+            'ph': self._round(ph, 2),
+            'acidification_trend': self._round(analytics.deseasonalized_trend(timestamps, values, climatology), 3),
+            'carbonate_saturation': 'adequate' if ph >= 8.05 else 'marginal' if ph >= 7.9 else 'low',
+            'region': self._region_label(region),
+            'observations': int(values.size),
         }
         
         return {
             'has_data': True,
-            'insights': f"- pH level: {data['ph']}\n- Acidification trend: {data['acidification_trend']} per decade\n- Carbonate saturation: {data['carbonate_saturation']}\n- Region: {data['region']} Ocean",
-            'summary': f"Ocean acidification monitoring shows {data['acidification_trend']} pH change per decade in {data['region']} Ocean.",
+            'insights': f"- pH level: {data['ph']}\n- Acidification trend: {self._per_decade(data['acidification_trend'], '', parenthesized=False)}\n- Carbonate saturation: {data['carbonate_saturation']}\n- Region: {area}",
+            'summary': (
+                f"Ocean acidification monitoring shows {data['acidification_trend']} pH change per decade in {area}."
+                if data['acidification_trend'] is not None else
+                f"Ocean acidification monitoring in {area} needs at least a year of data to estimate a trend."
+            ),
             'recommendations': "Monitor carbonate chemistry, assess impacts on calcifying organisms, study CO2 absorption patterns.",
             'data': data
         }
 
-    def _analyze_oxygen_data(self, query):
+    def _analyze_oxygen_data(self, query, region=None, location=None):
+        series = self._load('dissolved_oxygen', region, location)
+        if series is None:
+            return self._no_data('dissolved_oxygen', region, location)
+        timestamps, values = series
+        area = self._area(region, location)
+        climatology = analytics.monthly_climatology(timestamps, values)
         data = {
-            'oxygen': round(random.uniform(4, 9), 2),
-            'hypoxic_zones': random.randint(0, 5),
-            'seasonal_variation': round(random.uniform(0.5, 2), 2),
-            'region': random.choice(self.regions)
+            'oxygen': self._round(analytics.current_value(timestamps, values), 2),
+            'hypoxic_zones': self._count_hypoxic_zones(region, location, timestamps[-1]),
+            'seasonal_variation': self._round(analytics.seasonal_range(climatology), 2),
+            'region': self._region_label(region),
+            'observations': int(values.size),
         }
         
         return {
             'has_data': True,
-            'insights': f"- Dissolved oxygen: {data['oxygen']} mg/L\n- Hypoxic zones detected: {data['hypoxic_zones']}\n- Seasonal variation: {data['seasonal_variation']} mg/L\n- Region: {data['region']} Ocean",
-            'summary': f"Oxygen levels show {data['hypoxic_zones']} hypoxic zones in {data['region']} Ocean with seasonal variation of {data['seasonal_variation']} mg/L.",
+            'insights': f"- Dissolved oxygen: {data['oxygen']} mg/L\n- Hypoxic zones detected: {data['hypoxic_zones']}\n- Seasonal variation: {data['seasonal_variation']} mg/L\n- Region: {area}",
+            'summary': f"Oxygen levels show {data['hypoxic_zones']} hypoxic zones in {area} with seasonal variation of {data['seasonal_variation']} mg/L.",
             'recommendations': "Monitor oxygen minimum zones, study stratification effects, assess impacts on marine life.",
             'data': data
         }
 
-    def _analyze_ecosystem_data(self, query):
-        data = {
-            'biodiversity_index': round(random.uniform(0.6, 0.95), 3),
-            'primary_production': round(random.uniform(100, 500), 2),
-            'key_species': random.sample(self.marine_species, 3),
-            'ecosystem_health': random.choice(['excellent', 'good', 'fair', 'poor']),
-            'region': random.choice(self.regions)
-        }
+    def _count_hypoxic_zones(self, region, location, latest, window_days=30):
+        # Distinct 1° grid cells with a hypoxic reading in the last month
+        recent = series_queryset(
+            region.lower() if region else None, 'dissolved_oxygen',
+            start=datetime.fromtimestamp(latest - window_days * analytics.DAY, tz=dt_timezone.utc),
+        ).filter(value__lt=analytics.HYPOXIA_THRESHOLD, latitude__isnull=False, longitude__isnull=False)
+        if location:
+            recent = spatial.prefilter(
+                spatial.filter_depth(recent, location['min_depth'], location['max_depth']),
+                location['latitude'], location['longitude'], location['radius_km'],
+            )
+        points = np.array(list(recent.values_list('latitude', 'longitude')), dtype=np.float64).reshape(-1, 2)
+        if location:
+            distances = spatial.haversine_km(location['latitude'], location['longitude'], points[:, 0], points[:, 1])
+            points = points[distances <= location['radius_km']]
+        return analytics.count_grid_cells(points[:, 0], points[:, 1])
+
+    def _analyze_ecosystem_data(self, query, region=None, location=None):
+        chlorophyll = self._load('chlorophyll', region, location)
+        oxygen = self._load('dissolved_oxygen', region, location)
+        if chlorophyll is None and oxygen is None:
+            return self._no_data('chlorophyll', region, location)
+        area = self._area(region, location)
+
+        # Count stress indicators: low oxygen, hypoxia and bloom-level chlorophyll
+        stress = 0
+        data = {'region': self._region_label(region)}
+        if oxygen is not None:
+            data['oxygen'] = self._round(analytics.current_value(*oxygen), 2)
+            stress += (data['oxygen'] < 4) + (data['oxygen'] < analytics.HYPOXIA_THRESHOLD)
+        if chlorophyll is not None:
+            timestamps, values = chlorophyll
+            climatology = analytics.monthly_climatology(timestamps, values)
+            spread = float(analytics.anomalies(timestamps, values, climatology).std()) or 1.0
+            data['chlorophyll'] = self._round(analytics.current_value(timestamps, values), 2)
+            data['bloom_index'] = self._round(analytics.recent_anomaly(timestamps, values, climatology) / spread, 2)
+            stress += data['bloom_index'] > 2
+        data['ecosystem_health'] = ['excellent', 'good', 'fair', 'poor'][min(int(stress), 3)]
+
+        indicators = []
+        if 'chlorophyll' in data:
+            indicators.append(f"- Chlorophyll-a: {data['chlorophyll']} mg/m³ (bloom index {data['bloom_index']})")
+        if 'oxygen' in data:
+            indicators.append(f"- Dissolved oxygen: {data['oxygen']} mg/L")
         
         return {
             'has_data': True,
-            'insights': f"- Biodiversity index: {data['biodiversity_index']}\n- Primary production: {data['primary_production']} mg C/m²/day\n- Key species: {', '.join(data['key_species'])}\n- Ecosystem health: {data['ecosystem_health']}\n- Region: {data['region']} Ocean",
-            'summary': f"Marine ecosystem assessment shows {data['ecosystem_health']} health with biodiversity index of {data['biodiversity_index']} in {data['region']} Ocean.",
+            'insights': "\n".join(indicators + [f"- Ecosystem health: {data['ecosystem_health']}", f"- Region: {area}"]),
+            'summary': f"Marine ecosystem assessment shows {data['ecosystem_health']} health in {area} based on productivity and oxygen indicators.",
             'recommendations': "Monitor species distribution, assess habitat quality, study food web dynamics, track conservation status.",
             'data': data
         }
@@ -114,31 +393,93 @@ class OceanDataProcessor:
             'recommendations': "Consider specifying ocean parameters (temperature, salinity, pH, oxygen) or marine ecosystem aspects for detailed analysis."
         }
 
-    def generate_visualization_data(self, query):
-        # Generate sample data for visualization
-        time_points = 12
-        base_date = datetime.now() - timedelta(days=365)
-        
-        chart_data = {}
-        for param in random.sample(self.parameters, 3):
-            chart_data[param] = [
+    def _visualization_parameters(self, matches, region):
+        # Parameters named in the query, else up to three with stored data
+        if matches['parameter']:
+            return matches['parameter']
+        queryset = OceanData.objects.filter(region=region.lower()) if region else OceanData.objects.all()
+        stored = set(queryset.values_list('parameter', flat=True).distinct())
+        return [parameter for parameter in self.parameters if parameter in stored][:3]
+
+    def _visualization_days(self, query_lower):
+        match = TIME_RANGE.search(query_lower)
+        if not match:
+            return DEFAULT_VISUALIZATION_DAYS
+        return int(match.group(1) or 1) * TIME_RANGE_DAYS[match.group(2)]
+
+    def _downsampled_series(self, region, parameter, days, width, method):
+        # The last `days` of the series reduced to `width` points. The key
+        # carries the pair's data version, so hits skip loading the series
+        # and newly ingested readings produce a new entry instead of a stale
+        # hit. The version is read before loading, as in cached_analysis.
+        cache = get_analysis_cache()
+        version, = data_versions(cache, region, [parameter])
+        key = f"viz:{region.lower() if region else 'global'}:{parameter}:{version}:{days}:{width}:{method}"
+        series = cache.get(key)
+        if series is not None:
+            return series
+        timestamps, values = load_series(region.lower() if region else None, parameter)
+        if timestamps.size == 0:
+            return None
+        low = int(np.searchsorted(timestamps, float(timestamps[-1]) - days * analytics.DAY, side='left'))
+        reduced_ts, reduced_values = downsample(timestamps[low:], values[low:], width, method)
+        series = {
+            'original_points': int(timestamps.size - low),
+            'points': [
                 {
-                    'date': (base_date + timedelta(days=i*30)).strftime('%Y-%m-%d'),
-                    'value': round(random.uniform(10, 35) if param == 'temperature' else 
-                                  random.uniform(30, 40) if param == 'salinity' else
-                                  random.uniform(7.8, 8.3) if param == 'ph' else
-                                  random.uniform(4, 9) if param == 'dissolved_oxygen' else
-                                  random.uniform(0.1, 5) if param == 'chlorophyll' else
-                                  random.uniform(1, 10), 2)
+                    'date': datetime.fromtimestamp(ts, tz=dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'value': round(float(value), 3),
                 }
-                for i in range(time_points)
-            ]
-        
+                for ts, value in zip(reduced_ts.tolist(), reduced_values.tolist())
+            ],
+        }
+        cache.set(key, series, VISUALIZATION_CACHE_TIMEOUT)
+        return series
+
+    def generate_visualization_data(self, query, width=DEFAULT_VISUALIZATION_WIDTH, method='lttb', matches=None,
+                                    days=None):
+        # Chart series from stored observations, each downsampled to about
+        # one point per pixel of the requested chart width. days overrides
+        # the time range named in the query.
+        query_lower = query.lower()
+        matches = matches or ocean_matcher.match(query_lower)
+        region = self._detect_region(matches)
+        days = days or self._visualization_days(query_lower)
+        width = max(MIN_VISUALIZATION_WIDTH, min(int(width), MAX_VISUALIZATION_WIDTH))
+        parameters = self._visualization_parameters(matches, region)
+        return cached_analysis(
+            'visualization', [region, parameters, days, width, method], region, parameters,
+            lambda: self._build_visualization(region, parameters, days, width, method),
+        )
+
+    def _build_visualization(self, region, parameters, days, width, method):
+        chart_data = {}
+        original_points = 0
+        for param in parameters:
+            series = self._downsampled_series(region, param, days, width, method)
+            if series is None:
+                continue
+            chart_data[param] = series['points']
+            original_points += series['original_points']
+        returned_points = sum(len(points) for points in chart_data.values())
+
+        time_range = f"{days} days" if days % 365 else f"{days // 365 * 12} months"
+        area = f"{self._region_label(region)} Ocean"
         return {
             'chart_type': 'Time Series Analysis',
-            'data_points': time_points,
-            'time_range': '12 months',
+            'data_points': returned_points,
+            'time_range': time_range,
             'parameters': list(chart_data.keys()),
             'data': chart_data,
-            'description': f"trends in {', '.join(list(chart_data.keys()))} over the past year"
-        }
\ No newline at end of file
+            'description': (
+                f"trends in {', '.join(chart_data.keys())} over the past {time_range} in the {area}"
+                if chart_data else f"no stored observations for the {area}"
+            ),
+            'downsampling': {
+                'method': method,
+                'width': width,
+                'original_points': original_points,
+                'returned_points': returned_points,
+                'reduction_ratio': round(original_points / returned_points, 2) if returned_points else None,
+            },
+        }
@@ -0,0 +1,61 @@
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+
+
+def downsample(timestamps, values, width, method='lttb'):
+    # Reduces a series to about `width` points for a chart `width` pixels
+    # wide, keeping the first and last point and the visual extremes.
+    # Returns (timestamps, values); short series pass through unchanged.
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method '{method}'")
+    if width < 3 or timestamps.size <= width:
+        return timestamps, values
+    if method == 'minmax':
+        indices = minmax_indices(values, width)
+    else:
+        indices = lttb_indices(timestamps, values, width)
+    return timestamps[indices], values[indices]
+
+
+def minmax_indices(values, width):
+    # Min and max of each of width/2 equal-count buckets, in time order
+    buckets = max(1, width // 2)
+    n = values.size
+    bucket_ids = np.arange(n) * buckets // n
+    order = np.lexsort((values, bucket_ids))
+    boundaries = np.searchsorted(bucket_ids[order], np.arange(buckets))
+    lowest = order[boundaries]
+    highest = order[np.append(boundaries[1:], n) - 1]
+    return np.unique(np.concatenate(([0, n - 1], lowest, highest)))
+
+
+def lttb_indices(timestamps, values, width):
+    # Largest-Triangle-Three-Buckets: from each bucket keep the point that
+    # forms the largest triangle with the previously kept point and the
+    # mean of the next bucket. Each bucket step is vectorized.
+    n = values.size
+    edges = np.linspace(1, n - 1, width - 1).astype(np.int64)
+    x = timestamps - timestamps[0]
+    indices = np.empty(width, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(width - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if end <= start:
+            end = start + 1
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < width - 1 else n
+        if next_end <= next_start:
+            next_end = next_start + 1
+        mean_x = x[next_start:next_end].mean()
+        mean_y = values[next_start:next_end].mean()
+
+        px, py = x[previous], values[previous]
+        areas = np.abs(
+            (px - mean_x) * (values[start:end] - py)
+            - (px - x[start:end]) * (mean_y - py)
+        )
+        previous = start + int(np.argmax(areas))
+        indices[bucket + 1] = previous
+    return indices
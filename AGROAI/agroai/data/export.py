@@ -0,0 +1,187 @@
+import csv
+import io
+import json
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.db.models import Max, Min
+
+from .models import OceanData
+from .queries import InvalidQuery
+
+EXPORT_FIELDS = ['id', 'region', 'parameter', 'timestamp', 'value', 'unit', 'latitude', 'longitude', 'depth']
+# Content type and file extension of each format
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'columnar': ('application/octet-stream', 'oceancol'),
+}
+# Rows per query. Each batch is one keyset query, so no read transaction
+# stays open for the whole export and memory is bounded by the batch.
+BATCH_SIZE = 5000
+
+# Columnar format: MAGIC, a uint32-prefixed JSON header, then one block
+# per batch, then a block of zero rows. A block is a uint32 row count
+# followed by each column:
+#   int64 columns: id, timestamp (microseconds since the epoch, UTC)
+#   float64 columns: value, latitude, longitude, depth (NaN for null)
+#   string columns: a uint32-prefixed JSON list of the block's distinct
+#     values, then one uint16 index into it per row
+# All numbers are little-endian.
+MAGIC = b'OCEANCOL'
+COLUMNAR_VERSION = 1
+INT_COLUMNS = ['id', 'timestamp']
+FLOAT_COLUMNS = ['value', 'latitude', 'longitude', 'depth']
+STRING_COLUMNS = ['region', 'parameter', 'unit']
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+COLUMN_TYPES = {**{n: 'int64' for n in INT_COLUMNS}, **{n: 'float64' for n in FLOAT_COLUMNS},
+                **{n: 'string' for n in STRING_COLUMNS}}
+
+
+def export_range(region=None, parameter=None, start=None, end=None, after=None, until=None):
+    # (queryset, after, until): the rows to export and the id range they
+    # fall in. until pins the end of the export when it starts, so rows
+    # ingested meanwhile are left out and a resumed export covers exactly
+    # the same rows. Exports are in id order; resume with the last id
+    # received as after and the same until.
+    queryset = OceanData.objects.all()
+    if region:
+        queryset = queryset.filter(region=region.lower())
+    if parameter:
+        queryset = queryset.filter(parameter=parameter.lower())
+    if start:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end:
+        queryset = queryset.filter(timestamp__lt=end)
+    if (after is not None and after < 0) or (until is not None and until < 0):
+        raise InvalidQuery('after and until must not be negative')
+
+    if after is None or until is None:
+        # With filters this scans the (region, parameter, timestamp) index,
+        # and narrows every batch query to the ids that can match
+        bounds = queryset.aggregate(first=Min('id'), last=Max('id'))
+        if after is None:
+            after = (bounds['first'] or 1) - 1
+        if until is None:
+            until = bounds['last'] or 0
+    return queryset, after, until
+
+
+def export_batches(queryset, after, until, batch_size=BATCH_SIZE):
+    # Lists of EXPORT_FIELDS tuples with after < id <= until, in id order
+    while after < until:
+        rows = list(
+            queryset.filter(id__gt=after, id__lte=until).order_by('id')
+            .values_list(*EXPORT_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][0]
+
+
+def _isoformat(row):
+    return row[:3] + (row[3].isoformat(),) + row[4:]
+
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for rows in batches:
+        writer.writerows(_isoformat(row) for row in rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def ndjson_chunks(batches):
+    for rows in batches:
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_FIELDS, _isoformat(row))), separators=(',', ':')) + '\n' for row in rows
+        ).encode('utf-8')
+
+
+def _columnar_block(rows):
+    columns = dict(zip(EXPORT_FIELDS, zip(*rows)))
+    parts = [struct.pack('<I', len(rows))]
+    for name in EXPORT_FIELDS:
+        values = columns[name]
+        kind = COLUMN_TYPES[name]
+        if name == 'timestamp':
+            epoch = [(value.replace(tzinfo=value.tzinfo or dt_timezone.utc) - EPOCH) // MICROSECOND
+                     for value in values]
+            parts.append(np.array(epoch, dtype='<i8').tobytes())
+        elif kind == 'int64':
+            parts.append(np.array(values, dtype='<i8').tobytes())
+        elif kind == 'float64':
+            parts.append(np.array([np.nan if v is None else v for v in values], dtype='<f8').tobytes())
+        else:
+            distinct = sorted(set(values))
+            index = {value: i for i, value in enumerate(distinct)}
+            encoded = json.dumps(distinct).encode('utf-8')
+            parts.append(struct.pack('<I', len(encoded)) + encoded)
+            parts.append(np.array([index[value] for value in values], dtype='<u2').tobytes())
+    return b''.join(parts)
+
+
+def columnar_chunks(batches):
+    header = json.dumps({
+        'version': COLUMNAR_VERSION,
+        'columns': [[name, COLUMN_TYPES[name]] for name in EXPORT_FIELDS],
+    }).encode('utf-8')
+    yield MAGIC + struct.pack('<I', len(header)) + header
+    for rows in batches:
+        yield _columnar_block(rows)
+    yield struct.pack('<I', 0)
+
+
+def read_columnar(stream):
+    # Reads a columnar export from a binary file object. Yields one dict of
+    # numpy arrays (strings as object arrays) per block.
+    def read(size):
+        data = stream.read(size)
+        if len(data) != size:
+            raise ValueError('Truncated columnar export')
+        return data
+
+    if read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a columnar export')
+    header = json.loads(read(struct.unpack('<I', read(4))[0]))
+    if header['version'] != COLUMNAR_VERSION:
+        raise ValueError(f"Unsupported columnar export version {header['version']}")
+    while True:
+        count = struct.unpack('<I', read(4))[0]
+        if not count:
+            return
+        block = {}
+        for name, kind in header['columns']:
+            if kind == 'string':
+                distinct = json.loads(read(struct.unpack('<I', read(4))[0]))
+                codes = np.frombuffer(read(2 * count), dtype='<u2')
+                block[name] = np.array(distinct, dtype=object)[codes]
+            else:
+                block[name] = np.frombuffer(read(8 * count), dtype='<i8' if kind == 'int64' else '<f8')
+        yield block
+
+
+def gzip_chunks(chunks, level=6):
+    # gzip on the fly; each chunk is flushed so the client sees progress
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(export_format, batches, gzip=False):
+    chunks = {'csv': csv_chunks, 'ndjson': ndjson_chunks, 'columnar': columnar_chunks}[export_format](batches)
+    return gzip_chunks(chunks) if gzip else chunks
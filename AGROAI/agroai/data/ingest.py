@@ -0,0 +1,355 @@
+import csv
+import gzip
+import json
+import math
+import os
+import resource
+import sys
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .models import OceanData
+from .signals import ocean_data_ingested
+from .spatial import grid_cell
+
+# Canonical unit stored for each parameter
+CANONICAL_UNITS = {
+    'temperature': '°C',
+    'salinity': 'PSU',
+    'ph': 'pH',
+    'dissolved_oxygen': 'mg/L',
+    'chlorophyll': 'mg/m³',
+    'turbidity': 'NTU',
+}
+
+PARAMETER_ALIASES = {
+    'temp': 'temperature',
+    'sst': 'temperature',
+    'water_temperature': 'temperature',
+    'sea_surface_temperature': 'temperature',
+    'sal': 'salinity',
+    'psal': 'salinity',
+    'oxygen': 'dissolved_oxygen',
+    'do': 'dissolved_oxygen',
+    'o2': 'dissolved_oxygen',
+    'doxy': 'dissolved_oxygen',
+    'chl': 'chlorophyll',
+    'chla': 'chlorophyll',
+    'chlorophyll_a': 'chlorophyll',
+}
+
+# Converters from a source unit (lowercased) to the canonical unit
+UNIT_CONVERSIONS = {
+    'temperature': {
+        '°c': lambda v: v,
+        'c': lambda v: v,
+        'degc': lambda v: v,
+        'celsius': lambda v: v,
+        '°f': lambda v: (v - 32.0) * 5.0 / 9.0,
+        'f': lambda v: (v - 32.0) * 5.0 / 9.0,
+        'degf': lambda v: (v - 32.0) * 5.0 / 9.0,
+        'fahrenheit': lambda v: (v - 32.0) * 5.0 / 9.0,
+        'k': lambda v: v - 273.15,
+        'kelvin': lambda v: v - 273.15,
+    },
+    'salinity': {
+        'psu': lambda v: v,
+        'pss-78': lambda v: v,
+        'ppt': lambda v: v,
+        'g/kg': lambda v: v,
+    },
+    'ph': {
+        'ph': lambda v: v,
+        '': lambda v: v,
+    },
+    'dissolved_oxygen': {
+        'mg/l': lambda v: v,
+        'ml/l': lambda v: v * 1.429,
+        'umol/kg': lambda v: v * 0.032 * 1.025,
+        'µmol/kg': lambda v: v * 0.032 * 1.025,
+        'umol/l': lambda v: v * 0.032,
+        'µmol/l': lambda v: v * 0.032,
+    },
+    'chlorophyll': {
+        'mg/m³': lambda v: v,
+        'mg/m3': lambda v: v,
+        'ug/l': lambda v: v,
+        'µg/l': lambda v: v,
+    },
+    'turbidity': {
+        'ntu': lambda v: v,
+        'fnu': lambda v: v,
+    },
+}
+
+# Physically plausible ranges in canonical units, used to reject sensor garbage
+VALID_RANGES = {
+    'temperature': (-3.0, 45.0),
+    'salinity': (0.0, 45.0),
+    'ph': (6.5, 9.0),
+    'dissolved_oxygen': (0.0, 20.0),
+    'chlorophyll': (0.0, 100.0),
+    'turbidity': (0.0, 1000.0),
+}
+
+REGIONS = {code for code, _ in OceanData.REGION_CHOICES}
+
+
+class IngestError(ValueError):
+    pass
+
+
+def normalize_record(record):
+    # Returns a dict of OceanData field values in canonical units. Raises
+    # IngestError for any record it cannot use, so one bad row is rejected
+    # rather than aborting the ingest.
+    if not isinstance(record, dict):
+        raise IngestError(f"Expected an object, got {type(record).__name__}")
+    parameter = str(record.get('parameter', '')).strip().lower()
+    parameter = PARAMETER_ALIASES.get(parameter, parameter)
+    if parameter not in CANONICAL_UNITS:
+        raise IngestError(f"Unknown parameter '{record.get('parameter')}'")
+
+    region = str(record.get('region', '')).strip().lower()
+    if region.endswith(' ocean'):
+        region = region[:-len(' ocean')]
+    if region not in REGIONS:
+        raise IngestError(f"Unknown region '{record.get('region')}'")
+
+    try:
+        value = float(record.get('value'))
+    except (TypeError, ValueError, OverflowError):
+        raise IngestError(f"Invalid value '{record.get('value')}'")
+
+    unit = str(record.get('unit') or CANONICAL_UNITS[parameter]).strip()
+    convert = UNIT_CONVERSIONS[parameter].get(unit.lower())
+    if convert is None:
+        raise IngestError(f"Unsupported unit '{unit}' for {parameter}")
+    value = convert(value)
+
+    low, high = VALID_RANGES[parameter]
+    if not math.isfinite(value) or not low <= value <= high:
+        raise IngestError(f"Value {value} out of range for {parameter}")
+
+    timestamp = record.get('timestamp')
+    try:
+        if isinstance(timestamp, (int, float)):
+            timestamp = datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+        elif not isinstance(timestamp, datetime):
+            # Well-formed but impossible dates ("2024-13-45") raise ValueError
+            timestamp = parse_datetime(str(timestamp or '').strip())
+    except (ValueError, OverflowError, OSError):
+        timestamp = None
+    if timestamp is None:
+        raise IngestError(f"Invalid timestamp '{record.get('timestamp')}'")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=dt_timezone.utc)
+
+    latitude = _optional_float(record, 'latitude', -90.0, 90.0)
+    longitude = _optional_float(record, 'longitude', -180.0, 180.0)
+    return {
+        'region': region,
+        'parameter': parameter,
+        'value': value,
+        'unit': CANONICAL_UNITS[parameter],
+        'timestamp': timestamp,
+        'latitude': latitude,
+        'longitude': longitude,
+        'depth': _optional_float(record, 'depth', 0.0, 11000.0),
+        # bulk_create bypasses OceanData.save(), so the cell is set here
+        'grid_cell': grid_cell(latitude, longitude),
+    }
+
+
+def _optional_float(record, field, low, high):
+    raw = record.get(field)
+    if raw is None or raw == '':
+        return None
+    try:
+        value = float(raw)
+    except (TypeError, ValueError, OverflowError):
+        raise IngestError(f"Invalid {field} '{raw}'")
+    if not low <= value <= high:
+        raise IngestError(f"{field} {value} out of range")
+    return value
+
+
+def open_source(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    raise IngestError(f"Cannot detect format of '{path}', pass --format")
+
+
+def iter_records(stream, fmt, offset=0, line=0):
+    # Yields (record, line_number, byte_offset_after_record) without reading
+    # the whole file, so a checkpoint can resume right after any record.
+    header = None
+    if fmt == 'csv':
+        header_line = stream.readline()
+        try:
+            header = next(csv.reader([header_line.decode('utf-8-sig')]))
+        except UnicodeDecodeError as e:
+            # Without a header no row can be read
+            raise IngestError(f"Invalid UTF-8 in the CSV header at byte {e.start}") from e
+        header = [name.strip().lower() for name in header]
+    if offset:
+        stream.seek(offset)
+
+    if not offset:
+        line = 1 if fmt == 'csv' else 0
+    position = {'offset': stream.tell(), 'line': line}
+
+    def lines():
+        # A line that is not valid UTF-8 is passed on with replacement
+        # characters and flagged, so the record it belongs to is rejected
+        # on its own instead of ending the ingest
+        for raw in stream:
+            position['offset'] += len(raw)
+            position['line'] += 1
+            try:
+                yield raw.decode('utf-8')
+            except UnicodeDecodeError as e:
+                position['error'] = f"Invalid UTF-8 at byte {e.start}: {raw[:80]!r}"
+                yield raw.decode('utf-8', errors='replace')
+
+    if fmt == 'csv':
+        for row in csv.reader(lines()):
+            error = position.pop('error', None)
+            if error:
+                yield {'_error': error}, position['line'], position['offset']
+            elif row:
+                yield dict(zip(header, row)), position['line'], position['offset']
+    else:
+        for text in lines():
+            error = position.pop('error', None)
+            text = text.strip()
+            if error:
+                record = {'_error': error}
+            elif not text:
+                continue
+            else:
+                try:
+                    record = json.loads(text)
+                except ValueError:
+                    record = {'_error': f"Invalid JSON: {text[:80]}"}
+            yield record, position['line'], position['offset']
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, state):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class OceanDataIngestor:
+    def __init__(self, user, batch_size=5000, checkpoint_path=None, strict=False, log=None):
+        self.user = user
+        self.batch_size = batch_size
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.strict = strict
+        self.log = log or (lambda message: None)
+        self.stats = {'rows_written': 0, 'rows_rejected': 0, 'batches': 0, 'elapsed': 0.0}
+        self.previously_written = 0
+
+    def ingest_file(self, path, fmt=None, resume=False):
+        fmt = fmt or detect_format(path)
+        state = self.checkpoint.load() if resume else {}
+        if state and state.get('source') != os.path.abspath(path):
+            raise IngestError(f"Checkpoint belongs to '{state.get('source')}', not '{path}'")
+
+        offset = state.get('offset', 0)
+        self.previously_written = state.get('rows_written', 0)
+        if offset:
+            self.log(f"Resuming at byte {offset} ({self.previously_written} rows already written)")
+
+        with open_source(path) as stream:
+            records = iter_records(stream, fmt, offset, state.get('line', 0))
+            self.ingest(records, source=os.path.abspath(path))
+        self.checkpoint.clear()
+        return self.stats
+
+    def ingest(self, records, source=None):
+        started = time.monotonic()
+        batch = []
+        last_offset = last_line = None
+        for record, line, offset in records:
+            try:
+                if isinstance(record, dict) and '_error' in record:
+                    raise IngestError(record['_error'])
+                batch.append(OceanData(user=self.user, **normalize_record(record)))
+            except IngestError as e:
+                if self.strict:
+                    raise IngestError(f"Line {line}: {e}")
+                self.stats['rows_rejected'] += 1
+                if self.stats['rows_rejected'] <= 10:
+                    self.log(f"Skipping line {line}: {e}")
+            last_offset, last_line = offset, line
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch, source, last_offset, last_line)
+                batch = []
+        if batch or last_offset is not None:
+            self._write_batch(batch, source, last_offset, last_line)
+        self.stats['elapsed'] += time.monotonic() - started
+        return self.stats
+
+    def _write_batch(self, batch, source, offset, line):
+        batch_id = uuid.uuid4().hex
+        if batch:
+            with transaction.atomic():
+                OceanData.objects.bulk_create(batch, batch_size=self.batch_size)
+            self.stats['rows_written'] += len(batch)
+            self.stats['batches'] += 1
+            ocean_data_ingested.send(sender=OceanData, batch_id=batch_id, rows=batch)
+        self.checkpoint.save({
+            'source': source,
+            'offset': offset,
+            'line': line,
+            'rows_written': self.previously_written + self.stats['rows_written'],
+        })
+
+    def report(self):
+        elapsed = self.stats['elapsed'] or 1e-9
+        return {
+            'rows_written': self.stats['rows_written'],
+            'rows_rejected': self.stats['rows_rejected'],
+            'batches': self.stats['batches'],
+            'elapsed_seconds': round(self.stats['elapsed'], 3),
+            'rows_per_second': round(self.stats['rows_written'] / elapsed, 1),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
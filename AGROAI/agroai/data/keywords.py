@@ -0,0 +1,108 @@
+import threading
+from functools import reduce
+from itertools import repeat
+from operator import or_
+
+# Keyword tables: category -> [(label, [keywords]), ...]. Earlier labels take
+# precedence where callers need a single answer.
+OCEAN_KEYWORDS = {
+    'parameter': [
+        ('temperature', ['temperature', 'temp', 'thermal', 'sst']),
+        ('salinity', ['salinity', 'salt']),
+        ('ph', ['ph', 'acidity']),
+        ('dissolved_oxygen', ['oxygen', 'o2']),
+        ('chlorophyll', ['chlorophyll', 'chl']),
+        ('turbidity', ['turbidity']),
+    ],
+    'topic': [
+        ('ecosystem', ['ecosystem', 'marine', 'species']),
+    ],
+    'region': [
+        ('Pacific', ['pacific']),
+        ('Atlantic', ['atlantic']),
+        ('Indian', ['indian']),
+        ('Arctic', ['arctic']),
+        ('Southern', ['southern']),
+        ('Mediterranean', ['mediterranean']),
+    ],
+}
+
+
+# Byte table turning everything but ASCII letters and digits into spaces
+SEPARATORS = bytes(c if chr(c).isascii() and chr(c).isalnum() else 32 for c in range(256))
+
+
+class KeywordMatcher:
+    # Classifies text against several keyword tables in one pass. The text
+    # is lowercased and split into words in C (bytes.translate/split), then
+    # intersected with a hash set of every keyword and its plural forms,
+    # so matching is on whole words: "ph" does not fire inside "graph".
+    # Each keyword maps to a bitmask of the labels it implies; the OR of
+    # the masks is decoded once per distinct combination and memoized.
+    # Multi-word keywords ("good morning") are only looked for when their
+    # first word occurs. Results are built from immutable tuples, so one
+    # matcher can be shared between threads.
+    #
+    # Keywords of the labels in `exact` get no plural forms, for words
+    # that are not nouns: "hi" would otherwise match "his".
+
+    def __init__(self, tables, exact=()):
+        self.tables = tables
+        self.labels = []
+        self.masks = {}
+        for category, entries in tables.items():
+            for label, keywords in entries:
+                bit = 1 << len(self.labels)
+                self.labels.append((category, label))
+                for keyword in keywords:
+                    keyword = b' '.join(self._words(keyword))
+                    forms = (keyword,) if label in exact else (keyword, keyword + b's', keyword + b'es')
+                    for form in forms:
+                        self.masks[form] = self.masks.get(form, 0) | bit
+
+        self.phrases = {}
+        for keyword in self.masks:
+            if b' ' in keyword:
+                self.phrases.setdefault(keyword.split()[0], []).append(b' %s ' % keyword)
+        self.words = frozenset(k for k in self.masks if b' ' not in k) | frozenset(self.phrases)
+        self.decoded = {}
+        self.decoded_lock = threading.Lock()
+
+    def _words(self, text):
+        return text.lower().encode('utf-8').translate(SEPARATORS).split()
+
+    def match(self, text):
+        # {category: (labels,)} with labels in table order
+        words = self._words(text)
+        found = self.words.intersection(words)
+        mask = reduce(or_, map(self.masks.get, found, repeat(0)), 0)
+        if not self.phrases.keys().isdisjoint(found):
+            padded = b' %s ' % b' '.join(words)
+            for head in self.phrases.keys() & found:
+                for phrase in self.phrases[head]:
+                    if phrase in padded:
+                        mask |= self.masks[phrase[1:-1]]
+        return dict(self._decode(mask))
+
+    def _decode(self, mask):
+        decoded = self.decoded.get(mask)
+        if decoded is None:
+            result = {category: [] for category in self.tables}
+            for bit, (category, label) in enumerate(self.labels):
+                if mask >> bit & 1:
+                    result[category].append(label)
+            decoded = {category: tuple(labels) for category, labels in result.items()}
+            with self.decoded_lock:
+                self.decoded.setdefault(mask, decoded)
+        return decoded
+
+
+def merge_tables(*tables):
+    merged = {}
+    for table in tables:
+        for category, entries in table.items():
+            merged.setdefault(category, []).extend(entries)
+    return merged
+
+
+ocean_matcher = KeywordMatcher(OCEAN_KEYWORDS)
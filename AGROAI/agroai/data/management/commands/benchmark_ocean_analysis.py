@@ -0,0 +1,133 @@
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from agroai.benchmarking import Timer, benchmark_database, generate_ocean_data, latency_summary
+from data import analysis_cache, analytics
+from data.data_sources import OceanDataProcessor
+from data.series import load_series, query_series
+from data.series_cache import get_series_cache
+
+QUESTIONS = {
+    'temperature': 'What is the temperature trend in the Pacific?',
+    'salinity': 'Show salinity levels in the Pacific',
+    'ph': 'Is pH dropping in the Pacific?',
+    'dissolved_oxygen': 'Dissolved oxygen in the Pacific',
+    'chlorophyll': 'How healthy is the marine ecosystem in the Pacific?',
+}
+# How each parameter is named in the compound question
+COMPOUND_TERMS = {
+    'temperature': 'temperature',
+    'salinity': 'salinity',
+    'ph': 'pH',
+    'dissolved_oxygen': 'oxygen',
+    'chlorophyll': 'ecosystem health',
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure per-chat-query latency of OceanDataProcessor analyses on large series.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=1000000, help='Observations per series')
+        parser.add_argument('--parameters', default='temperature,dissolved_oxygen')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        parameters = options['parameters'].split(',')
+        unknown = set(parameters) - set(QUESTIONS)
+        if unknown:
+            raise CommandError(f"Unsupported parameters: {', '.join(sorted(unknown))}")
+
+        processor = OceanDataProcessor()
+        results = []
+        with benchmark_database():
+            user = User.objects.create_user('benchmark')
+            for parameter in parameters:
+                self.stderr.write(f"Generating {options['points']} {parameter} observations...")
+                generate_ocean_data(user, options['points'], regions=['pacific'], parameters=[parameter],
+                                    interval=timedelta(minutes=5))
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+            for parameter in parameters:
+                load, cold, warm, compute, total, cached = [], [], [], [], [], []
+                for _ in range(options['repeat']):
+                    with Timer() as timer:
+                        query_series('pacific', parameter)
+                    load.append(timer.elapsed)
+                    get_series_cache().invalidate('pacific', parameter)
+                    with Timer() as timer:
+                        load_series('pacific', parameter)
+                    cold.append(timer.elapsed)
+                    with Timer() as timer:
+                        timestamps, values = load_series('pacific', parameter)
+                    warm.append(timer.elapsed)
+                    with Timer() as timer:
+                        climatology = analytics.monthly_climatology(timestamps, values)
+                        analytics.deseasonalized_trend(timestamps, values, climatology)
+                        analytics.recent_anomaly(timestamps, values, climatology)
+                    compute.append(timer.elapsed)
+                    analysis_cache.bump_versions([('pacific', parameter)])
+                    with Timer() as timer:
+                        processor.analyze_query(QUESTIONS[parameter])
+                    total.append(timer.elapsed)
+                    with Timer() as timer:
+                        processor.analyze_query(QUESTIONS[parameter].lower())
+                    cached.append(timer.elapsed)
+                results.append({
+                    'parameter': parameter,
+                    'points': int(values.size),
+                    'database_load': latency_summary(load),
+                    'series_cache_cold': latency_summary(cold),
+                    'series_cache_warm': latency_summary(warm),
+                    'numpy_compute': latency_summary(compute),
+                    'analyze_query': latency_summary(total),
+                    'analyze_query_cached': latency_summary(cached),
+                })
+                self.stderr.write(json.dumps(results[-1]))
+
+            compound = self.compound(processor, parameters, options) if len(parameters) > 1 else None
+
+        self.stdout.write(json.dumps({
+            'benchmark': 'ocean_analysis',
+            'results': results,
+            'compound': compound,
+            'analysis_cache': analysis_cache.stats(),
+        }, indent=2))
+
+    def compound(self, processor, parameters, options):
+        # One question naming every parameter against the same questions
+        # asked one after another, all uncached and on warm series
+        question = f"Compare {' and '.join(COMPOUND_TERMS[p] for p in parameters)} in the Pacific"
+        pairs = [('pacific', parameter) for parameter in parameters]
+        sequential, slowest, combined = [], [], []
+        for _ in range(options['repeat']):
+            analysis_cache.bump_versions(pairs)
+            parts = []
+            for parameter in parameters:
+                with Timer() as timer:
+                    processor.analyze_query(QUESTIONS[parameter])
+                parts.append(timer.elapsed)
+            sequential.append(sum(parts))
+            slowest.append(max(parts))
+            analysis_cache.bump_versions(pairs)
+            with Timer() as timer:
+                processor.analyze_query(question)
+            combined.append(timer.elapsed)
+        result = {
+            'question': question,
+            # Parts only overlap as far as there are CPUs to run them
+            'workers': getattr(settings, 'OCEAN_QUERY_WORKERS', 4),
+            'cpus': len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count(),
+            'sequential_sum': latency_summary(sequential),
+            'slowest_part': latency_summary(slowest),
+            'compound': latency_summary(combined),
+        }
+        self.stderr.write(json.dumps(result))
+        return result
@@ -0,0 +1,87 @@
+import asyncio
+import json
+from importlib import import_module
+
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from agroai.benchmarking import PeakMemory, Timer, benchmark_database, generate_ocean_data
+from data.export import export_batches, export_chunks, export_range
+
+# (format, gzip) pairs exported straight from the generator
+VARIANTS = [('csv', False), ('ndjson', False), ('columnar', False), ('csv', True), ('columnar', True)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark streaming OceanData exports: rows/s and peak memory per format.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000_000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        results = []
+        with benchmark_database():
+            self.user = User.objects.create_user('benchmark')
+            self.stderr.write(f"Generating {options['rows']} observations...")
+            generate_ocean_data(self.user, options['rows'], seed=options['seed'])
+
+            for export_format, gzip in VARIANTS:
+                queryset, after, until = export_range()
+                written = 0
+                with PeakMemory() as memory, Timer() as timer:
+                    for chunk in export_chunks(export_format, export_batches(queryset, after, until), gzip=gzip):
+                        written += len(chunk)
+                results.append(self.result(f"{export_format}{'+gzip' if gzip else ''}", options['rows'],
+                                           written, timer, memory))
+                self.stderr.write(json.dumps(results[-1]))
+
+            # The endpoint through the ASGI application, reading the body
+            # as it streams
+            with PeakMemory() as memory, Timer() as timer:
+                written = asyncio.run(self.request('/data/api/export/?format=csv'))
+            results.append(self.result('csv over ASGI', options['rows'], written, timer, memory))
+            self.stderr.write(json.dumps(results[-1]))
+
+        self.stdout.write(json.dumps({'benchmark': 'ocean_export', 'rows': options['rows'], 'results': results},
+                                     indent=2))
+
+    def result(self, name, rows, written, timer, memory):
+        return {
+            'variant': name,
+            'rows_per_second': round(rows / timer.elapsed),
+            'seconds': round(timer.elapsed, 2),
+            'output_mb': round(written / 2 ** 20, 1),
+            **memory.report(),
+        }
+
+    async def request(self, path):
+        from asgiref.sync import sync_to_async
+        from agroai.asgi import application
+
+        cookie = await sync_to_async(self.session_cookie)()
+        path, query = path.split('?')
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http', 'http_version': '1.1', 'method': 'GET', 'path': path,
+            'query_string': query.encode(), 'headers': [(b'host', b'localhost'), (b'cookie', cookie)],
+        })
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output(60)
+        assert start['status'] == 200, start
+        written = 0
+        while True:
+            message = await communicator.receive_output(60)
+            written += len(message.get('body', b''))
+            if not message.get('more_body'):
+                return written
+
+    def session_cookie(self):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(self.user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = self.user.get_session_auth_hash()
+        session.save()
+        return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'.encode()
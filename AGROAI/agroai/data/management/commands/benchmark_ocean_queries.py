@@ -0,0 +1,83 @@
+import json
+import random
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from agroai.benchmarking import (
+    SYNTHETIC_REGIONS, Timer, benchmark_database, generate_ocean_data, latency_summary,
+)
+from data.models import OceanData
+from data.queries import readings_page
+
+
+class Command(BaseCommand):
+    help = 'Measure readings API latency (keyset vs OFFSET paging) as OceanData grows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100000,1000000,10000000',
+                            help='Comma-separated table sizes to measure at')
+        parser.add_argument('--queries', type=int, default=200, help='Queries per size')
+        parser.add_argument('--pages', type=int, default=20, help='Pages walked per query')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+
+        rng = random.Random(options['seed'])
+        results = []
+        with benchmark_database():
+            user = User.objects.create_user('benchmark')
+            rows = 0
+            for size in sizes:
+                self.stderr.write(f'Growing table to {size} rows...')
+                rows += generate_ocean_data(user, size - rows, seed=size)
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+                results.append(self._measure(size, rng, options))
+                self.stderr.write(json.dumps(results[-1]))
+
+        self.stdout.write(json.dumps({'benchmark': 'ocean_queries', 'results': results}, indent=2))
+
+    def _measure(self, size, rng, options):
+        first, deep, offset_deep = [], [], []
+        oldest = OceanData.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+        newest = OceanData.objects.order_by('-timestamp').values_list('timestamp', flat=True).first()
+        span = max((newest - oldest).total_seconds(), 1)
+        page_size = options['page_size']
+
+        for _ in range(options['queries']):
+            region = rng.choice(SYNTHETIC_REGIONS)
+            parameter = rng.choice(['temperature', 'salinity', 'ph', 'dissolved_oxygen'])
+            end = oldest + timedelta(seconds=rng.uniform(span * 0.25, span))
+            start = end - timedelta(days=90)
+
+            cursor = None
+            for page in range(options['pages']):
+                with Timer() as timer:
+                    rows, cursor = readings_page(region, parameter, start, end, cursor, page_size)
+                (first if page == 0 else deep).append(timer.elapsed)
+                if cursor is None:
+                    break
+
+            # The same deepest page fetched the old way, for comparison
+            with Timer() as timer:
+                list(OceanData.objects.filter(
+                    region=region, parameter=parameter, timestamp__gte=start, timestamp__lt=end,
+                ).order_by('-timestamp', '-id').values('id', 'timestamp', 'value')[
+                    (options['pages'] - 1) * page_size:options['pages'] * page_size
+                ])
+            offset_deep.append(timer.elapsed)
+
+        return {
+            'rows': size,
+            'keyset_first_page': latency_summary(first),
+            'keyset_next_pages': latency_summary(deep),
+            'offset_deep_page': latency_summary(offset_deep),
+        }
@@ -0,0 +1,75 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from data.export import BATCH_SIZE, FORMATS, export_batches, export_chunks, export_range
+from data.queries import InvalidQuery, parse_time
+
+
+class Command(BaseCommand):
+    help = 'Stream OceanData to a CSV, NDJSON or columnar file in id order, optionally gzipped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, or '-' for stdout")
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress (default for paths ending in .gz)')
+        parser.add_argument('--region')
+        parser.add_argument('--parameter')
+        parser.add_argument('--start', help='ISO timestamp, inclusive')
+        parser.add_argument('--end', help='ISO timestamp, exclusive')
+        parser.add_argument('--after', type=int, help='Resume after this id')
+        parser.add_argument('--until', type=int, help='Last id of the export being resumed')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per query')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        try:
+            queryset, after, until = export_range(
+                region=options['region'],
+                parameter=options['parameter'],
+                start=parse_time(options['start'], 'start'),
+                end=parse_time(options['end'], 'end'),
+                after=options['after'],
+                until=options['until'],
+            )
+        except InvalidQuery as e:
+            raise CommandError(str(e))
+
+        progress = {'rows': 0, 'last_id': after}
+
+        def counted(batches):
+            for rows in batches:
+                yield rows
+                progress['rows'] += len(rows)
+                progress['last_id'] = rows[-1][0]
+
+        gzip = options['gzip'] or options['path'].endswith('.gz')
+        chunks = export_chunks(options['format'], counted(export_batches(queryset, after, until, options['batch_size'])),
+                               gzip=gzip)
+        written = 0
+        started = time.perf_counter()
+        output = sys.stdout.buffer if options['path'] == '-' else open(options['path'], 'wb')
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        except BaseException:
+            self.stderr.write(f"Stopped after id {progress['last_id']}; resume into a new file with "
+                              f"--after {progress['last_id']} --until {until}")
+            raise
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        elapsed = time.perf_counter() - started
+
+        self.stderr.write(json.dumps({
+            'rows': progress['rows'],
+            'bytes': written,
+            'seconds': round(elapsed, 2),
+            'rows_per_second': round(progress['rows'] / elapsed) if elapsed else None,
+            'after': after,
+            'until': until,
+        }))
@@ -0,0 +1,57 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from data.ingest import IngestError, OceanDataIngestor
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV or JSON-lines sensor dump into OceanData using batched bulk inserts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSON-lines file (optionally .gz)')
+        parser.add_argument('--user', required=True, help='Username that owns the ingested rows')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Input format (default: from extension)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert transaction')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: <path>.checkpoint)')
+        parser.add_argument('--resume', action='store_true', help='Continue from the last checkpoint')
+        parser.add_argument('--strict', action='store_true', help='Abort on the first invalid row')
+        parser.add_argument('--json', action='store_true', help='Print the throughput report as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist")
+
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        ingestor = OceanDataIngestor(
+            user,
+            batch_size=options['batch_size'],
+            checkpoint_path=options['checkpoint'] or f"{options['path']}.checkpoint",
+            strict=options['strict'],
+            log=lambda message: self.stderr.write(message),
+        )
+
+        try:
+            ingestor.ingest_file(options['path'], fmt=options['format'], resume=options['resume'])
+        except (IngestError, OSError) as e:
+            raise CommandError(str(e))
+
+        report = ingestor.report()
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingested {report['rows_written']} rows in {report['batches']} batches "
+            f"({report['rows_rejected']} rejected)"
+        ))
+        self.stdout.write(
+            f"Elapsed: {report['elapsed_seconds']}s, "
+            f"throughput: {report['rows_per_second']} rows/s, "
+            f"peak RSS: {report['peak_rss_mb']} MB"
+        )
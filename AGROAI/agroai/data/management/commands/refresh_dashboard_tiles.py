@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from data.dashboard import refresh_tiles
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the dashboard tiles of every region and parameter from the rollups.'
+
+    def handle(self, *args, **options):
+        written = refresh_tiles()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} dashboard tiles"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from data.rollups import rebuild_rollups, refresh_rollups
+
+
+class Command(BaseCommand):
+    help = 'Fold new OceanData rows into the hourly and daily rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Drop all rollups and recompute them from raw rows')
+
+    def handle(self, *args, **options):
+        updated = rebuild_rollups() if options['rebuild'] else refresh_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} rollup buckets"))
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='oceandata',
+            index=models.Index(fields=['region', 'parameter', 'timestamp'], name='oceandata_region_param_ts'),
+        ),
+        migrations.AddIndex(
+            model_name='oceandata',
+            index=models.Index(fields=['user', 'timestamp'], name='oceandata_user_ts'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0002_oceandata_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OceanDataRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=8)),
+                ('region', models.CharField(choices=[('pacific', 'Pacific Ocean'), ('atlantic', 'Atlantic Ocean'), ('indian', 'Indian Ocean'), ('arctic', 'Arctic Ocean'), ('southern', 'Southern Ocean')], max_length=20)),
+                ('parameter', models.CharField(max_length=50)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField()),
+                ('total', models.FloatField()),
+                ('minimum', models.FloatField()),
+                ('maximum', models.FloatField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='oceandatarollup',
+            constraint=models.UniqueConstraint(fields=('resolution', 'region', 'parameter', 'bucket_start'), name='oceandatarollup_bucket_unique'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:29
+
+import math
+
+from django.db import migrations, models
+
+
+def backfill_grid_cells(apps, schema_editor):
+    # Same 1-degree grid as data.spatial.grid_cell, inlined so the
+    # migration does not depend on application code
+    OceanData = apps.get_model('data', 'OceanData')
+    located = OceanData.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    last_id = 0
+    while True:
+        batch = list(located.filter(id__gt=last_id).order_by('id').only('id', 'latitude', 'longitude')[:5000])
+        if not batch:
+            break
+        for row in batch:
+            lat_row = min(int(math.floor(row.latitude + 90.0)), 179)
+            col = int(math.floor(row.longitude + 180.0)) % 360
+            row.grid_cell = lat_row * 360 + col
+        OceanData.objects.bulk_update(batch, ['grid_cell'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0003_ocean_data_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='oceandata',
+            name='grid_cell',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='oceandata',
+            index=models.Index(fields=['grid_cell', 'parameter', 'timestamp'], name='oceandata_cell_param_ts'),
+        ),
+        migrations.RunPython(backfill_grid_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0004_oceandata_grid_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardTile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(choices=[('pacific', 'Pacific Ocean'), ('atlantic', 'Atlantic Ocean'), ('indian', 'Indian Ocean'), ('arctic', 'Arctic Ocean'), ('southern', 'Southern Ocean')], max_length=20)),
+                ('parameter', models.CharField(max_length=50)),
+                ('period', models.CharField(choices=[('24h', 'Last 24 hours'), ('7d', 'Last 7 days'), ('30d', 'Last 30 days'), ('1y', 'Last year')], max_length=8)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('summary', models.JSONField()),
+                ('series', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['region', 'parameter'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dashboardtile',
+            constraint=models.UniqueConstraint(fields=('period', 'region', 'parameter'), name='dashboardtile_unique'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from . import spatial
 
 class OceanData(models.Model):
     REGION_CHOICES = [
@@ -19,10 +20,95 @@ class OceanData(models.Model):
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
     depth = models.FloatField(null=True, blank=True)
+    # Fixed lat/lon grid cell (see data.spatial), kept in sync with the coordinates
+    grid_cell = models.IntegerField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['region', 'parameter', 'timestamp'], name='oceandata_region_param_ts'),
+            models.Index(fields=['user', 'timestamp'], name='oceandata_user_ts'),
+            models.Index(fields=['grid_cell', 'parameter', 'timestamp'], name='oceandata_cell_param_ts'),
+        ]
 
     def __str__(self):
-        return f"{self.parameter} - {self.region} - {self.timestamp}"
\ No newline at end of file
+        return f"{self.parameter} - {self.region} - {self.timestamp}"
+
+    def save(self, *args, **kwargs):
+        self.grid_cell = spatial.grid_cell(self.latitude, self.longitude)
+        super().save(*args, **kwargs)
+
+class OceanDataRollup(models.Model):
+    RESOLUTION_CHOICES = [
+        ('hour', 'Hourly'),
+        ('day', 'Daily'),
+    ]
+
+    resolution = models.CharField(max_length=8, choices=RESOLUTION_CHOICES)
+    region = models.CharField(max_length=20, choices=OceanData.REGION_CHOICES)
+    parameter = models.CharField(max_length=50)
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    total = models.FloatField()
+    minimum = models.FloatField()
+    maximum = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['bucket_start']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['resolution', 'region', 'parameter', 'bucket_start'],
+                name='oceandatarollup_bucket_unique',
+            ),
+        ]
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def __str__(self):
+        return f"{self.resolution} {self.parameter} - {self.region} - {self.bucket_start}"
+
+
+class RollupWatermark(models.Model):
+    # Highest OceanData id already folded into the rollups
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
+
+
+class DashboardTile(models.Model):
+    # Precomputed dashboard data of one region and parameter over one period
+    # ending at the pair's latest observation, shared by all users; see
+    # data.dashboard
+    PERIOD_CHOICES = [
+        ('24h', 'Last 24 hours'),
+        ('7d', 'Last 7 days'),
+        ('30d', 'Last 30 days'),
+        ('1y', 'Last year'),
+    ]
+
+    region = models.CharField(max_length=20, choices=OceanData.REGION_CHOICES)
+    parameter = models.CharField(max_length=50)
+    period = models.CharField(max_length=8, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    # count, mean, min, max, latest and change from the period before
+    summary = models.JSONField()
+    # [bucket start, count, mean, min, max] rows
+    series = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['region', 'parameter']
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'region', 'parameter'], name='dashboardtile_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.parameter} - {self.region}"
@@ -0,0 +1,74 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import OceanData
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+READING_FIELDS = ['id', 'timestamp', 'value', 'unit', 'latitude', 'longitude', 'depth']
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, pk):
+    payload = json.dumps([timestamp.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, pk = json.loads(base64.urlsafe_b64decode(padded))
+        timestamp = parse_datetime(timestamp)
+        if timestamp is None:
+            raise ValueError
+        return timestamp, int(pk)
+    except (ValueError, TypeError):
+        raise InvalidQuery('Invalid cursor')
+
+
+def parse_time(value, name):
+    if not value:
+        return None
+    try:
+        # None when malformed; ValueError when well formed but impossible,
+        # such as February 30th
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise InvalidQuery(f"Invalid {name} timestamp '{value}'")
+    return parsed
+
+
+def readings_page(region, parameter, start=None, end=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    # Newest-first page of readings for one region/parameter window.
+    # Pagination is keyset based on (timestamp, id) so every page is a
+    # bounded range scan on the (region, parameter, timestamp) index,
+    # however deep the client has paged.
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    queryset = OceanData.objects.filter(region=region, parameter=parameter)
+    if start:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end:
+        queryset = queryset.filter(timestamp__lt=end)
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        # The plain upper bound keeps the index range tight; the OR only
+        # breaks ties between readings sharing the cursor timestamp.
+        queryset = queryset.filter(timestamp__lte=timestamp).filter(
+            Q(timestamp__lt=timestamp) | Q(id__lt=pk)
+        )
+
+    rows = list(queryset.order_by('-timestamp', '-id').values(*READING_FIELDS)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+    return rows, next_cursor
@@ -0,0 +1,91 @@
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+# Series loads of the plan being executed, see SharedLoads
+shared_loads = contextvars.ContextVar('shared_loads', default=None)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def plan_query(analyses, regions):
+    # The (analysis, region) parts of a compound question: every analysis
+    # asked for in every region named, or across all regions (None) when
+    # none was. Grouped by analysis, so regions compare side by side.
+    return [(analysis, region) for analysis in analyses for region in (regions or [None])]
+
+
+class SharedLoads:
+    # Series loaded for one plan, so parts reading the same series (the
+    # oxygen analysis and the ecosystem one both read dissolved oxygen)
+    # load it once. The first part to ask loads it; parts asking
+    # meanwhile wait for that load rather than starting their own.
+
+    def __init__(self):
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        with self.lock:
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = self.futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(load())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+
+def get_query_executor():
+    # Bounded pool running the parts of compound questions. Threads rather
+    # than processes: NumPy and SQLite release the GIL for the heavy work,
+    # and parts share loaded series and the process's caches.
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'OCEAN_QUERY_WORKERS', 4),
+                    thread_name_prefix='ocean-query',
+                )
+    return _executor
+
+
+def _call(run_part, part):
+    # Each pool thread keeps its own connections from part to part rather
+    # than reconnecting for every one, which on SQLite also reapplies the
+    # connection PRAGMAs. A connection an error left unusable is replaced.
+    for connection in connections.all(initialized_only=True):
+        if connection.errors_occurred:
+            if connection.is_usable():
+                connection.errors_occurred = False
+            else:
+                connection.close()
+    return run_part(*part)
+
+
+def execute_plan(plan, run_part):
+    # [run_part(analysis, region) for each part], in plan order. Parts run
+    # concurrently on the pool, each in a copy of the caller's context, and
+    # share one load per series; a single part runs in the calling thread.
+    # The first exception of a part is raised once every part has finished.
+    token = shared_loads.set(SharedLoads())
+    try:
+        if len(plan) == 1:
+            return [run_part(*plan[0])]
+        executor = get_query_executor()
+        futures = [executor.submit(contextvars.copy_context().run, _call, run_part, part) for part in plan]
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+        return [future.result() for future in futures]
+    finally:
+        shared_loads.reset(token)
@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDay, TruncHour
+
+from .models import OceanData, OceanDataRollup, RollupWatermark
+
+WATERMARK_NAME = 'ocean_rollups'
+
+# Bucket width in seconds of each materialized resolution, coarsest first
+ROLLUP_RESOLUTIONS = [
+    ('day', 86400),
+    ('hour', 3600),
+]
+
+# Touched buckets closer together than this are recomputed in one range query
+MAX_BUCKET_GAP = 24
+
+
+def refresh_rollups():
+    # Folds OceanData rows added since the last refresh into the hourly and
+    # daily rollups. Only buckets that received new rows are recomputed:
+    # hourly buckets from raw rows, daily buckets from the hourly ones.
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+        new_rows = OceanData.objects.filter(id__gt=watermark.last_id)
+        high_water = new_rows.aggregate(Max('id'))['id__max']
+        if high_water is None:
+            return 0
+
+        # order_by() drops Meta.ordering, which would add the raw timestamp
+        # to the SELECT DISTINCT and return a row per reading
+        touched = (
+            new_rows.filter(id__lte=high_water)
+            .annotate(bucket=TruncHour('timestamp'))
+            .values_list('region', 'parameter', 'bucket')
+            .order_by()
+            .distinct()
+        )
+        hours_by_series = {}
+        for region, parameter, bucket in touched:
+            hours_by_series.setdefault((region, parameter), set()).add(bucket)
+
+        updated = 0
+        for (region, parameter), hours in hours_by_series.items():
+            updated += _recompute(region, parameter, 'hour', hours)
+            days = {hour.replace(hour=0) for hour in hours}
+            updated += _recompute(region, parameter, 'day', days)
+
+        watermark.last_id = high_water
+        watermark.save()
+    return updated
+
+
+def rebuild_rollups():
+    with transaction.atomic():
+        OceanDataRollup.objects.all().delete()
+        RollupWatermark.objects.filter(name=WATERMARK_NAME).delete()
+    return refresh_rollups()
+
+
+def _recompute(region, parameter, resolution, buckets):
+    width = timedelta(seconds=dict(ROLLUP_RESOLUTIONS)[resolution])
+    rows = []
+    for start, end in _bucket_ranges(sorted(buckets), width):
+        if resolution == 'hour':
+            aggregates = (
+                OceanData.objects
+                .filter(region=region, parameter=parameter, timestamp__gte=start, timestamp__lt=end)
+                .annotate(bucket=TruncHour('timestamp'))
+                .values('bucket')
+                .annotate(count=Count('id'), total=Sum('value'), minimum=Min('value'), maximum=Max('value'))
+            )
+        else:
+            aggregates = (
+                OceanDataRollup.objects
+                .filter(resolution='hour', region=region, parameter=parameter,
+                        bucket_start__gte=start, bucket_start__lt=end)
+                .annotate(bucket=TruncDay('bucket_start'))
+                .values('bucket')
+                .annotate(count=Sum('count'), total=Sum('total'), minimum=Min('minimum'), maximum=Max('maximum'))
+            )
+        rows.extend(
+            OceanDataRollup(
+                resolution=resolution, region=region, parameter=parameter,
+                bucket_start=row['bucket'], count=row['count'], total=row['total'],
+                minimum=row['minimum'], maximum=row['maximum'],
+            )
+            for row in aggregates
+            if row['bucket'] in buckets
+        )
+
+    OceanDataRollup.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['resolution', 'region', 'parameter', 'bucket_start'],
+        update_fields=['count', 'total', 'minimum', 'maximum', 'updated_at'],
+    )
+    return len(rows)
+
+
+def _bucket_ranges(buckets, width):
+    # Merges sorted bucket starts into [start, end) ranges
+    if not buckets:
+        return []
+    ranges = [[buckets[0], buckets[0] + width]]
+    for bucket in buckets[1:]:
+        if bucket - ranges[-1][1] <= width * MAX_BUCKET_GAP:
+            ranges[-1][1] = bucket + width
+        else:
+            ranges.append([bucket, bucket + width])
+    return ranges
+
+
+def choose_resolution(resolution_seconds):
+    # The coarsest rollup whose buckets evenly divide the requested
+    # resolution, or None when only raw rows are fine enough.
+    for name, width in ROLLUP_RESOLUTIONS:
+        if resolution_seconds >= width and resolution_seconds % width == 0:
+            return name
+    return None
+
+
+def aggregate_series(region, parameter, start, end, resolution_seconds):
+    # min/max/mean/count per bucket of `resolution_seconds`, served from the
+    # coarsest rollup that can satisfy the request.
+    source = choose_resolution(resolution_seconds)
+    if source:
+        rows = (
+            OceanDataRollup.objects
+            .filter(resolution=source, region=region, parameter=parameter,
+                    bucket_start__gte=start, bucket_start__lt=end)
+            .order_by('bucket_start')
+            .values_list('bucket_start', 'count', 'total', 'minimum', 'maximum')
+        )
+    else:
+        rows = (
+            (timestamp, 1, value, value, value)
+            for timestamp, value in OceanData.objects
+            .filter(region=region, parameter=parameter, timestamp__gte=start, timestamp__lt=end)
+            .order_by('timestamp')
+            .values_list('timestamp', 'value')
+            .iterator(chunk_size=10000)
+        )
+
+    buckets = {}
+    for timestamp, count, total, minimum, maximum in rows:
+        key = int(timestamp.timestamp()) // resolution_seconds * resolution_seconds
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [count, total, minimum, maximum]
+        else:
+            bucket[0] += count
+            bucket[1] += total
+            bucket[2] = min(bucket[2], minimum)
+            bucket[3] = max(bucket[3], maximum)
+
+    return {
+        'source': source or 'raw',
+        'buckets': [
+            {
+                'bucket_start': datetime.fromtimestamp(key, tz=dt_timezone.utc),
+                'count': count,
+                'total': total,
+                'mean': total / count,
+                'min': minimum,
+                'max': maximum,
+            }
+            for key, (count, total, minimum, maximum) in sorted(buckets.items())
+        ],
+    }
+
+
+def refresh_rollups_on_ingest(sender, **kwargs):
+    refresh_rollups()
@@ -0,0 +1,110 @@
+import numpy as np
+from django.db import connections
+from django.db.models import FloatField, Func, Max
+
+from .models import OceanData
+from . import spatial
+from .series_cache import get_series_cache
+
+
+class EpochSeconds(Func):
+    # Seconds since the Unix epoch as a float, computed in the database so
+    # loading a series never builds a datetime object per row.
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template="ROUND((julianday(%(expressions)s) - 2440587.5) * 86400.0, 3)",
+            **extra_context,
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='EXTRACT(EPOCH FROM %(expressions)s)', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='UNIX_TIMESTAMP(%(expressions)s)', **extra_context)
+
+
+def series_queryset(region, parameter, start=None, end=None, max_id=None):
+    queryset = OceanData.objects.filter(parameter=parameter)
+    if max_id is not None:
+        queryset = queryset.filter(id__lte=max_id)
+    if region:
+        queryset = queryset.filter(region=region)
+    if start:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end:
+        queryset = queryset.filter(timestamp__lt=end)
+    return queryset
+
+
+def load_series(region, parameter, start=None, end=None):
+    # The series as two float64 arrays (epoch seconds, values) sorted by
+    # time. region=None spans all regions. Single-region series are served
+    # from the memory-mapped series cache, which is filled from the
+    # database on first use.
+    cache = get_series_cache() if region else None
+    if cache is None:
+        return query_series(region, parameter, start, end)
+
+    window = (
+        start.timestamp() if start else None,
+        end.timestamp() if end else None,
+    )
+    cached = cache.read(region, parameter, *window)
+    if cached is None:
+        cache.populate(region, parameter, lambda: _load_for_cache(region, parameter), replace=False)
+        cached = cache.read(region, parameter, *window)
+    if cached is None:
+        return query_series(region, parameter, start, end)
+    return cached
+
+
+def _load_for_cache(region, parameter):
+    max_id = series_queryset(region, parameter).aggregate(Max('id'))['id__max'] or 0
+    timestamps, values = query_series(region, parameter, max_id=max_id)
+    return timestamps, values, max_id
+
+
+def query_series(region, parameter, start=None, end=None, max_id=None, chunk_size=50000):
+    # One query for the whole series straight from the database.
+    # Rows are fetched straight from the cursor in chunks and converted per
+    # chunk, which skips per-row model/converter overhead. The raw SQL lists
+    # model fields before annotations, hence the (value, epoch) column order.
+    queryset = (
+        series_queryset(region, parameter, start, end, max_id)
+        .annotate(epoch=EpochSeconds('timestamp'))
+        .order_by('timestamp')
+        .values_list('value', 'epoch')
+    )
+    sql, params = queryset.query.sql_with_params()
+    chunks = []
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+    pairs = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.float64)
+    return np.ascontiguousarray(pairs[:, 1]), np.ascontiguousarray(pairs[:, 0])
+
+
+def load_series_near(region, parameter, latitude, longitude, radius_km,
+                     min_depth=None, max_depth=None, start=None, end=None):
+    # Like load_series, restricted to readings within radius_km of a point
+    # and an optional depth band: grid-cell prefilter in SQL, exact
+    # haversine refinement in NumPy.
+    queryset = spatial.prefilter(
+        spatial.filter_depth(series_queryset(region, parameter, start, end), min_depth, max_depth),
+        latitude, longitude, radius_km,
+    )
+    rows = (
+        queryset.annotate(epoch=EpochSeconds('timestamp'))
+        .order_by('timestamp')
+        .values_list('latitude', 'longitude', 'value', 'epoch')
+    )
+    points = np.array(list(rows), dtype=np.float64).reshape(-1, 4)
+    inside = spatial.haversine_km(latitude, longitude, points[:, 0], points[:, 1]) <= radius_km
+    return np.ascontiguousarray(points[inside, 3]), np.ascontiguousarray(points[inside, 2])
@@ -0,0 +1,240 @@
+import fcntl
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+MANIFEST = 'manifest.json'
+
+# Appends beyond this many segments are folded into a single base segment
+MAX_SEGMENTS = 64
+
+
+class SeriesCache:
+    # Columnar on-disk cache of (epoch seconds, value) series, one directory
+    # per (region, parameter) pair. Each ingest batch adds its own pair of
+    # .npy segment files, so appends never rewrite existing data. Readers
+    # open segments with mmap, letting every worker process share the same
+    # pages through the OS page cache.
+    #
+    # A manifest lists the live segments and the highest OceanData id the
+    # base segment covers; a pair without a manifest is cold.
+
+    def __init__(self, root):
+        self.root = str(root)
+
+    def _pair_dir(self, region, parameter):
+        return os.path.join(self.root, region, parameter)
+
+    @contextmanager
+    def _locked(self, region, parameter):
+        pair_dir = self._pair_dir(region, parameter)
+        lock_path = os.path.join(pair_dir, '.lock')
+        while True:
+            os.makedirs(pair_dir, exist_ok=True)
+            with open(lock_path, 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    # invalidate() may have moved the directory aside while
+                    # we waited; the lock is only good if it is still there
+                    try:
+                        current = os.stat(lock_path)
+                    except FileNotFoundError:
+                        continue
+                    if not os.path.samestat(current, os.fstat(lock.fileno())):
+                        continue
+                    yield pair_dir
+                    return
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load_manifest(self, pair_dir):
+        try:
+            with open(os.path.join(pair_dir, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_manifest(self, pair_dir, manifest):
+        tmp_path = os.path.join(pair_dir, f'.{MANIFEST}.{uuid.uuid4().hex}')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(pair_dir, MANIFEST))
+
+    def _write_segment(self, pair_dir, segment_id, timestamps, values):
+        order = np.argsort(timestamps, kind='stable')
+        for suffix, array in (('ts', timestamps[order]), ('values', values[order])):
+            tmp_path = os.path.join(pair_dir, f'.seg-{segment_id}.{suffix}.{uuid.uuid4().hex}.npy')
+            np.save(tmp_path, np.ascontiguousarray(array, dtype=np.float64))
+            os.replace(tmp_path, os.path.join(pair_dir, f'seg-{segment_id}.{suffix}.npy'))
+        return {
+            'id': segment_id,
+            'rows': int(timestamps.size),
+            'min_ts': float(timestamps.min()) if timestamps.size else None,
+            'max_ts': float(timestamps.max()) if timestamps.size else None,
+        }
+
+    def _remove_segment_files(self, pair_dir, segment_id):
+        for suffix in ('ts', 'values'):
+            try:
+                os.remove(os.path.join(pair_dir, f'seg-{segment_id}.{suffix}.npy'))
+            except FileNotFoundError:
+                pass
+
+    def is_warm(self, region, parameter):
+        return self._load_manifest(self._pair_dir(region, parameter)) is not None
+
+    def populate(self, region, parameter, load, replace=True):
+        # Replaces whatever is cached for the pair with one base segment.
+        # load() returns (timestamps, values, max_id) and runs under the pair
+        # lock, so an ingest batch committed after it read max_id is appended
+        # afterwards instead of being lost. With replace=False a pair that
+        # another thread or process filled while we waited for the lock is
+        # kept, so concurrent misses load the series once.
+        with self._locked(region, parameter) as pair_dir:
+            old = self._load_manifest(pair_dir)
+            if old is not None and not replace:
+                return
+            timestamps, values, max_id = load()
+            segment = self._write_segment(pair_dir, f'base-{uuid.uuid4().hex}', timestamps, values)
+            self._save_manifest(pair_dir, {'max_id': max_id, 'segments': [segment]})
+            for stale in (old or {}).get('segments', []):
+                self._remove_segment_files(pair_dir, stale['id'])
+
+    def append_segment(self, region, parameter, segment_id, ids, timestamps, values):
+        # Adds one ingest batch to a warm pair. Rows the base segment already
+        # covers are skipped; cold pairs are left cold.
+        with self._locked(region, parameter) as pair_dir:
+            manifest = self._load_manifest(pair_dir)
+            if manifest is None:
+                return False
+            fresh = ids > manifest['max_id']
+            if not fresh.any():
+                return True
+            manifest['segments'] = [s for s in manifest['segments'] if s['id'] != segment_id]
+            manifest['segments'].append(
+                self._write_segment(pair_dir, segment_id, timestamps[fresh], values[fresh])
+            )
+            self._save_manifest(pair_dir, manifest)
+        if len(manifest['segments']) > MAX_SEGMENTS:
+            self.compact(region, parameter)
+        return True
+
+    def drop_segment(self, region, parameter, segment_id):
+        with self._locked(region, parameter) as pair_dir:
+            manifest = self._load_manifest(pair_dir)
+            if manifest is None:
+                return
+            manifest['segments'] = [s for s in manifest['segments'] if s['id'] != segment_id]
+            self._save_manifest(pair_dir, manifest)
+            self._remove_segment_files(pair_dir, segment_id)
+
+    def compact(self, region, parameter):
+        with self._locked(region, parameter) as pair_dir:
+            manifest = self._load_manifest(pair_dir)
+            if manifest is None or len(manifest['segments']) <= 1:
+                return
+            timestamps, values = self._read_segments(pair_dir, manifest['segments'])
+            segment = self._write_segment(pair_dir, f'base-{uuid.uuid4().hex}', timestamps, values)
+            old_segments = manifest['segments']
+            manifest['segments'] = [segment]
+            self._save_manifest(pair_dir, manifest)
+            for stale in old_segments:
+                self._remove_segment_files(pair_dir, stale['id'])
+
+    def invalidate(self, region, parameter):
+        # Moves the pair aside under its lock, so a concurrent populate or
+        # append never writes into a half-removed directory, then removes it
+        pair_dir = self._pair_dir(region, parameter)
+        if not os.path.isdir(pair_dir):
+            return
+        stale_dir = os.path.join(os.path.dirname(pair_dir), f'.{parameter}.{uuid.uuid4().hex}.stale')
+        with self._locked(region, parameter):
+            os.rename(pair_dir, stale_dir)
+        shutil.rmtree(stale_dir, ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def read(self, region, parameter, start=None, end=None):
+        # (timestamps, values) for the window, or None on a miss. A window
+        # inside a single segment comes back as zero-copy memmap views.
+        pair_dir = self._pair_dir(region, parameter)
+        manifest = self._load_manifest(pair_dir)
+        if manifest is None:
+            return None
+        segments = [
+            s for s in manifest['segments']
+            if s['rows'] and (start is None or s['max_ts'] >= start) and (end is None or s['min_ts'] < end)
+        ]
+        try:
+            return self._read_segments(pair_dir, segments, start, end)
+        except FileNotFoundError:
+            # Compacted underneath us; the caller falls back to the database
+            return None
+
+    def _read_segments(self, pair_dir, segments, start=None, end=None):
+        parts = []
+        for segment in segments:
+            if not segment['rows']:
+                continue
+            timestamps = np.load(os.path.join(pair_dir, f"seg-{segment['id']}.ts.npy"), mmap_mode='r')
+            values = np.load(os.path.join(pair_dir, f"seg-{segment['id']}.values.npy"), mmap_mode='r')
+            low = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+            high = timestamps.size if end is None else np.searchsorted(timestamps, end, side='left')
+            if high > low:
+                parts.append((timestamps[low:high], values[low:high]))
+
+        if not parts:
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+        if len(parts) == 1:
+            return parts[0]
+
+        timestamps = np.concatenate([p[0] for p in parts])
+        values = np.concatenate([p[1] for p in parts])
+        if np.any(np.diff(timestamps) < 0):
+            order = np.argsort(timestamps, kind='stable')
+            timestamps, values = timestamps[order], values[order]
+        return timestamps, values
+
+
+def get_series_cache():
+    root = getattr(settings, 'OCEAN_SERIES_CACHE_DIR', None)
+    return SeriesCache(root) if root else None
+
+
+def append_ingested_batch(sender, batch_id, rows, **kwargs):
+    # ocean_data_ingested receiver: one new segment per pair in the batch
+    cache = get_series_cache()
+    if cache is None:
+        return
+    groups = {}
+    for row in rows:
+        groups.setdefault((row.region, row.parameter), []).append(row)
+    for (region, parameter), group in groups.items():
+        if any(row.pk is None for row in group):
+            # The backend did not return primary keys, so overlap with the
+            # base segment cannot be ruled out
+            cache.invalidate(region, parameter)
+            continue
+        cache.append_segment(
+            region, parameter, batch_id,
+            np.fromiter((row.pk for row in group), dtype=np.int64, count=len(group)),
+            np.fromiter((row.timestamp.timestamp() for row in group), dtype=np.float64, count=len(group)),
+            np.fromiter((row.value for row in group), dtype=np.float64, count=len(group)),
+        )
+
+
+def invalidate_changed_row(sender, instance, **kwargs):
+    # post_save/post_delete receiver for writes outside the ingestion path.
+    # Waits for the commit so a concurrent reader cannot refill the cache
+    # from the pre-write state.
+    cache = get_series_cache()
+    if cache is not None:
+        region, parameter = instance.region, instance.parameter
+        transaction.on_commit(lambda: cache.invalidate(region, parameter))
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent after each ingestion batch has been committed.
+# Arguments: batch_id, rows (list of saved OceanData instances)
+ocean_data_ingested = Signal()
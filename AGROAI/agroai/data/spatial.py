@@ -0,0 +1,155 @@
+import math
+
+import numpy as np
+from django.db.models import Count, Max, Q
+
+# Fixed lat/lon grid used to bucket readings; cell ids are row * GRID_COLUMNS + col
+GRID_DEGREES = 1.0
+GRID_ROWS = int(180 / GRID_DEGREES)
+GRID_COLUMNS = int(360 / GRID_DEGREES)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Boxes spanning more cells than this skip the cell prefilter and rely on
+# the plain latitude/longitude range instead
+MAX_PREFILTER_CELLS = 900
+
+# Rows fetched per id__in query, under SQLite's bound parameter limit
+LOAD_BATCH_SIZE = 500
+
+
+def grid_cell(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    row = min(int(math.floor((latitude + 90.0) / GRID_DEGREES)), GRID_ROWS - 1)
+    col = int(math.floor((longitude + 180.0) / GRID_DEGREES)) % GRID_COLUMNS
+    return row * GRID_COLUMNS + col
+
+
+def bounding_box(latitude, longitude, radius_km):
+    # (min_lat, max_lat, [(min_lon, max_lon), ...]) enclosing the circle.
+    # Longitude is split in two ranges when the box crosses the antimeridian
+    # and covers every longitude when it reaches a pole.
+    delta_lat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = latitude - delta_lat, latitude + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), [(-180.0, 180.0)]
+
+    delta_lon = delta_lat / math.cos(math.radians(latitude))
+    if delta_lon >= 180:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+    min_lon, max_lon = longitude - delta_lon, longitude + delta_lon
+    if min_lon < -180:
+        return min_lat, max_lat, [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    if max_lon > 180:
+        return min_lat, max_lat, [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    return min_lat, max_lat, [(min_lon, max_lon)]
+
+
+def cells_in_box(min_lat, max_lat, lon_ranges):
+    rows = range(
+        int(math.floor((min_lat + 90.0) / GRID_DEGREES)),
+        min(int(math.floor((max_lat + 90.0) / GRID_DEGREES)), GRID_ROWS - 1) + 1,
+    )
+    cols = set()
+    for min_lon, max_lon in lon_ranges:
+        first = int(math.floor((min_lon + 180.0) / GRID_DEGREES))
+        last = min(int(math.floor((max_lon + 180.0) / GRID_DEGREES)), GRID_COLUMNS - 1)
+        cols.update(range(first, last + 1))
+    if len(rows) * len(cols) > MAX_PREFILTER_CELLS:
+        return None
+    return [row * GRID_COLUMNS + col for row in rows for col in sorted(cols)]
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    # Great-circle distance from one point to arrays of points
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def filter_depth(queryset, min_depth=None, max_depth=None):
+    if min_depth is not None:
+        queryset = queryset.filter(depth__gte=min_depth)
+    if max_depth is not None:
+        queryset = queryset.filter(depth__lte=max_depth)
+    return queryset
+
+
+def prefilter(queryset, latitude, longitude, radius_km):
+    # Cheap indexed bounding-box prefilter; callers refine with haversine_km
+    min_lat, max_lat, lon_ranges = bounding_box(latitude, longitude, radius_km)
+    cells = cells_in_box(min_lat, max_lat, lon_ranges)
+    if cells is not None:
+        queryset = queryset.filter(grid_cell__in=cells)
+    lon_filter = Q()
+    for min_lon, max_lon in lon_ranges:
+        lon_filter |= Q(longitude__gte=min_lon, longitude__lte=max_lon)
+    return queryset.filter(lon_filter, latitude__gte=min_lat, latitude__lte=max_lat)
+
+
+def readings_within(queryset, latitude, longitude, radius_km, fields=('id', 'timestamp', 'value'), limit=None):
+    # (rows, total): the nearest `limit` rows of `queryset` within radius_km
+    # of the point, nearest first, each with a distance_km key, and how
+    # many rows lie within the radius. Distances come from the positions
+    # alone; the other fields are only loaded for the rows returned.
+    candidates = list(prefilter(queryset, latitude, longitude, radius_km).values_list('id', 'latitude', 'longitude'))
+    if not candidates:
+        return [], 0
+    ids = np.fromiter((row[0] for row in candidates), dtype=np.int64, count=len(candidates))
+    distances = haversine_km(
+        latitude, longitude,
+        np.fromiter((row[1] for row in candidates), dtype=np.float64, count=len(candidates)),
+        np.fromiter((row[2] for row in candidates), dtype=np.float64, count=len(candidates)),
+    )
+    order = np.argsort(distances, kind='stable')
+    order = order[distances[order] <= radius_km]
+    total = int(order.size)
+    if limit is not None:
+        order = order[:limit]
+
+    columns = list(dict.fromkeys(('id', 'latitude', 'longitude') + tuple(fields)))
+    loaded = {}
+    for offset in range(0, order.size, LOAD_BATCH_SIZE):
+        batch = ids[order[offset:offset + LOAD_BATCH_SIZE]].tolist()
+        loaded.update((row['id'], row) for row in queryset.filter(id__in=batch).values(*columns))
+    nearby = []
+    for index in order:
+        row = loaded[int(ids[index])]
+        if 'id' not in fields:
+            row = {key: value for key, value in row.items() if key != 'id'}
+        row['distance_km'] = round(float(distances[index]), 3)
+        nearby.append(row)
+    return nearby, total
+
+
+def nearest_stations(queryset, latitude, longitude, limit=1, start_radius_km=50, max_radius_km=2000):
+    # Stations are distinct (latitude, longitude) positions. The search
+    # radius doubles until enough stations are found, so nearby stations
+    # cost a handful of grid cells rather than a table scan.
+    radius = start_radius_km
+    while True:
+        stations = list(
+            prefilter(queryset, latitude, longitude, radius)
+            .values('latitude', 'longitude')
+            .annotate(readings=Count('id'), last_timestamp=Max('timestamp'))
+        )
+        if stations:
+            distances = haversine_km(
+                latitude, longitude,
+                np.array([s['latitude'] for s in stations], dtype=np.float64),
+                np.array([s['longitude'] for s in stations], dtype=np.float64),
+            )
+            found = [
+                dict(station, distance_km=round(float(distance), 3))
+                for station, distance in zip(stations, distances)
+                if distance <= radius
+            ]
+            if len(found) >= limit or radius >= max_radius_km:
+                return sorted(found, key=lambda s: s['distance_km'])[:limit]
+        elif radius >= max_radius_km:
+            return []
+        radius = min(radius * 2, max_radius_km)
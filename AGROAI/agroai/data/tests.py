@@ -1,3 +1,752 @@
-from django.test import TestCase
+import csv
+import fcntl
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from . import analytics, dashboard, export, spatial
+from .ingest import IngestError, OceanDataIngestor, iter_records, normalize_record
+from .analysis_cache import bump_versions, cached_analysis, get_analysis_cache
+from .data_sources import OceanDataProcessor
+from .downsampling import downsample
+from .keywords import OCEAN_KEYWORDS, KeywordMatcher, ocean_matcher
+from .models import DashboardTile, OceanData, OceanDataRollup
+from .queries import readings_page
+from .query_plan import execute_plan, plan_query
+from .rollups import aggregate_series, refresh_rollups
+from .series_cache import MAX_SEGMENTS, SeriesCache
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        OceanData.objects.bulk_create([
+            OceanData(user=self.user, region=region, parameter='temperature', value=15 + i / 10, unit='°C',
+                      timestamp=start + timedelta(hours=i), latitude=None if i % 5 == 0 else 10.5, longitude=-20.25)
+            for i in range(30) for region in ('pacific', 'atlantic')
+        ])
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get('/data/api/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_resume(self):
+        response, body = self.export(region='Pacific', format='csv')
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+        self.assertEqual(len(rows), 30)
+        self.assertEqual({row['region'] for row in rows}, {'pacific'})
+
+        # Resuming after the tenth row returns the rest, and not rows
+        # ingested after the export started
+        OceanData.objects.create(user=self.user, region='pacific', parameter='temperature', value=1, unit='°C',
+                                 timestamp=datetime(2025, 1, 1, tzinfo=dt_timezone.utc))
+        _, rest = self.export(region='pacific', format='csv', after=rows[9]['id'],
+                              until=response['X-Export-Until'])
+        self.assertEqual(list(csv.DictReader(io.StringIO(rest.decode()))), rows[10:])
+
+    def test_ndjson_gzip(self):
+        response, body = self.export(format='ndjson', compress='gzip', parameter='temperature')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+        self.assertEqual(len(lines), 60)
+        self.assertEqual([line['id'] for line in lines], sorted(line['id'] for line in lines))
+
+    def test_columnar_round_trip(self):
+        queryset, after, until = export.export_range()
+        data = b''.join(export.export_chunks('columnar', export.export_batches(queryset, after, until, 7)))
+        blocks = list(export.read_columnar(io.BytesIO(data)))
+        self.assertEqual(sum(len(block['id']) for block in blocks), 60)
+
+        first = OceanData.objects.order_by('id').first()
+        block = blocks[0]
+        self.assertEqual(block['id'][0], first.id)
+        self.assertEqual(block['region'][0], first.region)
+        self.assertEqual(block['timestamp'][0], int(first.timestamp.timestamp()) * 1_000_000)
+        self.assertTrue(block['latitude'][0] != block['latitude'][0])  # NaN for null
+
+    def test_unknown_format(self):
+        response = self.client.get('/data/api/export/', {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        OceanData.objects.bulk_create([
+            OceanData(user=self.user, region=region, parameter='temperature', value=value + i % 4, unit='°C',
+                      timestamp=start + timedelta(hours=i))
+            for i in range(48) for region, value in (('pacific', 10), ('atlantic', 20))
+        ])
+        refresh_rollups()
+        dashboard.refresh_tiles()
+        self.client.force_login(self.user)
+
+    def test_tiles(self):
+        self.assertEqual(DashboardTile.objects.count(), 2 * len(dashboard.PERIODS))
+        tile = DashboardTile.objects.get(region='pacific', parameter='temperature', period='24h')
+        self.assertEqual(tile.summary['count'], 24)
+        self.assertEqual(tile.summary['mean'], 11.5)
+        self.assertEqual(tile.summary['change'], 0)
+        self.assertEqual(tile.summary['latest']['value'], 13)
+        self.assertEqual(len(tile.series), 24)
+
+    def test_tiles_read_through_aggregate_series(self):
+        tile = DashboardTile.objects.get(region='atlantic', parameter='temperature', period='30d')
+        buckets = aggregate_series('atlantic', 'temperature', tile.start, tile.end, 86400)
+        self.assertEqual(buckets['source'], 'day')
+        self.assertEqual(tile.series, [
+            [bucket['bucket_start'].isoformat(), bucket['count'], round(bucket['mean'], 4), bucket['min'], bucket['max']]
+            for bucket in buckets['buckets']
+        ])
+        with mock.patch.object(dashboard, 'aggregate_series', wraps=aggregate_series) as aggregate:
+            dashboard.build_tiles('atlantic', 'temperature')
+        self.assertEqual([call.args[4] for call in aggregate.call_args_list], [3600, 86400])
+
+    def test_endpoints_use_one_query(self):
+        # The session lookup and the user are not part of the dashboard
+        self.client.get('/data/api/dashboard/summary/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/data/api/dashboard/heatmap/', {'parameter': 'temperature'})
+        data = response.json()
+        self.assertEqual(data['regions'], ['atlantic', 'pacific'])
+        self.assertEqual(len(data['buckets']), 48)
+        self.assertEqual(len([q for q in queries if 'data_dashboardtile' in q['sql']]), 1)
+
+    def test_conditional_get(self):
+        response = self.client.get('/data/api/dashboard/summary/', {'period': '30d'})
+        self.assertEqual(len(response.json()['cards']), 2)
+        self.assertIn('private', response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get('/data/api/dashboard/summary/', {'period': '30d'},
+                                     HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(len(queries), 0)
+
+        # Another user's tag for the same URL does not match, but the data
+        # is shared
+        other = User.objects.create_user('diver', password='secret')
+        self.client.force_login(other)
+        theirs = self.client.get('/data/api/dashboard/summary/', {'period': '30d'},
+                                 HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(theirs.status_code, 200)
+        self.assertEqual(theirs.json(), response.json())
+        response = theirs
+
+        # New tiles give new tags
+        with self.captureOnCommitCallbacks(execute=True):
+            dashboard.refresh_tiles()
+        fresh = self.client.get('/data/api/dashboard/summary/', {'period': '30d'},
+                                HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+
+    def test_unknown_period(self):
+        response = self.client.get('/data/api/dashboard/summary/', {'period': '2w'})
+        self.assertEqual(response.status_code, 400)
+
+
+# Parts run on pool threads with their own connections, so the data must
+# be committed
+class CompoundQueryTests(TransactionTestCase):
+    def setUp(self):
+        user = User.objects.create_user('sailor', password='secret')
+        start = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+        OceanData.objects.bulk_create([
+            OceanData(user=user, region=region, parameter=parameter, value=base + offset + i % 7 / 10, unit='',
+                      timestamp=start + timedelta(days=i))
+            for i in range(400)
+            for region, offset in (('pacific', 0), ('indian', 2))
+            for parameter, base in (('temperature', 15), ('dissolved_oxygen', 6), ('chlorophyll', 1))
+        ])
+        self.processor = OceanDataProcessor()
+
+    def test_every_parameter_and_region(self):
+        result = self.processor.analyze_query('Compare temperature and oxygen in the Pacific and Indian oceans')
+        self.assertTrue(result['has_data'])
+        self.assertEqual(result['data']['analyses'], ['temperature', 'dissolved_oxygen'])
+        self.assertEqual(result['data']['regions'], ['Pacific', 'Indian'])
+        parts = [(part['analysis'], part['region']) for part in result['data']['parts']]
+        self.assertEqual(parts, [('temperature', 'Pacific'), ('temperature', 'Indian'),
+                                 ('dissolved_oxygen', 'Pacific'), ('dissolved_oxygen', 'Indian')])
+
+        # Each part matches the answer to its single question
+        single = self.processor.analyze_query('Temperature in the Indian ocean')
+        self.assertEqual(result['data']['parts'][1]['data'], single['data'])
+        self.assertIn('Dissolved oxygen, Indian Ocean', result['insights'])
+
+    def test_series_loaded_once(self):
+        loads = []
+        load_series = OceanDataProcessor._load_series
+
+        def counting(processor, parameter, region, location):
+            loads.append((parameter, region))
+            return load_series(processor, parameter, region, location)
+
+        with mock.patch.object(OceanDataProcessor, '_load_series', counting):
+            result = self.processor.analyze_query('Oxygen and ecosystem health in the Pacific')
+        self.assertEqual([part['analysis'] for part in result['data']['parts']], ['dissolved_oxygen', 'ecosystem'])
+        self.assertEqual(sorted(loads), [('chlorophyll', 'Pacific'), ('dissolved_oxygen', 'Pacific')])
+
+    def test_pool_threads_keep_connections(self):
+        def run_part(analysis, region):
+            OceanData.objects.filter(region=region).exists()
+            return analysis
+
+        plan = plan_query(['temperature', 'salinity'], ['pacific', 'indian'])
+        execute_plan(plan, run_part)
+        # Every pool thread now has a connection, which later parts reuse
+        with mock.patch.object(type(connections['default']), 'close', autospec=True) as close:
+            for _ in range(3):
+                self.assertEqual(execute_plan(plan, run_part), ['temperature'] * 2 + ['salinity'] * 2)
+        close.assert_not_called()
+
+    def test_single_question_unchanged(self):
+        result = self.processor.analyze_query('What is the temperature trend in the Pacific?')
+        self.assertEqual(result['data']['region'], 'Pacific')
+        self.assertNotIn('parts', result['data'])
+
+
+class AnalyticsTests(SimpleTestCase):
+    def days(self, count, start=datetime(2022, 1, 1, tzinfo=dt_timezone.utc)):
+        return start.timestamp() + np.arange(count, dtype=np.float64) * analytics.DAY
+
+    def test_trend_per_decade(self):
+        timestamps = self.days(800)
+        values = 4.0 + 2.0 * (timestamps - timestamps[0]) / analytics.DECADE
+        self.assertAlmostEqual(analytics.trend_per_decade(timestamps, values), 2.0, places=9)
+        # Under a year cannot separate trend from season
+        self.assertIsNone(analytics.trend_per_decade(timestamps[:300], values[:300]))
+
+    def test_climatology_and_anomaly(self):
+        # Two Januaries and one February; no other months observed
+        timestamps = np.array([datetime(2022, 1, 10), datetime(2023, 1, 10), datetime(2023, 2, 10)],
+                              dtype='datetime64[s]').astype(np.float64)
+        values = np.array([10.0, 14.0, 20.0])
+        climatology = analytics.monthly_climatology(timestamps, values)
+        self.assertEqual(climatology[:2].tolist(), [12.0, 20.0])
+        self.assertTrue(np.isnan(climatology[2:]).all())
+        self.assertEqual(analytics.anomalies(timestamps, values, climatology).tolist(), [-2.0, 2.0, 0.0])
+        self.assertEqual(analytics.seasonal_range(climatology), 8.0)
+
+    def test_current_value(self):
+        timestamps = self.days(30)
+        values = np.arange(30, dtype=np.float64)
+        # The last 7 days and the reading that starts them
+        self.assertEqual(analytics.current_value(timestamps, values), 25.5)
+
+    def test_count_grid_cells(self):
+        latitudes = np.array([10.2, 10.8, 11.5, np.nan, -0.5])
+        longitudes = np.array([-20.5, -20.1, -20.5, 5.0, 0.5])
+        self.assertEqual(analytics.count_grid_cells(latitudes, longitudes), 3)
+        self.assertEqual(analytics.count_grid_cells(np.array([np.nan]), np.array([1.0])), 0)
+
+
+class OceanAnalysisTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.processor = OceanDataProcessor()
+
+    def readings(self, region, parameter, start, count, value, **fields):
+        OceanData.objects.bulk_create([
+            OceanData(user=self.user, region=region, parameter=parameter, value=value(start + timedelta(days=i)),
+                      unit='', timestamp=start + timedelta(days=i), **fields)
+            for i in range(count)
+        ])
+
+    def test_temperature_trend(self):
+        start = datetime(2014, 1, 1, tzinfo=dt_timezone.utc)
+        self.readings('pacific', 'temperature', start, 3652,
+                      lambda at: 15 + 0.3 * (at - start).total_seconds() / analytics.DECADE)
+        data = self.processor._analyze_temperature_data('', 'Pacific')['data']
+        # The climatology absorbs a sliver of the trend over a finite record
+        self.assertAlmostEqual(data['trend_per_decade'], 0.3, delta=0.01)
+        self.assertEqual(data['trend'], 'increasing')
+        self.assertEqual(data['observations'], 3652)
+
+    def test_temperature_anomaly_and_current_value(self):
+        # A month-by-month seasonal cycle, 1.5° warmer in the last December
+        self.readings('atlantic', 'temperature', datetime(2022, 1, 1, tzinfo=dt_timezone.utc), 730,
+                      lambda at: 10 + at.month + (1.5 if (at.year, at.month) == (2023, 12) else 0))
+        data = self.processor._analyze_temperature_data('', 'Atlantic')['data']
+        self.assertEqual(data['current_temp'], 23.5)
+        # December climatology is the mean of 22 and 23.5
+        self.assertEqual(data['anomaly'], 0.75)
+
+    def test_short_record_has_no_trend(self):
+        self.readings('indian', 'temperature', datetime(2024, 1, 1, tzinfo=dt_timezone.utc), 90, lambda at: 20)
+        result = self.processor._analyze_temperature_data('', 'Indian')
+        self.assertIsNone(result['data']['trend_per_decade'])
+        self.assertEqual(result['data']['trend'], 'undetermined')
+        self.assertEqual(result['data']['anomaly'], 0.0)
+
+    def test_hypoxic_zones(self):
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        self.readings('pacific', 'dissolved_oxygen', start, 60, lambda at: 6.0, latitude=40.5, longitude=-130.5)
+        latest = start + timedelta(days=59)
+        for days_ago, value, latitude, longitude in (
+            (1, 1.5, 10.2, -20.5),    # hypoxic
+            (2, 1.0, 10.8, -20.1),    # hypoxic, same cell
+            (3, 1.9, -5.5, 100.5),    # hypoxic, second cell
+            (4, 3.0, 30.5, 30.5),     # not hypoxic
+            (45, 1.0, 50.5, 50.5),    # hypoxic, but over a month old
+        ):
+            OceanData.objects.create(user=self.user, region='pacific', parameter='dissolved_oxygen', value=value,
+                                     unit='', timestamp=latest - timedelta(days=days_ago),
+                                     latitude=latitude, longitude=longitude)
+        self.assertEqual(self.processor._analyze_oxygen_data('', 'Pacific')['data']['hypoxic_zones'], 2)
+
+    def test_no_data(self):
+        self.readings('pacific', 'temperature', datetime(2024, 1, 1, tzinfo=dt_timezone.utc), 10, lambda at: 20)
+        for analyze in (self.processor._analyze_temperature_data, self.processor._analyze_salinity_data,
+                        self.processor._analyze_ph_data, self.processor._analyze_oxygen_data,
+                        self.processor._analyze_ecosystem_data):
+            result = analyze('', 'Arctic')
+            self.assertFalse(result['has_data'], analyze.__name__)
+            self.assertNotIn('data', result)
+        self.assertFalse(self.processor._analyze_salinity_data('', 'Pacific')['has_data'])
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+
+    def record(self, **fields):
+        return dict({'region': 'Pacific Ocean', 'parameter': 'temp', 'value': '68', 'unit': 'F',
+                     'timestamp': '2024-03-01T12:00:00Z', 'latitude': '10.5', 'longitude': '-20'}, **fields)
+
+    def test_normalized(self):
+        row = normalize_record(self.record())
+        self.assertEqual((row['region'], row['parameter'], row['unit']), ('pacific', 'temperature', '°C'))
+        self.assertAlmostEqual(row['value'], 20.0)
+        self.assertEqual(row['timestamp'], datetime(2024, 3, 1, 12, tzinfo=dt_timezone.utc))
+
+    def test_malformed_records_rejected(self):
+        for record in [
+            self.record(timestamp='2024-13-45T00:00:00'),
+            self.record(timestamp=1e20),
+            self.record(timestamp='yesterday'),
+            self.record(value='1e400'),
+            self.record(value=None),
+            self.record(latitude='nan'),
+            self.record(region='Baltic'),
+            ['pacific', 'temperature', 20],
+            42,
+        ]:
+            with self.subTest(record=record), self.assertRaises(IngestError):
+                normalize_record(record)
+
+    def test_bad_rows_do_not_abort(self):
+        records = [self.record(), self.record(timestamp='2024-02-30T00:00:00'), 42, ['a'],
+                   {'_error': 'Invalid JSON: {'}, self.record(value='70')]
+        ingestor = OceanDataIngestor(self.user, batch_size=2)
+        stats = ingestor.ingest((record, line, line * 10) for line, record in enumerate(records, 1))
+        self.assertEqual((stats['rows_written'], stats['rows_rejected']), (2, 4))
+        self.assertEqual(OceanData.objects.count(), 2)
+
+    def test_bad_byte_rejects_only_its_line(self):
+        csv_header = b'region,parameter,value,unit,timestamp\n'
+        csv_row = b'pacific,temperature,20,C,2024-03-01T12:00:00Z\n'
+        json_row = (json.dumps(self.record()) + '\n').encode('utf-8')
+        for fmt, header, good, bad, line in (
+            ('csv', csv_header, csv_row, b'pacific,temperature,2\xff0,C,2024-03-01T13:00:00Z\n', 3),
+            ('jsonl', b'', json_row, b'{"region": "pacific\xff"}\n', 2),
+        ):
+            with self.subTest(fmt=fmt):
+                stream = io.BytesIO(header + good + bad + good)
+                records = list(iter_records(stream, fmt))
+                self.assertEqual(len(records), 3)
+                self.assertIn('Invalid UTF-8', records[1][0]['_error'])
+                self.assertEqual(records[1][1], line)
+                self.assertEqual(records[2][2], len(stream.getvalue()))
+
+                stats = OceanDataIngestor(self.user).ingest(iter(records))
+                self.assertEqual((stats['rows_written'], stats['rows_rejected']), (2, 1))
+
+    def test_strict_stops_at_bad_row(self):
+        ingestor = OceanDataIngestor(self.user, strict=True)
+        with self.assertRaisesMessage(IngestError, 'Line 2'):
+            ingestor.ingest(iter([(self.record(), 1, 10), (self.record(timestamp=-1e20), 2, 20)]))
+
+
+class ImpossibleTimestampTests(TestCase):
+    # Well-formed timestamps of days that do not exist
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.client.force_login(self.user)
+
+    def test_endpoints_reject(self):
+        for path, params in [
+            ('/data/api/readings/', {'region': 'pacific', 'parameter': 'ph', 'start': '2024-02-30T00:00:00'}),
+            ('/data/api/readings/', {'region': 'pacific', 'parameter': 'ph', 'limit': 'ten'}),
+            ('/data/api/nearby/', {'lat': 0, 'lon': 0, 'start': '2024-02-30T00:00:00'}),
+            ('/data/api/nearby/', {'lat': 0, 'lon': 0, 'end': '2024-04-31T12:00:00'}),
+            ('/data/api/export/', {'start': '2024-02-30T00:00:00'}),
+            ('/data/api/export/', {'end': '2023-13-01T00:00:00'}),
+        ]:
+            with self.subTest(path=path, params=params):
+                response = self.client.get(path, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['success'])
+
+    def test_export_command(self):
+        with self.assertRaisesMessage(CommandError, "Invalid start timestamp '2024-02-30T00:00:00'"):
+            call_command('export_ocean_data', '-', start='2024-02-30T00:00:00', stdout=io.StringIO())
+
+
+class ReadingsPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        # Pairs of readings share a timestamp, so pages must break ties on id
+        OceanData.objects.bulk_create([
+            OceanData(user=self.user, region='pacific', parameter='salinity', value=30 + i, unit='PSU',
+                      timestamp=start + timedelta(hours=i // 2))
+            for i in range(25)
+        ] + [
+            OceanData(user=self.user, region='atlantic', parameter='salinity', value=1, unit='PSU', timestamp=start),
+        ])
+        self.client.force_login(self.user)
+
+    def test_pages_cover_every_reading_once(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'region': 'Pacific', 'parameter': 'salinity', 'limit': 4}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get('/data/api/readings/', params).json()
+            seen += [row['id'] for row in data['results']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        expected = list(OceanData.objects.filter(region='pacific').order_by('-timestamp', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_window(self):
+        rows, cursor = readings_page('pacific', 'salinity', start=datetime(2024, 1, 1, 3, tzinfo=dt_timezone.utc),
+                                     end=datetime(2024, 1, 1, 5, tzinfo=dt_timezone.utc))
+        self.assertEqual(len(rows), 4)
+        self.assertIsNone(cursor)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/data/api/readings/', {'region': 'pacific', 'parameter': 'salinity',
+                                                           'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+    def add(self, hours, value=1.0):
+        OceanData.objects.bulk_create([
+            OceanData(user=self.user, region='pacific', parameter='ph', value=value + i % 3, unit='pH',
+                      timestamp=self.start + timedelta(minutes=20 * i))
+            for i in range(hours * 3)
+        ])
+
+    def rollup(self, resolution):
+        return list(OceanDataRollup.objects.filter(resolution=resolution)
+                    .values_list('bucket_start', 'count', 'total', 'minimum', 'maximum'))
+
+    def test_hourly_and_daily(self):
+        self.add(30)
+        refresh_rollups()
+        hours = self.rollup('hour')
+        self.assertEqual(len(hours), 30)
+        self.assertEqual(hours[0], (self.start, 3, 6.0, 1.0, 3.0))
+        days = self.rollup('day')
+        self.assertEqual([(day[0].day, day[1]) for day in days], [(1, 72), (2, 18)])
+
+    def test_incremental_refresh(self):
+        self.add(2)
+        refresh_rollups()
+        self.assertEqual(refresh_rollups(), 0)
+        OceanData.objects.create(user=self.user, region='pacific', parameter='ph', value=10, unit='pH',
+                                 timestamp=self.start + timedelta(minutes=5))
+        # Only the touched hour and its day
+        self.assertEqual(refresh_rollups(), 2)
+        self.assertEqual(self.rollup('hour')[0][1:], (4, 16.0, 1.0, 10.0))
+
+    def test_touched_buckets_distinct(self):
+        self.add(2)
+        with CaptureQueriesContext(connection) as queries:
+            refresh_rollups()
+        distinct = [query['sql'] for query in queries if 'DISTINCT' in query['sql']]
+        self.assertEqual(len(distinct), 1)
+        self.assertNotIn('ORDER BY', distinct[0])
+
+    def test_served_from_rollups(self):
+        self.add(48)
+        refresh_rollups()
+        end = self.start + timedelta(days=2)
+        from_rollups = aggregate_series('pacific', 'ph', self.start, end, 6 * 3600)
+        raw = aggregate_series('pacific', 'ph', self.start, end, 1200 * 3)
+        self.assertEqual(from_rollups['source'], 'hour')
+        self.assertEqual(len(from_rollups['buckets']), 8)
+        self.assertEqual(from_rollups['buckets'][0]['mean'], 2.0)
+        self.assertEqual(raw['source'], 'hour')
+        self.assertEqual(aggregate_series('pacific', 'ph', self.start, end, 1200)['source'], 'raw')
+
+
+class SeriesCacheTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.cache = SeriesCache(self.root)
+
+    def populate(self, timestamps, max_id):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.cache.populate('pacific', 'ph', lambda: (timestamps, timestamps * 10, max_id))
+
+    def test_cold_pair_misses(self):
+        self.assertIsNone(self.cache.read('pacific', 'ph'))
+        self.assertFalse(self.cache.append_segment('pacific', 'ph', 'b1', np.array([1]), np.array([1.0]),
+                                                   np.array([1.0])))
+        self.assertFalse(self.cache.is_warm('pacific', 'ph'))
+
+    def test_window_is_memmapped(self):
+        self.populate([3, 1, 2, 5], max_id=4)
+        timestamps, values = self.cache.read('pacific', 'ph', start=2, end=5)
+        self.assertEqual(timestamps.tolist(), [2, 3])
+        self.assertEqual(values.tolist(), [20, 30])
+        self.assertIsInstance(timestamps.base, np.memmap)
+
+    def test_append_skips_covered_rows(self):
+        self.populate([1, 2], max_id=2)
+        self.cache.append_segment('pacific', 'ph', 'b1', np.array([2, 3]), np.array([2.0, 0.5]),
+                                  np.array([99.0, 5.0]))
+        timestamps, values = self.cache.read('pacific', 'ph')
+        self.assertEqual(timestamps.tolist(), [0.5, 1, 2])
+        self.assertEqual(values.tolist(), [5, 10, 20])
+        self.cache.drop_segment('pacific', 'ph', 'b1')
+        self.assertEqual(self.cache.read('pacific', 'ph')[0].tolist(), [1, 2])
+
+    def test_compacts_many_segments(self):
+        self.populate([0], max_id=0)
+        for i in range(1, MAX_SEGMENTS + 1):
+            self.cache.append_segment('pacific', 'ph', f'b{i}', np.array([i]), np.array([float(i)]),
+                                      np.array([1.0]))
+        pair_dir = os.path.join(self.root, 'pacific', 'ph')
+        self.assertEqual(len([f for f in os.listdir(pair_dir) if f.endswith('.ts.npy')]), 1)
+        self.assertEqual(self.cache.read('pacific', 'ph')[0].tolist(), list(range(MAX_SEGMENTS + 1)))
+
+    def test_invalidate(self):
+        self.populate([1, 2], max_id=2)
+        self.cache.invalidate('pacific', 'ph')
+        self.assertIsNone(self.cache.read('pacific', 'ph'))
+        self.assertEqual(os.listdir(os.path.join(self.root, 'pacific')), [])
+        self.cache.invalidate('pacific', 'ph')
+        self.populate([4], max_id=3)
+        self.assertEqual(self.cache.read('pacific', 'ph')[0].tolist(), [4])
+
+    def test_invalidate_while_locked(self):
+        # A writer that was waiting on the old directory's lock relocks the
+        # new directory instead of writing into the removed one
+        self.populate([1], max_id=1)
+        with mock.patch('data.series_cache.fcntl.flock') as flock:
+            def invalidate_first(lock, op):
+                if op == fcntl.LOCK_EX and flock.call_count == 1:
+                    pair_dir = os.path.join(self.root, 'pacific', 'ph')
+                    os.rename(pair_dir, pair_dir + '.stale')
+            flock.side_effect = invalidate_first
+            self.populate([7], max_id=2)
+        self.assertEqual(self.cache.read('pacific', 'ph')[0].tolist(), [7])
+
+
+class SpatialTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.client.force_login(self.user)
+        now = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        # Stations 0, 11, 22, 33 and 556 km east of the origin, and one by the antimeridian
+        for i, longitude in enumerate([0.0, 0.1, 0.2, 0.3, 5.0]):
+            OceanData.objects.create(user=self.user, region='atlantic', parameter='temperature', value=i,
+                                     unit='C', timestamp=now, latitude=0.0, longitude=longitude, depth=10)
+        OceanData.objects.create(user=self.user, region='pacific', parameter='temperature', value=9,
+                                 unit='C', timestamp=now, latitude=0.0, longitude=179.95)
+
+    def test_bounding_box_crosses_antimeridian(self):
+        min_lat, max_lat, lon_ranges = spatial.bounding_box(0.0, -179.9, 50)
+        self.assertEqual(len(lon_ranges), 2)
+        self.assertEqual(lon_ranges[1][0], -180.0)
+        self.assertGreater(lon_ranges[0][0], 179)
+        self.assertEqual(spatial.bounding_box(89.9, 0.0, 50)[2], [(-180.0, 180.0)])
+
+    def test_readings_within(self):
+        rows, total = spatial.readings_within(OceanData.objects.all(), 0.0, 0.05, 20)
+        self.assertEqual(total, 3)
+        self.assertEqual([row['value'] for row in rows], [0, 1, 2])
+        self.assertEqual(rows[0]['distance_km'], rows[1]['distance_km'])
+        rows, _ = spatial.readings_within(OceanData.objects.all(), 0.0, -179.95, 20)
+        self.assertEqual([row['value'] for row in rows], [9])
+
+    def test_readings_within_loads_only_the_limit(self):
+        with CaptureQueriesContext(connection) as queries:
+            rows, total = spatial.readings_within(OceanData.objects.all(), 0.0, 0.0, 100, limit=2)
+        self.assertEqual((len(rows), total), (2, 4))
+        self.assertEqual([row['value'] for row in rows], [0, 1])
+        self.assertIn('"data_oceandata"."id" IN (', queries[-1]['sql'])
+
+    def test_nearby_view(self):
+        response = self.client.get('/data/api/nearby/', {'lat': 0, 'lon': 0, 'radius_km': 100, 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 4)
+        self.assertEqual([row['value'] for row in response.json()['results']], [0])
+
+    def test_rejects_non_finite_parameters(self):
+        for params in ({'lat': 'nan', 'lon': 0}, {'lat': 0, 'lon': 0, 'radius_km': 'nan'},
+                       {'lat': 0, 'lon': 'inf'}, {'lat': 0, 'lon': 0, 'limit': 'inf'}):
+            response = self.client.get('/data/api/nearby/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_nearest_station(self):
+        response = self.client.get('/data/api/nearest-station/', {'lat': 0, 'lon': 4.9, 'limit': 2})
+        stations = response.json()['results']
+        self.assertEqual([station['longitude'] for station in stations], [5.0, 0.3])
+        self.assertEqual(stations[0]['readings'], 1)
+
+
+class DownsamplingTests(SimpleTestCase):
+    def setUp(self):
+        self.timestamps = np.arange(1000, dtype=np.float64)
+        self.values = np.sin(self.timestamps / 50)
+        self.values[437] = 5.0
+        self.values[802] = -5.0
+
+    def test_short_series_pass_through(self):
+        head_ts, head_values = self.timestamps[:10], self.values[:10]
+        timestamps, values = downsample(head_ts, head_values, 20)
+        self.assertIs(timestamps, head_ts)
+        self.assertIs(values, head_values)
+        with self.assertRaises(ValueError):
+            downsample(self.timestamps, self.values, 100, 'median')
+
+    def test_lttb(self):
+        timestamps, values = downsample(self.timestamps, self.values, 100, 'lttb')
+        self.assertEqual(timestamps.size, 100)
+        self.assertEqual((timestamps[0], timestamps[-1]), (0, 999))
+        self.assertTrue(np.all(np.diff(timestamps) > 0))
+        self.assertIn(437, timestamps)
+        self.assertIn(802, timestamps)
+
+    def test_minmax(self):
+        timestamps, values = downsample(self.timestamps, self.values, 100, 'minmax')
+        self.assertLessEqual(timestamps.size, 102)
+        self.assertEqual((timestamps[0], timestamps[-1]), (0, 999))
+        self.assertTrue(np.all(np.diff(timestamps) > 0))
+        self.assertEqual((values.max(), values.min()), (5.0, -5.0))
+        # Each of the 50 buckets of 20 points keeps its own extremes
+        first = self.values[:20]
+        self.assertIn(first.min(), values)
+        self.assertIn(first.max(), values)
+
+
+class VisualizationCacheTests(TestCase):
+    def test_hit_skips_loading(self):
+        timestamps = np.arange(0, 40 * 86400, 3600, dtype=np.float64)
+        series = (timestamps, np.cos(timestamps))
+        processor = OceanDataProcessor()
+        with mock.patch('data.data_sources.load_series', return_value=series) as load:
+            first = processor._downsampled_series('Pacific', 'temperature', 30, 200, 'lttb')
+            self.assertEqual(processor._downsampled_series('Pacific', 'temperature', 30, 200, 'lttb'), first)
+            self.assertEqual(load.call_count, 1)
+            bump_versions([('pacific', 'temperature')])
+            processor._downsampled_series('Pacific', 'temperature', 30, 200, 'lttb')
+            self.assertEqual(load.call_count, 2)
+        self.assertEqual(first['original_points'], 30 * 24 + 1)
+        self.assertEqual(len(first['points']), 200)
+
+
+class KeywordMatcherTests(SimpleTestCase):
+    def test_whole_words_and_plurals(self):
+        matches = ocean_matcher.match('Graph the Temps and SALINITY of the pacific-ocean')
+        self.assertEqual(matches['parameter'], ('temperature', 'salinity'))
+        self.assertEqual(matches['region'], ('Pacific',))
+        self.assertEqual(ocean_matcher.match('a graph of phosphate')['parameter'], ())
+
+    def test_labels_in_table_order(self):
+        matches = ocean_matcher.match('oxygen, then ph, then sst')
+        self.assertEqual(matches['parameter'], ('temperature', 'ph', 'dissolved_oxygen'))
+
+    def test_phrases_and_exact_labels(self):
+        matcher = KeywordMatcher({
+            'intent': [('greeting', ['hi', 'good morning']), ('chart', ['line chart'])],
+        }, exact={'greeting'})
+        self.assertEqual(matcher.match('Good  morning!')['intent'], ('greeting',))
+        self.assertEqual(matcher.match('a good day, morning')['intent'], ())
+        self.assertEqual(matcher.match('two line charts')['intent'], ('chart',))
+        self.assertEqual(matcher.match('his data')['intent'], ())
+        self.assertEqual(KeywordMatcher(OCEAN_KEYWORDS).match('salts')['parameter'], ('salinity',))
+
+
+class AnalysisCacheVersionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sailor', password='secret')
+        self.computed = []
+
+    def analysis(self, region, parameter='temperature'):
+        def compute():
+            self.computed.append((region, parameter))
+            return {'n': len(self.computed)}
+        return cached_analysis('trend', [region], region, [parameter], compute)
+
+    def ingest(self, region):
+        record = {'region': region, 'parameter': 'temperature', 'value': '20', 'unit': 'C',
+                  'timestamp': '2024-03-01T12:00:00Z'}
+        with self.captureOnCommitCallbacks(execute=True):
+            OceanDataIngestor(self.user).ingest([(record, 1, 10)])
+
+    def test_hit_until_ingest(self):
+        self.assertEqual(self.analysis('pacific'), self.analysis('pacific'))
+        self.assertEqual(len(self.computed), 1)
+        self.ingest('pacific')
+        self.analysis('pacific')
+        self.assertEqual(len(self.computed), 2)
+
+    def test_ingest_invalidates_its_region_and_global(self):
+        for region in ('pacific', 'atlantic', None):
+            self.analysis(region)
+        self.analysis('pacific', 'salinity')
+        self.ingest('pacific')
+        for region in ('pacific', 'atlantic', None):
+            self.analysis(region)
+        self.analysis('pacific', 'salinity')
+        self.assertEqual(self.computed[4:], [('pacific', 'temperature'), (None, 'temperature')])
+
+    def test_row_changes_invalidate_after_commit(self):
+        self.analysis('pacific')
+        with self.captureOnCommitCallbacks(execute=True):
+            row = OceanData.objects.create(user=self.user, region='pacific', parameter='temperature', value=1,
+                                           unit='C', timestamp=datetime(2024, 1, 1, tzinfo=dt_timezone.utc))
+            self.analysis('pacific')
+            self.assertEqual(len(self.computed), 1)
+        self.analysis('pacific')
+        with self.captureOnCommitCallbacks(execute=True):
+            row.delete()
+        self.analysis('pacific')
+        self.assertEqual(len(self.computed), 3)
+
+    def test_evicted_version_does_not_revive_entries(self):
+        self.analysis('pacific')
+        get_analysis_cache().delete('ocean-data-version:pacific:temperature')
+        self.analysis('pacific')
+        self.assertEqual(len(self.computed), 2)
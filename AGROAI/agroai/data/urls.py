@@ -3,4 +3,11 @@ from . import views
 
 urlpatterns = [
     path('ocean/', views.ocean_data_dashboard, name='ocean_data_dashboard'),
-]
\ No newline at end of file
+    path('api/readings/', views.ocean_readings, name='ocean_readings'),
+    path('api/nearby/', views.ocean_nearby, name='ocean_nearby'),
+    path('api/nearest-station/', views.ocean_nearest_station, name='ocean_nearest_station'),
+    path('api/export/', views.ocean_export, name='ocean_export'),
+    path('api/dashboard/summary/', views.dashboard_summary, name='dashboard_summary'),
+    path('api/dashboard/series/', views.dashboard_series, name='dashboard_series'),
+    path('api/dashboard/heatmap/', views.dashboard_heatmap, name='dashboard_heatmap'),
+]
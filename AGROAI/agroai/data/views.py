@@ -1,6 +1,255 @@
+from django.conf import settings
 from django.shortcuts import render
+from django.http import JsonResponse, StreamingHttpResponse
+from django.contrib.auth import SESSION_KEY
 from django.contrib.auth.decorators import login_required
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition, require_GET
+from asgiref.sync import sync_to_async
+import hashlib
+import math
+from .models import OceanData
+from .queries import DEFAULT_PAGE_SIZE, InvalidQuery, parse_time, readings_page
+from . import dashboard, export, spatial
 
 @login_required
 def ocean_data_dashboard(request):
-    return render(request, 'data/dashboard.html')
\ No newline at end of file
+    return render(request, 'data/dashboard.html')
+
+@login_required
+@require_GET
+def ocean_readings(request):
+    region = request.GET.get('region')
+    parameter = request.GET.get('parameter')
+    if not region or not parameter:
+        return JsonResponse({'success': False, 'error': 'Missing region or parameter'}, status=400)
+
+    try:
+        limit = _int_param(request, 'limit')
+        rows, next_cursor = readings_page(
+            region.lower(),
+            parameter.lower(),
+            start=parse_time(request.GET.get('start'), 'start'),
+            end=parse_time(request.GET.get('end'), 'end'),
+            cursor=request.GET.get('cursor'),
+            limit=DEFAULT_PAGE_SIZE if limit is None else limit,
+        )
+    except InvalidQuery as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'results': rows,
+        'next_cursor': next_cursor,
+    })
+
+def _float_param(request, name, default=None, low=None, high=None, required=False):
+    raw = request.GET.get(name)
+    if raw in (None, ''):
+        if required:
+            raise InvalidQuery(f"Missing {name}")
+        return default
+    try:
+        value = float(raw)
+    except ValueError:
+        raise InvalidQuery(f"Invalid {name} '{raw}'")
+    if not math.isfinite(value):
+        raise InvalidQuery(f"Invalid {name} '{raw}'")
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise InvalidQuery(f"{name} out of range")
+    return value
+
+def _location_params(request):
+    # Point, depth band and parameter shared by the spatial endpoints
+    latitude = _float_param(request, 'lat', low=-90, high=90, required=True)
+    longitude = _float_param(request, 'lon', low=-180, high=180, required=True)
+    queryset = spatial.filter_depth(
+        OceanData.objects.all(),
+        _float_param(request, 'min_depth', low=0),
+        _float_param(request, 'max_depth', low=0),
+    )
+    if request.GET.get('parameter'):
+        queryset = queryset.filter(parameter=request.GET['parameter'].lower())
+    return queryset, latitude, longitude
+
+@login_required
+@require_GET
+def ocean_nearby(request):
+    try:
+        queryset, latitude, longitude = _location_params(request)
+        radius_km = _float_param(request, 'radius_km', 50, low=0.001, high=2000)
+        limit = int(_float_param(request, 'limit', DEFAULT_PAGE_SIZE, low=1, high=1000))
+        start = parse_time(request.GET.get('start'), 'start')
+        end = parse_time(request.GET.get('end'), 'end')
+    except InvalidQuery as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    if start:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end:
+        queryset = queryset.filter(timestamp__lt=end)
+    rows, count = spatial.readings_within(
+        queryset, latitude, longitude, radius_km,
+        fields=('id', 'region', 'parameter', 'timestamp', 'value', 'unit', 'depth'),
+        limit=limit,
+    )
+    return JsonResponse({
+        'success': True,
+        'count': count,
+        'results': rows,
+    })
+
+@login_required
+@require_GET
+def ocean_nearest_station(request):
+    try:
+        queryset, latitude, longitude = _location_params(request)
+        limit = int(_float_param(request, 'limit', 1, low=1, high=100))
+    except InvalidQuery as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'results': spatial.nearest_stations(queryset, latitude, longitude, limit=limit),
+    })
+
+def _int_param(request, name):
+    raw = request.GET.get(name)
+    if raw in (None, ''):
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        raise InvalidQuery(f"Invalid {name} '{raw}'")
+
+async def _aiter_chunks(chunks):
+    # Under ASGI Django buffers a synchronous iterator whole before sending
+    # it, so each chunk is pulled on the request's thread instead
+    pull = sync_to_async(next)
+    while True:
+        chunk = await pull(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+@login_required
+@require_GET
+def ocean_export(request):
+    # Streams OceanData in id order as csv, ndjson or columnar (see
+    # data.export), optionally gzipped. X-Export-Until carries the id the
+    # export ends at; resume with after=<last id received>&until=<it>.
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in export.FORMATS:
+        return JsonResponse({'success': False, 'error': f"Unknown format '{export_format}'"}, status=400)
+    try:
+        queryset, after, until = export.export_range(
+            region=request.GET.get('region'),
+            parameter=request.GET.get('parameter'),
+            start=parse_time(request.GET.get('start'), 'start'),
+            end=parse_time(request.GET.get('end'), 'end'),
+            after=_int_param(request, 'after'),
+            until=_int_param(request, 'until'),
+        )
+    except InvalidQuery as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    gzip = request.GET.get('compress') == 'gzip'
+    chunks = export.export_chunks(export_format, export.export_batches(queryset, after, until), gzip=gzip)
+    content_type, extension = export.FORMATS[export_format]
+    if gzip:
+        content_type, extension = 'application/gzip', f'{extension}.gz'
+    if hasattr(request, 'scope'):
+        chunks = _aiter_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="ocean-data-{after + 1}-{until}.{extension}"'
+    response['X-Export-After'] = str(after)
+    response['X-Export-Until'] = str(until)
+    return response
+
+def _dashboard_version(request):
+    # Session and default cache only, so an unchanged dashboard is
+    # revalidated without a database query
+    user_id = request.session.get(SESSION_KEY)
+    if user_id is None:
+        return None
+    return user_id, dashboard.tiles_version()
+
+def _dashboard_etag(request):
+    version = _dashboard_version(request)
+    if version is None:
+        return None
+    user_id, (token, _) = version
+    # Tags are per user and query, so one user's tag never validates
+    # another's response. Only the caching is per user: every user is
+    # served the same tiles.
+    scope = hashlib.sha1(f'{user_id}:{request.path}?{request.GET.urlencode()}'.encode('utf-8')).hexdigest()[:12]
+    return f'{token}-{scope}'
+
+def _dashboard_modified(request):
+    version = _dashboard_version(request)
+    if version is None:
+        return None
+    return version[1][1]
+
+def _dashboard_period(request):
+    period = request.GET.get('period', dashboard.DEFAULT_PERIOD)
+    if period not in dashboard.PERIODS:
+        raise InvalidQuery(f"Unknown period '{period}'")
+    return period
+
+def _dashboard_response(data):
+    response = JsonResponse(dict(data, success=True))
+    # Private, so shared caches never serve it to a logged-out client; the
+    # data in it is the same for every user
+    patch_cache_control(response, private=True, max_age=getattr(settings, 'DASHBOARD_MAX_AGE', 60))
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+# The dashboard endpoints read precomputed DashboardTiles (data.dashboard):
+# one query each whatever the amount of data, none for a 304. Tiles are
+# global, built from every user's readings like the rest of the ocean data
+# API; login is required to see them, but their contents do not depend on
+# who asks.
+# condition() goes outside login_required so that 304s skip the user lookup.
+@condition(etag_func=_dashboard_etag, last_modified_func=_dashboard_modified)
+@login_required
+@require_GET
+def dashboard_summary(request):
+    try:
+        period = _dashboard_period(request)
+    except InvalidQuery as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    return _dashboard_response({'period': period, 'cards': dashboard.summary_cards(period)})
+
+@condition(etag_func=_dashboard_etag, last_modified_func=_dashboard_modified)
+@login_required
+@require_GET
+def dashboard_series(request):
+    parameter = request.GET.get('parameter')
+    if not parameter:
+        return JsonResponse({'success': False, 'error': 'Missing parameter'}, status=400)
+    try:
+        period = _dashboard_period(request)
+    except InvalidQuery as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    regions = [region.lower() for region in request.GET.getlist('region') if region]
+    return _dashboard_response({
+        'period': period,
+        'parameter': parameter.lower(),
+        'columns': ['bucket_start', 'count', 'mean', 'min', 'max'],
+        'results': dashboard.series_tiles(period, parameter.lower(), regions),
+    })
+
+@condition(etag_func=_dashboard_etag, last_modified_func=_dashboard_modified)
+@login_required
+@require_GET
+def dashboard_heatmap(request):
+    parameter = request.GET.get('parameter')
+    if not parameter:
+        return JsonResponse({'success': False, 'error': 'Missing parameter'}, status=400)
+    try:
+        period = _dashboard_period(request)
+    except InvalidQuery as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    return _dashboard_response(dict(dashboard.heatmap(period, parameter.lower()),
+                                    period=period, parameter=parameter.lower()))